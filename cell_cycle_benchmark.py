@@ -0,0 +1,322 @@
+"""Benchmarks of the cell cycle pipeline, phase by phase.
+
+Each scenario is a fixed workload split into phases; every phase records
+wall time, CPU time (this process and finished pool workers), peak resident
+set size so far (this process and its largest child) and the size of its
+workload. Phases that integrate the ODEs also record the solver counters
+summed over their runs (cell_cycle_integrate.STAT_COUNTERS: steps,
+rejected steps, RHS and Jacobian evaluations, LU factorizations).
+Scenarios:
+
+- five_level_sweep: model declaration, generate_equations (BioNetGen, or
+  the network cache unless --cold), building or loading the OdeSystem
+  (whose lambdify functions every sweep below evaluates; also cached
+  unless --cold), the damage sweep of run_cell_cycle.py into a trajectory
+  store, and plotting; with --codegen also generating and compiling the
+  RHS/Jacobian code of cell_cycle_codegen, which the pipeline itself does
+  not use
+- dds_sweep_1000: 1000 DDS_0 levels in [0, 0.02], streamed to a store
+- sensitivity_100: one Morris trajectory over 100 parameters (k + 1 fate
+  classifications): the shared_k* rate constants, topped up with the other
+  positive non-initial-condition parameters in model order, since the model
+  has fewer than 100 shared_k* constants
+- stochastic_ensemble: 100 tau-leaping trajectories classified by fate (no
+  ODE solver counters)
+
+Both sweeps go through cell_cycle_sweep.sweep_dna_damage(), the path
+run_cell_cycle.py takes, with the OdeSystem built during setup (the sweep
+would otherwise build the same one again).
+
+--quick shrinks every workload for smoke tests; results of quick and full
+runs are not compared with each other. With --baseline, phases whose wall
+time grew by more than --tolerance are reported and the exit status is 1.
+
+Usage: python cell_cycle_benchmark.py [--scenarios NAMES] [--output FILE]
+       [--baseline FILE] [--tolerance FRACTION] [--processes N] [--quick] [--cold]
+       [--codegen]
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+import scipy
+
+from cell_cycle_builder import ModelSpec, build_model
+from cell_cycle_cache import atomic_write, cached_generate_equations
+from cell_cycle_codegen import CompiledSystem
+from cell_cycle_fate import DEFAULT_THRESHOLDS
+from cell_cycle_odes import OdeSystem
+from cell_cycle_plots import APC_OBSERVABLES, PROTEIN_OBSERVABLES, damage_figures, render_figures
+from cell_cycle_sensitivity import (DEFAULT_OUTPUTS, MorrisAnalysis, default_bounds,
+                                    rate_constants, run_sensitivity)
+from cell_cycle_stochastic import run_ensemble
+from cell_cycle_store import TrajectoryWriter
+from cell_cycle_sweep import DAMAGE_PARAMETER, sweep_dna_damage
+
+TSPAN = np.linspace(0, 6000, 600)
+DAMAGE_LEVELS = [(0.0, "No", 0), (0.002, "Low", 0), (0.004, "Medium", 0),
+                 (0.008, "High", 'upper left'), (0.016, "Extreme", 'upper left')]
+SENSITIVITY_PARAMETERS = 100
+
+
+def _peak_rss_kb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss  # bytes on macOS
+
+
+def _cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+class Phase(object):
+    """Context manager measuring one phase; counters can be added to the
+    record it returns"""
+
+    def __init__(self, records, name):
+        self.record = OrderedDict(name=name)
+        records.append(self.record)
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._cpu = _cpu_time()
+        return self.record
+
+    def __exit__(self, *exc_info):
+        cpu = _cpu_time()
+        self.record['wall_time'] = time.time() - self._wall
+        self.record['cpu_time'] = cpu[0] - self._cpu[0]
+        self.record['children_cpu_time'] = cpu[1] - self._cpu[1]
+        self.record['peak_rss_kb'] = _peak_rss_kb(resource.RUSAGE_SELF)
+        self.record['children_peak_rss_kb'] = _peak_rss_kb(resource.RUSAGE_CHILDREN)
+        return False
+
+
+class _Context(object):
+    """Model and OdeSystem shared by the scenarios of one run, built (and
+    measured) by whichever scenario needs them first"""
+
+    def __init__(self, processes, quick, cold, codegen=False):
+        self.processes = processes
+        self.quick = quick
+        self.cold = cold
+        self.codegen = codegen
+        self.model = None
+        self.system = None
+        self.tspan = TSPAN[:60] if quick else TSPAN
+
+    def setup(self, records):
+        if self.system is not None:
+            return
+        with Phase(records, 'model_declaration'):
+            self.model = build_model(ModelSpec())
+        cache_dir = tempfile.mkdtemp() if self.cold else None
+        try:
+            with Phase(records, 'generate_equations') as record:
+                record['cache_hit'] = cached_generate_equations(self.model, cache_dir=cache_dir)
+                record['n_species'] = len(self.model.species)
+                record['n_reactions'] = len(self.model.reactions)
+            with Phase(records, 'ode_system') as record:
+                self.system = OdeSystem.from_model(self.model, cache_dir)
+                record['jac_nnz'] = self.system.jac_nnz
+        finally:
+            if cache_dir is not None:
+                shutil.rmtree(cache_dir)
+        if not self.codegen:
+            return
+        cache_dir = tempfile.mkdtemp() if self.cold else None
+        try:
+            with Phase(records, 'rhs_codegen') as record:
+                compiled = CompiledSystem(self.system, cache_dir=cache_dir)
+                y, p = self.system.initial_values(), self.system.parameters
+                compiled.rhs(y, p)
+                compiled.jacobian(y, p)
+                record['backend'] = compiled.backend
+        finally:
+            if cache_dir is not None:
+                shutil.rmtree(cache_dir)
+
+    def sweep(self, records, name, levels, store, metadata=None):
+        """Phase `name`: the damage sweep over `levels` into a new
+        trajectory store at `store`, as run_cell_cycle.py runs it"""
+        with Phase(records, name) as record:
+            record['n_simulations'] = len(levels)
+            with TrajectoryWriter(store, self.tspan, PROTEIN_OBSERVABLES + APC_OBSERVABLES,
+                                  metadata=metadata) as writer:
+                sweep_dna_damage(self.system, self.tspan, levels, processes=self.processes,
+                                 writer=writer, stats=record)
+
+
+def five_level_sweep(context, records):
+    context.setup(records)
+    outdir = tempfile.mkdtemp()
+    try:
+        store = os.path.join(outdir, 'store')
+        context.sweep(records, 'integrate_levels', [level for level, _, _ in DAMAGE_LEVELS],
+                      store, {'damage_levels': DAMAGE_LEVELS})
+        with Phase(records, 'plotting') as record:
+            record['figures'] = len(render_figures(store, damage_figures(DAMAGE_LEVELS), outdir,
+                                                   processes=context.processes, force=True))
+    finally:
+        shutil.rmtree(outdir)
+
+
+def dds_sweep_1000(context, records):
+    context.setup(records)
+    levels = np.linspace(0, 0.02, 20 if context.quick else 1000)
+    outdir = tempfile.mkdtemp()
+    try:
+        context.sweep(records, 'integrate_sweep', levels, os.path.join(outdir, 'store'))
+    finally:
+        shutil.rmtree(outdir)
+
+
+def sensitivity_parameters(system, n):
+    """The first n of: the shared_k* rate constants, then the other positive
+    parameters that are neither initial conditions nor DDS_0"""
+    names = rate_constants(system)
+    ic = set(system.parameter_names[k] for k in system.ic_parameters)
+    names += [name for name, value in zip(system.parameter_names, system.parameters)
+              if value > 0 and name not in ic and name not in names and name != DAMAGE_PARAMETER]
+    return names[:n]
+
+
+def sensitivity_100(context, records):
+    context.setup(records)
+    names = sensitivity_parameters(context.system, 10 if context.quick
+                                   else SENSITIVITY_PARAMETERS)
+    analysis = MorrisAnalysis(names, default_bounds(context.system, names), 1, 0,
+                              [name for name, _ in DEFAULT_OUTPUTS])
+    with Phase(records, 'classify_batch') as record:
+        record['n_parameters'] = len(names)
+        record['n_simulations'] = len(names) + 1
+        run_sensitivity(context.system, context.tspan, analysis, processes=context.processes,
+                        stats=record)
+
+
+def stochastic_ensemble(context, records):
+    context.setup(records)
+    thresholds = dict(DEFAULT_THRESHOLDS, arrest_time=context.tspan[-1] / 2)
+    with Phase(records, 'ensemble') as record:
+        record['n_simulations'] = 8 if context.quick else 100
+        result = run_ensemble(context.system, context.tspan, record['n_simulations'],
+                              processes=context.processes, observables=(),
+                              thresholds=thresholds)
+        record['fractions'] = result.fractions
+
+
+SCENARIOS = OrderedDict([
+    ('five_level_sweep', five_level_sweep),
+    ('dds_sweep_1000', dds_sweep_1000),
+    ('sensitivity_100', sensitivity_100),
+    ('stochastic_ensemble', stochastic_ensemble),
+])
+
+
+def _environment():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        commit = commit.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return OrderedDict([('commit', commit), ('python', platform.python_version()),
+                        ('numpy', np.__version__), ('scipy', scipy.__version__),
+                        ('platform', platform.platform()), ('cpus', multiprocessing.cpu_count())])
+
+
+def run_benchmarks(names=None, processes=None, quick=False, cold=False, codegen=False):
+    """Run the named scenarios (default: all) and return the report dict;
+    codegen=True adds the optional rhs_codegen phase"""
+    names = list(SCENARIOS) if names is None else list(names)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise ValueError("Unknown scenarios: %s" % ', '.join(sorted(unknown)))
+    context = _Context(processes, quick, cold, codegen)
+    report = OrderedDict([('timestamp', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                          ('environment', _environment()),
+                          ('config', OrderedDict([('quick', quick), ('cold', cold),
+                                                  ('codegen', codegen),
+                                                  ('processes', processes)])),
+                          ('scenarios', OrderedDict())])
+    for name in names:
+        records = []
+        start = time.time()
+        SCENARIOS[name](context, records)
+        report['scenarios'][name] = OrderedDict([('wall_time', time.time() - start),
+                                                 ('phases', records)])
+    return report
+
+
+def compare(baseline, report, tolerance=0.25, min_time=0.05):
+    """Phases of `report` whose wall time exceeds the baseline's by more
+    than `tolerance` (ignoring phases faster than min_time seconds in the
+    baseline); returns (scenario, phase, baseline time, time) tuples"""
+    if baseline['config']['quick'] != report['config']['quick']:
+        raise ValueError("Cannot compare a quick run with a full one")
+    regressions = []
+    for scenario, result in report['scenarios'].items():
+        before = baseline['scenarios'].get(scenario)
+        if before is None:
+            continue
+        times = dict((phase['name'], phase['wall_time']) for phase in before['phases'])
+        for phase in result['phases']:
+            old = times.get(phase['name'])
+            if old is not None and old >= min_time and phase['wall_time'] > old * (1 + tolerance):
+                regressions.append((scenario, phase['name'], old, phase['wall_time']))
+    return regressions
+
+
+def _json_default(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cell cycle pipeline")
+    parser.add_argument('--scenarios', help="comma-separated subset of: %s" % ', '.join(SCENARIOS))
+    parser.add_argument('--output', help="write the JSON report here (default: stdout)")
+    parser.add_argument('--baseline', help="JSON report to check for regressions against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('--cold', action='store_true', help="bypass the network cache")
+    parser.add_argument('--codegen', action='store_true',
+                        help="also time cell_cycle_codegen (not used by the pipeline)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.scenarios.split(',') if args.scenarios else None,
+                            args.processes, args.quick, args.cold, args.codegen)
+    text = json.dumps(report, indent=2, default=_json_default)
+    if args.output:
+        atomic_write(args.output, text.encode('utf-8'))
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for scenario, phase, old, new in regressions:
+            print("REGRESSION %s/%s: %.3fs -> %.3fs" % (scenario, phase, old, new),
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Adaptive sampling of fate boundaries in a two-parameter plane.
+
+Phase diagrams of fate against DDS_0 and one rate constant (shared_k61 for
+ATM_ATR -> p53, shared_k103 for p21 sequestration of CycB/CDK1, ...) on a
+uniform grid spend most simulations deep inside single-fate regions.
+fate_map() samples the final grid of (coarse * 2**levels + 1) points per
+axis as a quadtree instead:
+
+1. classify the corners of a coarse grid of cells
+2. split every cell whose corners disagree on the fate, together with
+   (neighbors=True) the cells next to it, which catches boundaries that
+   cross a cell between two corners of the same fate
+3. repeat `levels` times; each round's new corners are one parallel batch
+   of cell_cycle_fate.classify_fates()
+
+Cells that were never split get the fate of their corners. The result has
+the fate of every point of the final grid and the boundary between fates at
+that resolution, for a number of simulations that grows with the length of
+the boundary rather than the area of the plane.
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+
+from cell_cycle_fate import FATES, classify_fates
+
+FateMap = namedtuple('FateMap', ['x_name', 'y_name', 'x', 'y', 'labels', 'classes', 'sampled',
+                                 'boundary', 'n_simulations'])
+
+
+def _axis(spec, n):
+    """Grid values of an axis given as (name, low, high[, 'log'])"""
+    name, low, high = spec[:3]
+    scale = spec[3] if len(spec) > 3 else 'linear'
+    if scale == 'log':
+        return name, np.logspace(np.log10(low), np.log10(high), n)
+    if scale != 'linear':
+        raise ValueError("Unknown axis scale %r" % scale)
+    return name, np.linspace(low, high, n)
+
+
+def _corners(i, j, s):
+    return ((i, j), (i + s, j), (i, j + s), (i + s, j + s))
+
+
+def fate_map(system, tspan, x, y, coarse=(8, 8), levels=4, base=None, label=None,
+             neighbors=True, processes=None, **classify_options):
+    """Map fates over the plane of the parameters in `x` and `y`
+
+    `x` and `y` are (name, low, high) or (name, low, high, 'log'); `base`
+    holds overrides of the other parameters. `label(record)` turns a
+    FateRecord into the class compared between neighbors (default: its
+    fate). Extra keyword arguments go to classify_fates().
+
+    Returns a FateMap: `labels[i, j]` indexes `classes` for the point
+    (x[i], y[j]); `sampled` marks the points that were simulated; `boundary`
+    is an array of (x, y) midpoints between adjacent grid points of
+    different classes.
+    """
+    label = (lambda record: record.fate) if label is None else label
+    step = 2 ** levels
+    nx, ny = coarse[0] * step + 1, coarse[1] * step + 1
+    x_name, xs = _axis(x, nx)
+    y_name, ys = _axis(y, ny)
+    p_base = system.parameter_vector(base)
+    columns = system.parameter_index(x_name), system.parameter_index(y_name)
+    values = {}
+
+    def evaluate(points):
+        new = sorted(set(points) - set(values))
+        if not new:
+            return
+        p = np.tile(p_base, (len(new), 1))
+        p[:, columns[0]] = [xs[i] for i, _ in new]
+        p[:, columns[1]] = [ys[j] for _, j in new]
+        for point, record in zip(new, classify_fates(system, tspan, p, processes,
+                                                     **classify_options)):
+            values[point] = label(record)
+
+    cells = [(i * step, j * step) for i in range(coarse[0]) for j in range(coarse[1])]
+    evaluate([c for i, j in cells for c in _corners(i, j, step)])
+    leaves = []
+    s = step
+    for _ in range(levels):
+        active = set(cells)
+        mixed = set(cell for cell in cells
+                    if len(set(values[c] for c in _corners(cell[0], cell[1], s))) > 1)
+        split = set(mixed)
+        if neighbors:
+            for i, j in mixed:
+                split.update(n for n in ((i - s, j), (i + s, j), (i, j - s), (i, j + s))
+                             if n in active)
+        leaves.extend((i, j, s) for i, j in cells if (i, j) not in split)
+        h = s // 2
+        cells = [(i + di, j + dj) for i, j in sorted(split) for di in (0, h) for dj in (0, h)]
+        s = h
+        evaluate([c for i, j in cells for c in _corners(i, j, s)])
+    leaves.extend((i, j, s) for i, j in cells)
+
+    classes = [f for f in FATES if f in set(values.values())] + \
+        sorted(set(values.values()) - set(FATES))
+    code = dict((c, k) for k, c in enumerate(classes))
+    labels = np.full((nx, ny), -1, dtype=int)
+    for i, j, s in leaves:
+        corner = set(values[c] for c in _corners(i, j, s))
+        if len(corner) == 1:
+            labels[i:i + s + 1, j:j + s + 1] = code[corner.pop()]
+    sampled = np.zeros((nx, ny), dtype=bool)
+    for (i, j), value in values.items():
+        labels[i, j] = code[value]
+        sampled[i, j] = True
+
+    gx, gy = np.meshgrid(xs, ys, indexing='ij')
+    edges = []
+    for axis in (0, 1):
+        a = [slice(None), slice(None)]
+        b = [slice(None), slice(None)]
+        a[axis], b[axis] = slice(None, -1), slice(1, None)
+        a, b = tuple(a), tuple(b)
+        differ = (labels[a] != labels[b]) & (labels[a] >= 0) & (labels[b] >= 0)
+        edges.append(np.column_stack([(gx[a][differ] + gx[b][differ]) / 2,
+                                      (gy[a][differ] + gy[b][differ]) / 2]))
+    return FateMap(x_name, y_name, xs, ys, labels, tuple(classes), sampled,
+                   np.vstack(edges), len(values))
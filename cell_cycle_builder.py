@@ -0,0 +1,146 @@
+"""Declarative construction of independent cell cycle model instances.
+
+The declare_* functions of cell_cycle_shared, G1_S_v2 and G2_M_v2 rely on
+pysb's self-export: components go into whichever Model() was created last
+and alias_model_components() copies them into the declaring module's
+globals. build_model() runs those functions in the order run_cell_cycle.py
+always used, then removes every exported name and alias again, so each call
+returns a fresh Model that shares nothing with earlier ones and several
+variants can coexist in one process.
+
+A ModelSpec says which rule modules to include and which parameter values
+to override. It is a small hashable tuple, so it is what gets sent to worker
+processes; get_model() and get_system() build each spec at most once per
+process. The monomers, parameters, initial conditions, observables and
+expressions are always declared; the rule modules are
+
+- 'g2_m': G2_M_v2.declare_rules
+- 'g1_s': the G1_S_v2 pathways (signal degradation, p16/p27 inhibition,
+  CDK2 activation, Rb/E2F activation, DNA damage)
+- 'shared': cell_cycle_shared.declare_rules, coupling the two checkpoints
+
+so ModelSpec(modules=('g1_s',)) is the G1/S checkpoint on its own.
+"""
+
+import hashlib
+import importlib
+from collections import namedtuple
+
+from pysb.core import Component, Model, SelfExporter
+
+from cell_cycle_odes import OdeSystem
+
+_BASE_STEPS = (
+    ('cell_cycle_shared', 'declare_monomers'),
+    ('G2_M_v2', 'declare_parameters'),
+    ('G1_S_v2', 'declare_parameters'),
+    ('cell_cycle_shared', 'declare_parameters'),
+    ('cell_cycle_shared', 'declare_initial_conditions'),
+    ('cell_cycle_shared', 'declare_observables'),
+    ('G2_M_v2', 'declare_functions'),
+)
+
+_MODULE_STEPS = (
+    ('g2_m', (('G2_M_v2', 'declare_rules'),)),
+    ('g1_s', (('G1_S_v2', 'simulate_signal_degradation'),
+              ('G1_S_v2', 'p16_p27_inhibition'),
+              ('G1_S_v2', 'CDK2_activation'),
+              ('G1_S_v2', 'Rb_E2F_activation'),
+              ('G1_S_v2', 'DNA_damage_pathway'))),
+    ('shared', (('cell_cycle_shared', 'declare_rules'),)),
+)
+
+MODULES = tuple(name for name, _ in _MODULE_STEPS)
+
+_SOURCES = ('cell_cycle_shared', 'G1_S_v2', 'G2_M_v2')
+
+
+class ModelSpec(namedtuple('ModelSpec', ['modules', 'parameters', 'name'])):
+    """Rule modules to include and parameter overrides of a model variant
+
+    `parameters` may be given as a dict; it is stored as sorted (name,
+    value) pairs so equal specs compare and hash equal.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, modules=MODULES, parameters=None, name=None):
+        unknown = set(modules) - set(MODULES)
+        if unknown:
+            raise ValueError("Unknown model modules: %s" % ', '.join(sorted(unknown)))
+        modules = tuple(m for m in MODULES if m in modules)
+        parameters = tuple(sorted(dict(parameters or {}).items()))
+        return super(ModelSpec, cls).__new__(cls, modules, parameters, name)
+
+    def key(self):
+        return hashlib.sha1(repr(tuple(self)).encode('utf-8')).hexdigest()[:12]
+
+    def replace(self, modules=None, parameters=None, name=None):
+        """A copy with other modules, additional parameter overrides or
+        another name"""
+        merged = dict(self.parameters)
+        merged.update(parameters or {})
+        return ModelSpec(self.modules if modules is None else modules, merged,
+                         self.name if name is None else name)
+
+    def build(self):
+        return build_model(self)
+
+
+def _steps(spec):
+    steps = list(_BASE_STEPS)
+    for name, module_steps in _MODULE_STEPS:
+        if name in spec.modules:
+            steps.extend(module_steps)
+    return steps
+
+
+def _clear_aliases(module):
+    """Remove components exported or aliased into a declaring module"""
+    for name, value in list(vars(module).items()):
+        if isinstance(value, (Component, Model)):
+            delattr(module, name)
+
+
+def build_model(spec=None):
+    """Assemble a new, independent Model for `spec` (default: everything)"""
+    spec = ModelSpec() if spec is None else spec
+    sources = [importlib.import_module(name) for name in _SOURCES]
+    for module in sources:
+        _clear_aliases(module)
+    # A named Model is exported under its name, which cleanup() leaves
+    # behind; unnamed ones are exported as 'model' and removed again
+    model = Model()
+    model.name = spec.name or 'cell_cycle_%s' % '_'.join(spec.modules or ('base',))
+    try:
+        for module_name, function in _steps(spec):
+            getattr(importlib.import_module(module_name), function)()
+    finally:
+        SelfExporter.cleanup()
+        for module in sources:
+            _clear_aliases(module)
+    for name, value in spec.parameters:
+        model.parameters[name].value = value
+    return model
+
+
+# Per-process instances, keyed by spec
+_models = {}
+_systems = {}
+
+
+def get_model(spec=None):
+    """The Model for `spec`, built on first use in this process"""
+    spec = ModelSpec() if spec is None else spec
+    if spec not in _models:
+        _models[spec] = build_model(spec)
+    return _models[spec]
+
+
+def get_system(spec=None):
+    """The OdeSystem for `spec`, generated (through the network cache) on
+    first use in this process"""
+    spec = ModelSpec() if spec is None else spec
+    if spec not in _systems:
+        _systems[spec] = OdeSystem.from_model(get_model(spec))
+    return _systems[spec]
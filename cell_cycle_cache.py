@@ -0,0 +1,382 @@
+"""Persistent on-disk cache of generated reaction networks.
+
+generate_equations() runs BioNetGen every time a script starts, even though
+the network only depends on the model's structure: its monomers, rules,
+expressions, observables and which parameters seed which initial species.
+Parameter *values* never enter the network, so runs that only change DDS_0
+or a rate constant can reuse it. cached_generate_equations() keys the
+generated species, reactions, ODEs and observable species lists on a hash of
+that structure and restores them onto the model on a hit. Once the network is
+restored, pysb's own generate_equations() is a no-op.
+cell_cycle_odes.OdeSystem.from_model() keeps the OdeSystem of a network in
+the same directory (system-*.pkl), so a new process also skips deriving the
+rate laws and the Jacobian; only their lambdify runs again on loading.
+
+Network entries are plain pickles of strings and tuples (no pysb objects) and
+the directory is bounded in size by least-recently-used eviction.
+
+With incremental=True, a miss first looks for the last network built from
+the same model apart from its rules. Reactions of unchanged rules are kept;
+BioNetGen expands only the edited and added rules, seeded with all known
+species. If that yields no new species, the network is assembled from the
+two parts, and every species keeps its index. Otherwise, or when anything
+besides rules changed, the full generate_equations() runs as before.
+"""
+
+import errno
+import hashlib
+import os
+import pickle
+import tempfile
+
+import sympy
+from pysb.bng import generate_equations
+from pysb.core import ComplexPattern, Model, MonomerPattern, Parameter
+
+CACHE_FORMAT = 1
+DEFAULT_CACHE_DIR = os.environ.get(
+    'CELL_CYCLE_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'cell_cycle'))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def network_key(model, rules=True):
+    """Return a hex digest identifying the reaction network of `model`
+
+    Only the structure of the model contributes: monomers, rules,
+    expressions, observables and initial condition patterns with the *names*
+    of their parameters. Parameter values do not. With rules=False the
+    rules are left out too, identifying the family of networks that
+    incremental generation can move between.
+    """
+    h = hashlib.sha1()
+    h.update(('cell_cycle network %d\n' % CACHE_FORMAT).encode('utf-8'))
+    for m in model.monomers:
+        h.update(('M %r\n' % m).encode('utf-8'))
+    for r in model.rules if rules else ():
+        h.update(('R %r\n' % r).encode('utf-8'))
+    for e in model.expressions:
+        h.update(('E %s %s\n' % (e.name, e.expr)).encode('utf-8'))
+    for o in model.observables:
+        h.update(('O %r\n' % o).encode('utf-8'))
+    for cp, param in model.initial_conditions:
+        h.update(('I %s %s\n' % (cp, param.name)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def atomic_write(path, data):
+    """Write the bytes `data` to `path` so readers never see a partial file"""
+    makedirs(os.path.dirname(path) or '.')
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def prune_cache(cache_dir, max_bytes, suffix='.pkl'):
+    """Delete the least recently used `suffix` files in `cache_dir` until
+    their total size is at most `max_bytes`; returns the size left"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+    return total
+
+
+def _dump_species(cp):
+    return ([(mp.monomer.name, dict(mp.site_conditions)) for mp in cp.monomer_patterns])
+
+
+def _load_species(model, data):
+    return ComplexPattern([MonomerPattern(model.monomers[name], sites, None)
+                           for name, sites in data], None)
+
+
+def _dump_reaction(rxn):
+    rxn = dict(rxn)
+    rxn['rate'] = str(rxn['rate'])
+    return rxn
+
+
+def _load_reaction(rxn, symbols):
+    rxn = dict(rxn)
+    rxn['rate'] = sympy.sympify(rxn['rate'], locals=symbols)
+    return rxn
+
+
+def _dump_network(model):
+    return {
+        'format': CACHE_FORMAT,
+        'species': [_dump_species(cp) for cp in model.species],
+        'reactions': [_dump_reaction(r) for r in model.reactions],
+        'reactions_bidirectional': [_dump_reaction(r) for r in model.reactions_bidirectional],
+        'odes': [str(ode) for ode in model.odes],
+        'observables': dict((o.name, (list(o.species), list(o.coefficients)))
+                            for o in model.observables),
+    }
+
+
+def _load_network(model, data):
+    symbols = dict((c.name, c) for c in list(model.parameters) + list(model.expressions))
+    for i in range(len(data['species'])):
+        symbols['__s%d' % i] = sympy.Symbol('__s%d' % i)
+    model.species = [_load_species(model, s) for s in data['species']]
+    model.reactions = [_load_reaction(r, symbols) for r in data['reactions']]
+    model.reactions_bidirectional = [_load_reaction(r, symbols)
+                                     for r in data['reactions_bidirectional']]
+    try:
+        model.odes = [sympy.sympify(ode, locals=symbols) for ode in data['odes']]
+    except AttributeError:
+        pass  # newer pysb derives the ODEs from the reactions
+    for obs in model.observables:
+        obs.species, obs.coefficients = data['observables'][obs.name]
+
+
+def _read_pickle(path):
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return data if data.get('format') == CACHE_FORMAT else None
+
+
+def _split_condition(condition):
+    """(state, bond) of a concrete site condition"""
+    if isinstance(condition, tuple):
+        return condition
+    if isinstance(condition, int) and not isinstance(condition, bool):
+        return None, condition
+    return condition, None
+
+
+def _ranks(values):
+    order = dict((v, k) for k, v in enumerate(sorted(set(values))))
+    return [order[v] for v in values]
+
+
+def _species_key(data):
+    """Canonical key of a dumped species: two dumps get the same key exactly
+    when they describe the same complex, whatever the order of their monomer
+    patterns and the numbering of their bonds
+
+    The monomers are coloured by name and site states, the colours refined
+    by those of the bond partners, and remaining ties (such as the members
+    of a homo-oligomer) broken by trying each tied monomer first; the key is
+    the smallest encoding found.
+    """
+    monomers = [(name, sorted(sites.items())) for name, sites in data]
+    ends = {}
+    for i, (_, sites) in enumerate(monomers):
+        for site, condition in sites:
+            bond = _split_condition(condition)[1]
+            if bond is not None:
+                ends.setdefault(bond, []).append((i, site))
+    partners = [[] for _ in monomers]
+    for pair in ends.values():
+        if len(pair) == 2:
+            (i, a), (j, b) = pair
+            partners[i].append((a, j, b))
+            partners[j].append((b, i, a))
+
+    def refine(colours):
+        while True:
+            refined = _ranks([(colours[i], tuple(sorted((a, b, colours[j])
+                                                        for a, j, b in partners[i])))
+                              for i in range(len(monomers))])
+            if len(set(refined)) == len(set(colours)):
+                return refined
+            colours = refined
+
+    def encode(order):
+        bonds, rows = {}, []
+        for i in order:
+            name, sites = monomers[i]
+            row = []
+            for site, condition in sites:
+                state, bond = _split_condition(condition)
+                if bond is not None:
+                    bond = bonds.setdefault(bond, len(bonds))
+                row.append((site, repr(state), bond))
+            rows.append((name, tuple(row)))
+        return repr(tuple(rows))
+
+    def search(colours):
+        colours = refine(colours)
+        tied = [c for c in set(colours) if colours.count(c) > 1]
+        if not tied:
+            return encode(sorted(range(len(colours)), key=colours.__getitem__))
+        target = min(tied)
+        return min(search([2 * c + (0 if i == m else 1) for i, c in enumerate(colours)])
+                   for m in range(len(colours)) if colours[m] == target)
+
+    return search(_ranks([(name, tuple((site, repr(_split_condition(c)[0]),
+                                        _split_condition(c)[1] is None) for site, c in sites))
+                          for name, sites in monomers]))
+
+
+def _rule_names(rxn):
+    rule = rxn.get('rule')
+    return set(rule) if isinstance(rule, (tuple, list)) else set([rule])
+
+
+def _write_rules(model, cache_dir, key):
+    """Record `key` as the latest network of the model's rule family"""
+    manifest = {'format': CACHE_FORMAT, 'network': key,
+                'rules': dict((r.name, repr(r)) for r in model.rules)}
+    atomic_write(os.path.join(cache_dir, 'rules-%s.pkl' % network_key(model, rules=False)),
+                 pickle.dumps(manifest, 2))
+
+
+def _assemble(species, reactions, observables):
+    """Network data from species and reactions whose rates are sympy
+    expressions, with the bidirectional reactions and ODEs pysb derives"""
+    odes = [sympy.Integer(0)] * len(species)
+    bidirectional, by_key = [], {}
+    for rxn in reactions:
+        for s in rxn['products']:
+            odes[s] += rxn['rate']
+        for s in rxn['reactants']:
+            odes[s] -= rxn['rate']
+        rule = rxn['rule']
+        reverse = by_key.get((rule, tuple(rxn['products']), tuple(rxn['reactants'])))
+        if reverse is None:
+            combined = dict(rxn, reversible=False)
+            by_key[(rule, tuple(rxn['reactants']), tuple(rxn['products']))] = combined
+            bidirectional.append(combined)
+        else:
+            reverse['reversible'] = True
+            reverse['rate'] -= rxn['rate']
+    return {
+        'format': CACHE_FORMAT,
+        'species': species,
+        'reactions': [_dump_reaction(r) for r in reactions],
+        'reactions_bidirectional': [_dump_reaction(r) for r in bidirectional],
+        'odes': [str(ode) for ode in odes],
+        'observables': observables,
+    }
+
+
+def _incremental(model, cache_dir, verbose=False):
+    """Network data of `model` derived from the latest network of its rule
+    family by re-expanding only changed rules, or None if that is not
+    possible (no earlier network, or new species would appear)"""
+    manifest = _read_pickle(os.path.join(cache_dir,
+                                         'rules-%s.pkl' % network_key(model, rules=False)))
+    previous = manifest and _read_pickle(os.path.join(cache_dir,
+                                                      'network-%s.pkl' % manifest['network']))
+    if not previous:
+        return None
+    rules = dict((r.name, repr(r)) for r in model.rules)
+    changed = set(name for name, text in rules.items() if manifest['rules'].get(name) != text)
+    stale = changed | (set(manifest['rules']) - set(rules))
+    kept = []
+    for rxn in previous['reactions']:
+        names = _rule_names(rxn)
+        if None in names or (names & stale and names - stale):
+            return None  # unknown or shared provenance
+        if not names & stale:
+            kept.append(rxn)
+
+    symbols = dict((c.name, c) for c in list(model.parameters) + list(model.expressions))
+    for i in range(len(previous['species'])):
+        symbols['__s%d' % i] = sympy.Symbol('__s%d' % i)
+    reactions = [_load_reaction(r, symbols) for r in kept]
+    delta_rules = [r for r in model.rules if r.name in changed]
+    if delta_rules:
+        # BioNetGen on the changed rules alone, seeded with every known species
+        delta = Model(_export=False)
+        for component in list(model.monomers) + list(model.parameters) + \
+                list(model.expressions) + list(model.observables) + delta_rules:
+            delta.add_component(component)
+        for i, data in enumerate(previous['species']):
+            seed = Parameter('incremental_seed_%d' % i, 0.0, _export=False)
+            delta.add_component(seed)
+            delta.initial(_load_species(model, data), seed)
+        generate_equations(delta, verbose=verbose)
+        known = dict((_species_key(data), i) for i, data in enumerate(previous['species']))
+        index = [known.get(_species_key(_dump_species(cp))) for cp in delta.species]
+        if None in index:
+            return None
+        renumber = dict((sympy.Symbol('__s%d' % j), symbols['__s%d' % i])
+                        for j, i in enumerate(index))
+        for rxn in delta.reactions:
+            rxn = dict(rxn)
+            rxn['reactants'] = tuple(index[j] for j in rxn['reactants'])
+            rxn['products'] = tuple(index[j] for j in rxn['products'])
+            rxn['rate'] = sympy.sympify(rxn['rate']).xreplace(renumber)
+            reactions.append(rxn)
+    if verbose:
+        print("Regenerated %d of %d rules incrementally" % (len(changed), len(rules)))
+    return _assemble(previous['species'], reactions, previous['observables'])
+
+
+def cached_generate_equations(model, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES,
+                              verbose=False, incremental=False):
+    """Populate the reaction network of `model`, from the cache if possible
+
+    Behaves like pysb.bng.generate_equations(), but looks the network up in
+    `cache_dir` (default $CELL_CYCLE_CACHE or ~/.cache/cell_cycle) first and
+    stores it there after a BioNetGen run. With incremental=True a miss is
+    first tried as an edit of the last network with the same non-rule
+    structure. Returns True on a cache hit and False after generating the
+    network; a model that already has its network is left as it is (and
+    its network stored if the cache does not have it yet), returning None.
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    key = network_key(model)
+    path = os.path.join(cache_dir, 'network-%s.pkl' % key)
+    if model.reactions:
+        if not os.path.exists(path):
+            atomic_write(path, pickle.dumps(_dump_network(model), 2))
+            _write_rules(model, cache_dir, key)
+            prune_cache(cache_dir, max_bytes)
+        return None
+
+    data = _read_pickle(path)
+    if data is not None:
+        _load_network(model, data)
+        os.utime(path, None)
+        _write_rules(model, cache_dir, key)
+        if verbose:
+            print("Loaded reaction network from %s" % path)
+        return True
+
+    data = _incremental(model, cache_dir, verbose) if incremental else None
+    if data is not None:
+        _load_network(model, data)
+    else:
+        generate_equations(model, verbose=verbose)
+        data = _dump_network(model)
+    atomic_write(path, pickle.dumps(data, 2))
+    _write_rules(model, cache_dir, key)
+    prune_cache(cache_dir, max_bytes)
+    return False
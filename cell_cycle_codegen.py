@@ -0,0 +1,286 @@
+"""Generated, compiled right-hand side and Jacobian of an OdeSystem.
+
+OdeSystem evaluates its rate laws through sympy.lambdify, which is built for
+batches: for the single states integrate() asks for, every call pays for
+numpy dispatch on each term, and each rate law recomputes the observable
+sums and Hill terms (create_Int, sig_deg, the OBS_Int**n of create_Mdm2) it
+shares with others. CompiledSystem instead generates straight-line code:
+
+- common subexpressions of all rate laws (and, separately, of all dv/dy
+  entries) are computed once, so an observable sum or Expression appearing
+  in many reactions is evaluated once per call
+- integer powers become repeated squaring, with the squares shared, so
+  x**50 costs 7 multiplications and x**49 next to it one more
+- dy/dt and the nonzero Jacobian entries are written directly, with the
+  stoichiometry folded in
+
+Parameters are read from the runtime vector p, except those used as
+exponents (the Hill coefficient n of OBS_Int**n): while such a parameter
+holds an integer value it is written into the source as a constant, so the
+power is squared out like a literal one, and the value is part of the
+source key. Other parameter changes never regenerate anything; setting an
+exponent parameter to a new integer compiles (once) a new variant, and a
+non-integer value leaves it a runtime power. The source is cached as
+rhs-<hash>.py next to the network cache. With numba installed
+(backend='numba', or 'auto') the functions are compiled with numba.njit,
+whose own cache keeps the machine code; otherwise they run as plain Python
+on floats, which is already much faster than lambdify for one state.
+"""
+
+from __future__ import division
+
+import hashlib
+import os
+import re
+
+import numpy as np
+import scipy.sparse
+import sympy
+from sympy.printing.pycode import PythonCodePrinter
+
+from cell_cycle_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, atomic_write, prune_cache
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+CODEGEN_FORMAT = 2
+MAX_CONSTANT_EXPONENT = 1024
+BACKENDS = ('auto', 'python', 'numba')
+
+
+class _Emitter(object):
+    """Straight-line statements with shared repeated-squaring temporaries"""
+
+    def __init__(self, printer):
+        self.printer = printer
+        self.lines = []
+        self.squares = {}
+        self.powers = {}
+        self._count = 0
+
+    def temp(self, expr):
+        name = sympy.Symbol('_t%d' % self._count)
+        self._count += 1
+        self.lines.append('%s = %s' % (name, self.printer.doprint(expr)))
+        return name
+
+    def _square(self, base, k):
+        """base**(2**k) as a symbol"""
+        if k == 0:
+            return base
+        key = (base, k)
+        if key not in self.squares:
+            half = self._square(base, k - 1)
+            self.squares[key] = self.temp(sympy.Mul(half, half, evaluate=False))
+        return self.squares[key]
+
+    def power(self, base, n):
+        if not base.is_Symbol:
+            base = self.temp(base)
+        key = (base, abs(n))
+        if key not in self.powers:
+            factors = [self._square(base, k) for k in range(abs(n).bit_length()) if abs(n) >> k & 1]
+            self.powers[key] = factors[0] if len(factors) == 1 else \
+                self.temp(sympy.Mul(*factors, evaluate=False))
+        return self.powers[key] if n > 0 else 1 / self.powers[key]
+
+    def rewrite(self, expr):
+        """expr with every integer power of 2 or more replaced by squarings"""
+        if expr.is_Atom:
+            return expr
+        args = [self.rewrite(a) for a in expr.args]
+        if expr.is_Pow and args[1].is_Integer and abs(int(args[1])) >= 2:
+            return self.power(args[0], int(args[1]))
+        return expr.func(*args)
+
+    def assign(self, target, expr):
+        self.lines.append('%s = %s' % (target, self.printer.doprint(self.rewrite(expr))))
+
+
+def _linear_combination(terms, values):
+    code = ''
+    for c, e in terms:
+        c = float(c)
+        term = values[e] if abs(c) == 1 else '%r*%s' % (abs(c), values[e])
+        code += ('-' if c < 0 else '+') + ' ' + term + ' '
+    code = code.strip()
+    if code.startswith('+ '):
+        return code[2:]
+    return '-' + code[2:] if code else '0.0'
+
+
+def _function(name, exprs, outputs, y_symbols, p_symbols):
+    """Source of `def name(y, p, out)` storing each outputs[i] (a list of
+    (coefficient, expression index) pairs) into out[i]"""
+    printer = PythonCodePrinter({'fully_qualified_modules': True})
+    replacements, reduced = sympy.cse(exprs, symbols=sympy.numbered_symbols('_c'))
+    emitter = _Emitter(printer)
+    for symbol, expr in replacements:
+        emitter.assign(symbol, expr)
+    values = []
+    for e, expr in enumerate(reduced):
+        if expr.is_Number:
+            values.append(printer.doprint(expr))
+        else:
+            emitter.assign('_v%d' % e, expr)
+            values.append('_v%d' % e)
+    body = emitter.lines
+    for i, terms in enumerate(outputs):
+        body.append('out[%d] = %s' % (i, _linear_combination(terms, values)))
+
+    used = set(re.findall(r'\w+', '\n'.join(body)))
+    unpack = ['%s = y[%d]' % (s, i) for i, s in enumerate(y_symbols) if str(s) in used] + \
+             ['%s = p[%d]' % (s, k) for k, s in enumerate(p_symbols) if str(s) in used]
+    return 'def %s(y, p, out):\n%s\n' % (name, ''.join('    %s\n' % line
+                                                       for line in unpack + body))
+
+
+def exponent_columns(system):
+    """Sorted indices of the parameters that appear in an exponent of a
+    rate law"""
+    index = dict((s, k) for k, s in enumerate(system.p_symbols))
+    columns = set()
+    for expr in system.rate_exprs:
+        for power in expr.atoms(sympy.Pow):
+            columns.update(index[s] for s in power.exp.free_symbols if s in index)
+    return sorted(columns)
+
+
+def integer_exponents(p, columns):
+    """{column: int} for the exponent parameters in `columns` whose value in
+    the parameter vector `p` is a (moderate) integer"""
+    constants = {}
+    for k in columns:
+        value = float(p[k])
+        if abs(value) <= MAX_CONSTANT_EXPONENT and value == int(value):
+            constants[k] = int(value)
+    return constants
+
+
+def generate_source(system, constants=None):
+    """Python source of rhs(y, p, out) and jac(y, p, out) for `system`;
+    jac stores the entries at (system.jac_rows, system.jac_cols).
+    `constants` ({parameter index: int}) are substituted into the rate laws
+    instead of being read from p"""
+    rate_exprs, dv_exprs = system.rate_exprs, system.dv_exprs
+    if constants:
+        values = dict((system.p_symbols[k], sympy.Integer(v)) for k, v in constants.items())
+        rate_exprs = [e.xreplace(values) for e in rate_exprs]
+        dv_exprs = [e.xreplace(values) for e in dv_exprs]
+    S = system.stoichiometry
+    rhs_outputs = [[(S[i, j], j) for j in np.nonzero(S[i])[0]] for i in range(system.n_species)]
+    to_jac = system._dv_to_jac.tocsc()
+    jac_outputs = [[(to_jac.data[k], to_jac.indices[k])
+                    for k in range(to_jac.indptr[n], to_jac.indptr[n + 1])]
+                   for n in range(system.jac_nnz)]
+    return '\n\n'.join([
+        '"""Generated by cell_cycle_codegen; do not edit"""\n\n'
+        'from __future__ import division\n\nimport math\n',
+        _function('rhs', rate_exprs, rhs_outputs, system.y_symbols, system.p_symbols),
+        _function('jac', dv_exprs, jac_outputs, system.y_symbols, system.p_symbols)])
+
+
+def source_key(system, constants=None):
+    """Hex digest of everything the generated source depends on"""
+    h = hashlib.sha1(('cell_cycle codegen %d\n' % CODEGEN_FORMAT).encode('utf-8'))
+    for expr in system.rate_exprs:
+        h.update(('%s\n' % sympy.srepr(expr)).encode('utf-8'))
+    h.update(np.ascontiguousarray(system.stoichiometry).tobytes())
+    h.update(np.ascontiguousarray(system.jac_rows).tobytes())
+    h.update(np.ascontiguousarray(system.jac_cols).tobytes())
+    h.update(repr(sorted((constants or {}).items())).encode('utf-8'))
+    return h.hexdigest()
+
+
+def cached_source(system, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, constants=None):
+    """Path of the generated source file for `system` (with `constants`
+    substituted), writing it first if it is not in `cache_dir` (default: the
+    network cache directory)"""
+    cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, 'rhs-%s.py' % source_key(system, constants))
+    if os.path.exists(path):
+        os.utime(path, None)
+    else:
+        atomic_write(path, generate_source(system, constants).encode('utf-8'))
+        prune_cache(cache_dir, max_bytes, suffix='.py')
+    return path
+
+
+class CompiledSystem(object):
+    """An OdeSystem whose single-state rhs, jacobian and jacobian_matrix use
+    generated code; batched calls and everything else go to the OdeSystem
+
+    One variant is compiled per combination of integer exponent values met
+    in p (usually just one). Pickles without the compiled functions, which
+    are rebuilt (from the source cache) on first use in each process.
+    """
+
+    def __init__(self, system, backend='auto', cache_dir=None):
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend %r; expected one of %s"
+                             % (backend, ', '.join(BACKENDS)))
+        if backend == 'numba' and numba is None:
+            raise ImportError("backend='numba' needs numba installed")
+        self.system = system
+        self.backend = 'numba' if backend == 'auto' and numba is not None else \
+            'python' if backend == 'auto' else backend
+        self.cache_dir = cache_dir
+        self.exponent_columns = exponent_columns(system)
+        self._functions = {}
+
+    def __getattr__(self, name):
+        if name == 'system':
+            raise AttributeError(name)
+        return getattr(self.system, name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_functions'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def _load(self, constants):
+        path = cached_source(self.system, self.cache_dir, constants=constants)
+        with open(path) as f:
+            source = f.read()
+        namespace = {}
+        exec(compile(source, path, 'exec'), namespace)
+        rhs, jac = namespace['rhs'], namespace['jac']
+        if self.backend == 'numba':
+            rhs, jac = numba.njit(cache=True)(rhs), numba.njit(cache=True)(jac)
+        return rhs, jac
+
+    def _evaluate(self, which, y, p, n):
+        constants = integer_exponents(p, self.exponent_columns)
+        key = tuple(sorted(constants.items()))
+        functions = self._functions.get(key)
+        if functions is None:
+            functions = self._functions[key] = self._load(constants)
+        function = functions[which]
+        if self.backend == 'numba':
+            out = np.empty(n)
+            function(np.asarray(y, dtype=float), np.asarray(p, dtype=float), out)
+            return out
+        out = [0.0] * n
+        function(np.asarray(y, dtype=float).tolist(), np.asarray(p, dtype=float).tolist(), out)
+        return np.array(out)
+
+    def rhs(self, y, p):
+        if np.ndim(y) != 1 or np.ndim(p) != 1:
+            return self.system.rhs(y, p)
+        return self._evaluate(0, y, p, self.system.n_species)
+
+    def jacobian(self, y, p):
+        if np.ndim(y) != 1 or np.ndim(p) != 1:
+            return self.system.jacobian(y, p)
+        return self._evaluate(1, y, p, self.system.jac_nnz)
+
+    def jacobian_matrix(self, y, p):
+        n = self.system.n_species
+        return scipy.sparse.csc_matrix((self.jacobian(y, p),
+                                        (self.system.jac_rows, self.system.jac_cols)),
+                                       shape=(n, n))
@@ -0,0 +1,244 @@
+"""Steady states, limit cycles and their continuation in one parameter.
+
+Scanning DNA damage with long time courses (five hard-coded DDS_0 levels in
+run_cell_cycle.py) is a crude way to find where behaviour changes. This
+module works on the generated ODEs directly, with the analytic Jacobian of
+OdeSystem:
+
+- steady_state(): damped Newton on dy/dt = 0. Conservation laws (the left
+  null space of the stoichiometry matrix) fix the otherwise free totals, so
+  the Newton system is square and regular.
+- continue_steady_state(): pseudo-arclength continuation of a steady state
+  in DDS_0 or any other parameter, reporting stability along the branch and
+  locating fold (limit point) and Hopf bifurcations.
+- limit_cycle(): single shooting for a periodic orbit and its Floquet
+  multipliers, using the monodromy matrix from forward sensitivities.
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+
+from cell_cycle_fit import integrate_sensitivities
+from cell_cycle_integrate import integrate
+
+Branch = namedtuple('Branch', ['parameter', 'values', 'states', 'stable', 'max_real',
+                               'special_points'])
+SpecialPoint = namedtuple('SpecialPoint', ['kind', 'value', 'state', 'index'])
+LimitCycle = namedtuple('LimitCycle', ['state', 'period', 'multipliers', 'iterations'])
+
+
+def conservation_basis(system):
+    """Return (Q, L): an orthonormal basis Q of the column space of the
+    stoichiometry matrix (every dy/dt lies in it) and the conservation laws
+    L, with L . dy/dt = 0 for every state"""
+    U, s, _ = np.linalg.svd(system.stoichiometry)
+    rank = int((s > 1e-10 * s[0]).sum()) if len(s) and s[0] > 0 else 0
+    return U[:, :rank], U[:, rank:].T
+
+
+def _newton(F, JF, x, tol, max_iter):
+    """Damped Newton; returns (x, iterations) or raises RuntimeError"""
+    r = F(x)
+    for iteration in range(max_iter):
+        if np.abs(r).max() <= tol:
+            return x, iteration
+        dx = np.linalg.lstsq(JF(x), -r, rcond=None)[0]
+        step = 1.0
+        while True:
+            x_new = x + step * dx
+            r_new = F(x_new)
+            if np.all(np.isfinite(r_new)) and np.linalg.norm(r_new) < np.linalg.norm(r):
+                break
+            step /= 2
+            if step < 1e-4:
+                raise RuntimeError("Newton iteration stalled (|F| = %g)" % np.abs(r).max())
+        x, r = x_new, r_new
+    if np.abs(r).max() <= tol:
+        return x, max_iter
+    raise RuntimeError("Newton iteration did not converge (|F| = %g)" % np.abs(r).max())
+
+
+def _equations(system, Q, L, totals):
+    def F(y, p):
+        return np.concatenate([Q.T.dot(system.rhs(y, p)), L.dot(y) - totals])
+
+    def JF(y, p):
+        return np.vstack([Q.T.dot(system.jacobian_matrix(y, p).toarray()), L])
+    return F, JF
+
+
+def steady_state(system, p=None, y_guess=None, relax_time=0.0, tol=1e-10, max_iter=50):
+    """Find a steady state by Newton's method
+
+    The conserved totals are those of `y_guess` (default: the initial
+    values for `p`). With relax_time > 0 the guess is first integrated for
+    that long, which helps Newton find the attracting state.
+    """
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    y = system.initial_values(p) if y_guess is None else np.asarray(y_guess, dtype=float)
+    if relax_time > 0:
+        y = integrate(system, [0.0, relax_time], p, y)[0][-1]
+    Q, L = conservation_basis(system)
+    F, JF = _equations(system, Q, L, L.dot(y))
+    return _newton(lambda x: F(x, p), lambda x: JF(x, p), y, tol, max_iter)[0]
+
+
+def eigenvalues(system, y, p, Q=None):
+    """Eigenvalues of the Jacobian restricted to the stoichiometric subspace
+    (the zero eigenvalues of the conservation laws are left out)"""
+    if Q is None:
+        Q = conservation_basis(system)[0]
+    return np.linalg.eigvals(Q.T.dot(system.jacobian_matrix(y, p).toarray()).dot(Q))
+
+
+def _stability(ev):
+    complex_ev = ev[np.abs(ev.imag) > 1e-12 * max(1.0, np.abs(ev).max())]
+    return (ev.real.max() if len(ev) else -np.inf,
+            int((complex_ev.real > 0).sum()),
+            complex_ev.real.max() if len(complex_ev) else None)
+
+
+def continue_steady_state(system, parameter, stop, p=None, y=None, ds=0.01, ds_min=1e-6,
+                          ds_max=0.05, max_points=1000, tol=1e-10, max_iter=10):
+    """Trace a steady-state branch as `parameter` moves towards `stop`
+
+    Starts from the steady state at the parameter's value in `p` (found
+    from `y` by steady_state()). The arclength combines the state and the
+    parameter rescaled by |stop - start|, and step sizes `ds` are in those
+    units. Returns a Branch with one entry per converged point and the fold
+    and Hopf points detected between them.
+    """
+    p = system.parameter_vector() if p is None else np.array(p, dtype=float)
+    k = system.parameter_index(parameter)
+    start = p[k]
+    span = abs(stop - start)
+    if span == 0:
+        raise ValueError("stop must differ from the parameter's current value")
+    direction = 1.0 if stop > start else -1.0
+    y = steady_state(system, p, y, tol=tol)
+    Q, L = conservation_basis(system)
+    F, JF = _equations(system, Q, L, L.dot(y))
+    n = len(y)
+
+    def with_mu(mu):
+        q = p.copy()
+        q[k] = start + mu * span * direction
+        return q
+
+    def G(x):
+        return F(x[:n], with_mu(x[n]))
+
+    def JG(x):
+        q = with_mu(x[n])
+        dmu = Q.T.dot(system.parameter_jacobian(x[:n], q)[:, k]) * span * direction
+        return np.hstack([JF(x[:n], q), np.concatenate([dmu, np.zeros(len(L))])[:, None]])
+
+    def tangent(x, previous):
+        A = np.vstack([JG(x), previous])
+        t = np.linalg.solve(A, np.concatenate([np.zeros(n), [1.0]]))
+        return t / np.linalg.norm(t)
+
+    x = np.concatenate([y, [0.0]])
+    t = tangent(x, np.concatenate([np.zeros(n), [1.0]]))
+    points, special = [x], []
+    ev_stats = [_stability(eigenvalues(system, y, with_mu(0.0), Q))]
+    while len(points) < max_points and x[n] < 1.0:
+        predicted = x + ds * t
+        try:
+            x_new, iterations = _newton(
+                lambda z: np.concatenate([G(z), [t.dot(z - predicted)]]),
+                lambda z: np.vstack([JG(z), t]), predicted, tol, max_iter)
+        except (RuntimeError, np.linalg.LinAlgError):
+            ds /= 2
+            if ds < ds_min:
+                break
+            continue
+        t_new = tangent(x_new, t)
+        stats = _stability(eigenvalues(system, x_new[:n], with_mu(x_new[n]), Q))
+
+        if np.sign(t_new[n]) != np.sign(t[n]):
+            w = t[n] / (t[n] - t_new[n])
+            special.append(('fold', x + w * (x_new - x), len(points)))
+        elif stats[1] != ev_stats[-1][1] and stats[2] is not None and ev_stats[-1][2] is not None:
+            a, b = ev_stats[-1][2], stats[2]
+            w = a / (a - b) if a != b else 0.5
+            special.append(('hopf', x + w * (x_new - x), len(points)))
+
+        points.append(x_new)
+        ev_stats.append(stats)
+        x, t = x_new, t_new
+        ds = min(ds * 1.5, ds_max) if iterations <= 3 else (ds / 2 if iterations > 6 else ds)
+
+    points = np.array(points)
+    values = start + points[:, n] * span * direction
+    max_real = np.array([s[0] for s in ev_stats])
+    return Branch(parameter, values, points[:, :n], max_real < 0, max_real,
+                  [SpecialPoint(kind, start + z[n] * span * direction, z[:n], i)
+                   for kind, z, i in special])
+
+
+def estimate_period(t, x):
+    """Mean interval between upward crossings of the mean of x(t); None if
+    there are fewer than two"""
+    t, x = np.asarray(t), np.asarray(x)
+    level = x.mean()
+    up = np.nonzero((x[:-1] < level) & (x[1:] >= level))[0]
+    times = t[up] + (level - x[up]) * (t[up + 1] - t[up]) / (x[up + 1] - x[up])
+    return np.diff(times).mean() if len(times) > 1 else None
+
+
+def limit_cycle(system, p=None, y_guess=None, period_guess=None, relax_time=3000.0,
+                observable='OBS_MPF', tol=1e-8, max_iter=20, rtol=1e-8, atol=1e-10):
+    """Find a periodic orbit by single shooting
+
+    Without `y_guess` and `period_guess`, the model is integrated for
+    `relax_time` from its initial values and the period is estimated from
+    `observable` over the second half of that run. Newton then solves
+    phi_T(y0) = y0 together with a phase condition and the conservation
+    laws, using the monodromy matrix from integrate_sensitivities().
+    Returns a LimitCycle whose multipliers are the Floquet multipliers.
+    """
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    if y_guess is None or period_guess is None:
+        tspan = np.linspace(0.0, relax_time, 2001)
+        y = integrate(system, tspan, p, y_guess)[0]
+        half = len(tspan) // 2
+        if period_guess is None:
+            obs = system.observables(y[half:])[:, system.observable_index(observable)]
+            period_guess = estimate_period(tspan[half:], obs)
+            if period_guess is None:
+                raise RuntimeError("No oscillation in %s to estimate a period from" % observable)
+        y_guess = y[-1]
+    y_star = np.asarray(y_guess, dtype=float)
+    f_star = system.rhs(y_star, p)
+    _, L = conservation_basis(system)
+    totals = L.dot(y_star)
+    n = len(y_star)
+
+    state = {}
+
+    def flow(x):
+        key = x.tobytes()
+        if key not in state:
+            y, S = integrate_sensitivities(system, [0.0, x[n]], p, x[:n], initial=True,
+                                           rtol=rtol, atol=atol)
+            state.clear()
+            state[key] = (y[-1], S[-1])
+        return state[key]
+
+    def F(x):
+        yT, _ = flow(x)
+        return np.concatenate([yT - x[:n], [f_star.dot(x[:n] - y_star)], L.dot(x[:n]) - totals])
+
+    def JF(x):
+        yT, M = flow(x)
+        top = np.hstack([M - np.eye(n), system.rhs(yT, p)[:, None]])
+        phase = np.concatenate([f_star, [0.0]])
+        return np.vstack([top, phase, np.hstack([L, np.zeros((len(L), 1))])])
+
+    x, iterations = _newton(F, JF, np.concatenate([y_star, [period_guess]]), tol, max_iter)
+    multipliers = np.linalg.eigvals(flow(x)[1])
+    return LimitCycle(x[:n], x[n], multipliers, iterations)
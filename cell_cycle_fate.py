@@ -0,0 +1,343 @@
+"""Event-driven cell-fate classification.
+
+Instead of integrating to t = 6000 and inspecting OBS_MPF, OBS_APC_Ccdc20,
+OBS_p53 and OBS_CycE afterwards, a FateClassifier watches those observables
+while the integrator runs and stops it as soon as the fate is decided:
+
+- divided: OBS_MPF crosses mpf_threshold upwards (mitotic entry) and the
+  following OBS_APC_Ccdc20 activation peak above apc_threshold completes
+  mitosis
+- apoptotic: OBS_p53 stays above p53_threshold for p53_duration
+- arrested: no mitotic entry within arrest_time; the arrest is in G1 if
+  OBS_CycE never crossed cyce_threshold and in G2 otherwise
+
+The classifier only sees the states at the output times. When it knows the
+parameters (classify() passes them), it also evaluates the right-hand side
+there, and between two output times follows each observable along the cubic
+Hermite interpolant of its values and slopes: every threshold crossing and
+APC/Cdc20 peak (a zero of the interpolant's slope) on it is found with
+brentq, including excursions that start and end between two output times,
+and the events of one interval are handled in time order. The interpolant
+is fourth-order accurate in the output interval, so an excursion much
+shorter than it can still be missed; choose the output grid accordingly.
+Without the parameters (stochastic trajectories, stored observables fed to
+update()), crossings are interpolated linearly and the peak is the vertex
+of a parabola through the three samples around it. The result of each
+simulation is a compact FateRecord.
+"""
+
+from __future__ import division
+
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+from scipy.optimize import brentq
+
+from cell_cycle_integrate import add_stats, integrate
+
+FATES = ('divided', 'apoptotic', 'arrested', 'undecided')
+
+FateRecord = namedtuple('FateRecord', ['fate', 'time', 'arrest_phase', 'mpf_time',
+                                       'apc_time', 'p53_time', 'cyce_time', 't_final'])
+
+DEFAULT_THRESHOLDS = {
+    'mpf_threshold': 0.1,
+    'apc_threshold': 0.2,
+    'p53_threshold': 0.5,
+    'p53_duration': 500.0,
+    'cyce_threshold': 0.1,
+    'arrest_time': 3000.0,
+}
+
+_OBSERVABLES = ('OBS_MPF', 'OBS_APC_Ccdc20', 'OBS_p53', 'OBS_CycE')
+
+# Points per output interval at which the interpolant is scanned for
+# sign changes before they are refined with brentq
+SCAN_POINTS = 8
+
+
+def _crossing(t0, g0, t1, g1, level):
+    """Time at which the segment (t0, g0)-(t1, g1) crosses `level`"""
+    return t0 + (level - g0) * (t1 - t0) / (g1 - g0)
+
+
+def _peak(t0, a0, t1, a1, t2, a2):
+    """Abscissa of the vertex of the parabola through three samples"""
+    d = (t0 - t1) * (t0 - t2) * (t1 - t2)
+    A = (t2 * (a1 - a0) + t1 * (a0 - a2) + t0 * (a2 - a1)) / d
+    B = (t2 * t2 * (a0 - a1) + t1 * t1 * (a2 - a0) + t0 * t0 * (a1 - a2)) / d
+    return t1 if A >= 0 else min(max(-B / (2 * A), t0), t2)
+
+
+class _Segment(object):
+    """One observable between two output times: the cubic Hermite
+    interpolant of its values and slopes, or the straight line when the
+    slopes are not known"""
+
+    def __init__(self, t0, g0, d0, t1, g1, d1):
+        self.t0, self.g0, self.d0, self.t1, self.g1, self.d1 = t0, g0, d0, t1, g1, d1
+        self.cubic = d0 is not None and d1 is not None
+
+    def __call__(self, t):
+        h = self.t1 - self.t0
+        s = (t - self.t0) / h
+        if not self.cubic:
+            return self.g0 + s * (self.g1 - self.g0)
+        return ((1 + 2 * s) * (1 - s) ** 2 * self.g0 + s * (1 - s) ** 2 * h * self.d0 +
+                s * s * (3 - 2 * s) * self.g1 - s * s * (1 - s) * h * self.d1)
+
+    def slope(self, t):
+        h = self.t1 - self.t0
+        s = (t - self.t0) / h
+        return (6 * s * (s - 1) * (self.g0 - self.g1) / h + (1 - s) * (1 - 3 * s) * self.d0 +
+                s * (3 * s - 2) * self.d1)
+
+    def _scan(self, start):
+        n = SCAN_POINTS if self.cubic else 1
+        return np.linspace(start, self.t1, n + 1)
+
+    def crossings(self, level):
+        """(time, upward) for every crossing of `level`, in time order"""
+        if not self.cubic:
+            if (self.g0 < level) == (self.g1 < level):
+                return []
+            return [(_crossing(self.t0, self.g0, self.t1, self.g1, level), self.g0 < level)]
+        ts = self._scan(self.t0)
+        gs = [self.g0] + [self(t) for t in ts[1:-1]] + [self.g1]
+        out = []
+        for k in range(len(ts) - 1):
+            a, b = gs[k] - level, gs[k + 1] - level
+            if (a < 0) != (b < 0):
+                t = ts[k + 1] if b == 0 else \
+                    brentq(lambda t: self(t) - level, ts[k], ts[k + 1])
+                out.append((t, a < 0))
+        return out
+
+    def peaks(self, start):
+        """Times after `start` at which the cubic interpolant has a
+        maximum"""
+        ts = self._scan(start)
+        ds = [self.slope(t) for t in ts]
+        return [ts[k + 1] if ds[k + 1] == 0 else brentq(self.slope, ts[k], ts[k + 1])
+                for k in range(len(ts) - 1) if ds[k] > 0 >= ds[k + 1]]
+
+
+class FateClassifier(object):
+    """Stateful fate detector, usable as integrate()'s callback
+
+    Call it with (t, y) at increasing times; it returns True once the fate
+    is decided. record() gives the FateRecord at any point. With the
+    parameter vector `p` of the run, events between output times are
+    resolved on the cubic interpolant (see the module docstring); pass the
+    run's cell_cycle_inputs.Schedule as `schedule` so the slopes follow it.
+    p53 or CycE already above its threshold at the first time counts as
+    having risen then.
+    """
+
+    def __init__(self, system, p=None, schedule=None, **thresholds):
+        unknown = set(thresholds) - set(DEFAULT_THRESHOLDS)
+        if unknown:
+            raise TypeError("Unknown thresholds: %s" % ', '.join(sorted(unknown)))
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **thresholds)
+        rows = [system.observable_index(name) for name in _OBSERVABLES]
+        self._matrix = system.observable_matrix[rows]
+        self.system = system if p is not None else None
+        self.p = None if p is None else np.asarray(p, dtype=float)
+        self._inputs = None if schedule is None or p is None else schedule.bind(system)
+        self.reset()
+
+    def reset(self):
+        self.fate = None
+        self.time = None
+        self.arrest_phase = None
+        self.mpf_time = self.apc_time = self.p53_time = self.cyce_time = None
+        self.t_start = None
+        self.t_last = None
+        self._last = None
+        self._apc = []
+
+    def __call__(self, t, y):
+        slopes = None
+        if self._inputs is not None:
+            p = self._inputs.parameters_at(t, self.p)
+            slopes = self._matrix.dot(self._inputs.rhs(t, y, p))
+        elif self.system is not None:
+            slopes = self._matrix.dot(self.system.rhs(y, self.p))
+        return self.update(t, self._matrix.dot(y), slopes)
+
+    def update(self, t, obs, slopes=None):
+        """Feed the observables (MPF, APC_Ccdc20, p53, CycE) at time t, and
+        optionally their time derivatives"""
+        th = self.thresholds
+        obs = tuple(obs)
+        slopes = None if slopes is None else tuple(slopes)
+        if self.t_start is None:
+            # a run may start with p53 or CycE already up (e.g. from a
+            # relaxed cycle state): that counts from the first sample
+            self.t_start = t
+            if obs[2] >= th['p53_threshold']:
+                self.p53_time = t
+            if obs[3] >= th['cyce_threshold']:
+                self.cyce_time = t
+        elif self.fate is None:
+            self._interval(t, obs, slopes)
+        if self.fate is None and slopes is None and self.mpf_time is not None:
+            self._apc = (self._apc + [(t, obs[1])])[-3:]
+            if len(self._apc) == 3:
+                (ta, a0), (tb, a1), (tc, a2) = self._apc
+                if a1 >= a0 and a1 > a2 and a1 >= th['apc_threshold']:
+                    self.apc_time = _peak(ta, a0, tb, a1, tc, a2)
+                    self._decide('divided', self.apc_time)
+        self._apoptosis(t)
+
+        self._last = (t, obs, slopes)
+        self.t_last = t
+        return self.fate is not None
+
+    def _interval(self, t, obs, slopes):
+        """Handle the events between the previous update and time t in
+        time order"""
+        th = self.thresholds
+        t0, obs0, slopes0 = self._last
+        if slopes0 is None or slopes is None:
+            slopes0 = slopes = (None,) * 4
+        mpf, apc, p53, cyce = [_Segment(t0, obs0[i], slopes0[i], t, obs[i], slopes[i])
+                               for i in range(4)]
+        events = [(tc, 'p53', up) for tc, up in p53.crossings(th['p53_threshold'])]
+        if self.mpf_time is None:
+            events += [(tc, 'mpf', None) for tc, up in mpf.crossings(th['mpf_threshold'])
+                       if up][:1]
+            t_arrest = self.t_start + th['arrest_time']
+            if t0 < t_arrest <= t:
+                events.append((t_arrest, 'arrest', None))
+        if self.cyce_time is None:
+            events += [(tc, 'cyce', None) for tc, up in cyce.crossings(th['cyce_threshold'])
+                       if up][:1]
+        for tc, kind, up in sorted(events, key=lambda event: event[0]):
+            if self._apoptosis(tc):
+                return
+            if kind == 'mpf':
+                self.mpf_time = tc
+                self._apc = []
+            elif kind == 'cyce':
+                self.cyce_time = tc
+            elif kind == 'p53':
+                self.p53_time = tc if up else None
+            elif self.mpf_time is None:
+                self.arrest_phase = 'G1' if self.cyce_time is None else 'G2'
+                self._decide('arrested', tc)
+                return
+        if self.mpf_time is not None and apc.cubic:
+            for tp in apc.peaks(max(t0, self.mpf_time)):
+                if apc(tp) >= th['apc_threshold'] and not self._apoptosis(tp):
+                    self.apc_time = tp
+                    self._decide('divided', tp)
+                    return
+
+    def _apoptosis(self, t):
+        """Decide apoptosis if p53 has been above its threshold for
+        p53_duration by time t"""
+        if self.fate is None and self.p53_time is not None and \
+                t - self.p53_time >= self.thresholds['p53_duration']:
+            self._decide('apoptotic', self.p53_time + self.thresholds['p53_duration'])
+        return self.fate is not None
+
+    def _decide(self, fate, time):
+        self.fate, self.time = fate, time
+
+    def record(self):
+        return FateRecord(self.fate or 'undecided', self.time, self.arrest_phase, self.mpf_time,
+                          self.apc_time, self.p53_time, self.cyce_time, self.t_last)
+
+
+def classify(system, tspan, p=None, y0=None, method='auto', thresholds=None, **solver_options):
+    """Integrate until the fate is decided (or tspan ends)
+
+    Returns (FateRecord, stats) where stats are integrate()'s statistics.
+    """
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    classifier = FateClassifier(system, p, solver_options.get('schedule'), **(thresholds or {}))
+    _, stats = integrate(system, tspan, p, y0, method=method, callback=classifier,
+                         **solver_options)
+    return classifier.record(), stats
+
+
+# Per-process state for classify_fates()
+_worker = None
+
+
+def _init_worker(system, tspan, method, thresholds, solver_options):
+    global _worker
+    _worker = (system, tspan, method, thresholds, solver_options)
+
+
+def _classify_block(block):
+    """FateRecords of the parameter vectors in `block` and the sum of their
+    solver counters"""
+    system, tspan, method, thresholds, solver_options = _worker
+    records, counters = [], {}
+    for p in block:
+        record, stats = classify(system, tspan, p, method=method, thresholds=thresholds,
+                                 **solver_options)
+        records.append(record)
+        add_stats(counters, stats)
+    return records, counters
+
+
+def imap_fates(system, tspan, blocks, processes=None, method='auto', thresholds=None,
+               stats=None, **solver_options):
+    """Classify blocks of parameter vectors over a process pool, yielding one
+    list of FateRecords per block, in order, as soon as it is ready
+
+    Each block is an array of shape (m, n_parameters) and is handled by a
+    single worker; every worker receives `system` once. If a dict is given
+    as `stats`, the solver counters of every run are added into it.
+    """
+    stats = {} if stats is None else stats
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    initargs = (system, tspan, method, thresholds, solver_options)
+    if processes == 1:
+        _init_worker(*initargs)
+        for block in blocks:
+            records, counters = _classify_block(block)
+            add_stats(stats, counters)
+            yield records
+        return
+    pool = multiprocessing.Pool(processes, _init_worker, initargs)
+    try:
+        for records, counters in pool.imap(_classify_block, blocks):
+            add_stats(stats, counters)
+            yield records
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def classify_fates(system, tspan, p, processes=None, method='auto', thresholds=None,
+                   **solver_options):
+    """Classify the fate of every parameter vector in `p` (shape (N,
+    n_parameters)) over a process pool; returns a list of FateRecords"""
+    p = np.atleast_2d(p)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(p)))
+    n_blocks = 1 if processes == 1 else min(len(p), 4 * processes)
+    records = []
+    for block in imap_fates(system, tspan, np.array_split(p, n_blocks), processes, method,
+                            thresholds, **solver_options):
+        records.extend(block)
+    return records
+
+
+def fate_table(records):
+    """Pack FateRecords into a record array; missing times become NaN"""
+    dtype = [('fate', 'S10'), ('time', float), ('arrest_phase', 'S2'), ('mpf_time', float),
+             ('apc_time', float), ('p53_time', float), ('cyce_time', float), ('t_final', float)]
+    nan = float('nan')
+    rows = [(r.fate, nan if r.time is None else r.time, r.arrest_phase or '',
+             nan if r.mpf_time is None else r.mpf_time, nan if r.apc_time is None else r.apc_time,
+             nan if r.p53_time is None else r.p53_time, nan if r.cyce_time is None else r.cyce_time,
+             r.t_final) for r in records]
+    return np.array(rows, dtype=dtype).view(np.recarray)
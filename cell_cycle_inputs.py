@@ -0,0 +1,165 @@
+"""Time-varying inputs such as DNA damage schedules.
+
+set_dna_damage() fixes DDS_0 for a whole run: DDS_0 is the initial amount
+of Signal and SignalDamp, which then decay by the signal degradation rules
+of G1_S_v2. A Schedule instead describes how inputs change during one
+integration:
+
+- set(t, name, value): from time t on, parameter `name` has `value`, or
+  species `name` jumps to `value`
+- add(t, name, amount): species `name` jumps by `amount` (e.g. a dose)
+- function(name, f): parameter or species `name` follows f(t) continuously;
+  a forced species is held at f(t) and its own dynamics are ignored
+
+Pass it to cell_cycle_integrate.integrate(schedule=...). The times of set()
+and add() are breakpoints: the integrator stops exactly there, applies the
+change and restarts from the new state with its existing stepper, so no
+Jacobian structure or solver is rebuilt between segments.
+"""
+
+from __future__ import division
+
+import numpy as np
+import scipy.sparse
+
+DAMAGE_PARAMETER = 'DDS_0'
+DAMAGE_SPECIES = ('Signal()', 'SignalDamp()')
+
+
+class Schedule(object):
+    """Piecewise-constant, impulsive and functional inputs over time"""
+
+    def __init__(self):
+        self.events = []
+        self.functions = {}
+
+    def set(self, t, name, value):
+        self.events.append((float(t), len(self.events), 'set', name, float(value)))
+        return self
+
+    def add(self, t, name, amount):
+        self.events.append((float(t), len(self.events), 'add', name, float(amount)))
+        return self
+
+    def function(self, name, f):
+        self.functions[name] = f
+        return self
+
+    def bind(self, system):
+        return _BoundSchedule(self, system)
+
+
+def damage_schedule(steps):
+    """Schedule resetting DNA damage to `level` at each (time, level) in
+    `steps`, through DDS_0 and the Signal species it initializes"""
+    schedule = Schedule()
+    for t, level in steps:
+        for name in (DAMAGE_PARAMETER,) + DAMAGE_SPECIES:
+            schedule.set(t, name, level)
+    return schedule
+
+
+def damage_pulses(times, dose):
+    """Schedule adding `dose` of damage signal at each of `times`, such as
+    repeated irradiation or drug dosing"""
+    schedule = Schedule()
+    for t in times:
+        for name in DAMAGE_SPECIES:
+            schedule.add(t, name, dose)
+    return schedule
+
+
+class _BoundSchedule(object):
+    """A Schedule resolved against the names of one OdeSystem"""
+
+    def __init__(self, schedule, system):
+        self.system = system
+        self.events = []
+        for t, _, kind, name, value in sorted(schedule.events):
+            is_parameter, index = self._resolve(name)
+            if kind == 'add' and is_parameter:
+                raise ValueError("Cannot add to parameter %r; use set()" % name)
+            self.events.append((t, kind, is_parameter, index, value))
+        self.breakpoints = np.unique([e[0] for e in self.events])
+        self.parameter_functions, self.species_functions = [], []
+        for name, f in sorted(schedule.functions.items()):
+            is_parameter, index = self._resolve(name)
+            (self.parameter_functions if is_parameter else self.species_functions).append(
+                (index, f))
+        self.forced = np.array([i for i, _ in self.species_functions], dtype=int)
+        if len(self.forced):
+            free = np.ones(system.n_species)
+            free[self.forced] = 0.0
+            self._free = scipy.sparse.diags(free, format='csc')
+
+    def _resolve(self, name):
+        if name in self.system.parameter_names:
+            return True, self.system.parameter_index(name)
+        if name in self.system.species_names:
+            return False, self.system.species_names.index(name)
+        raise ValueError("%r is neither a parameter nor a species" % name)
+
+    def start(self, t0, y, p):
+        """Apply every event up to and including t0; returns (y, p)"""
+        y, p = np.array(y, dtype=float), np.array(p, dtype=float)
+        for t, kind, is_parameter, index, value in self.events:
+            if t <= t0:
+                self._apply(kind, is_parameter, index, value, y, p)
+        return self._force(t0, y), p
+
+    def apply(self, t_break, y, p):
+        """Apply the events at breakpoint t_break; returns new (y, p)"""
+        y, p = np.array(y, dtype=float), np.array(p, dtype=float)
+        for t, kind, is_parameter, index, value in self.events:
+            if t == t_break:
+                self._apply(kind, is_parameter, index, value, y, p)
+        return self._force(t_break, y), p
+
+    def parameters_at(self, t, p):
+        """`p` with the parameter changes of every event up to and including
+        t applied"""
+        p = np.array(p, dtype=float)
+        for te, kind, is_parameter, index, value in self.events:
+            if te <= t and is_parameter:
+                p[index] = value
+        return p
+
+    @staticmethod
+    def _apply(kind, is_parameter, index, value, y, p):
+        if is_parameter:
+            p[index] = value
+        elif kind == 'set':
+            y[index] = value
+        else:
+            y[index] += value
+
+    def _force(self, t, y):
+        for index, f in self.species_functions:
+            y[index] = f(t)
+        return y
+
+    def parameters(self, t, p):
+        if not self.parameter_functions:
+            return p
+        p = p.copy()
+        for index, f in self.parameter_functions:
+            p[index] = f(t)
+        return p
+
+    def rhs(self, t, y, p):
+        p = self.parameters(t, p)
+        if not len(self.forced):
+            return self.system.rhs(y, p)
+        y = self._force(t, np.array(y, dtype=float))
+        dy = self.system.rhs(y, p)
+        h = 1e-6 * max(1.0, abs(t))
+        for index, f in self.species_functions:
+            dy[index] = (f(t + h) - f(t - h)) / (2 * h)
+        return dy
+
+    def jacobian_matrix(self, t, y, p):
+        p = self.parameters(t, p)
+        if not len(self.forced):
+            return self.system.jacobian_matrix(y, p)
+        J = self.system.jacobian_matrix(self._force(t, np.array(y, dtype=float)), p)
+        return (self._free * J * self._free).tocsc()
@@ -0,0 +1,283 @@
+"""Memoized simulation results, keyed on everything that determines them.
+
+Notebooks and scripts keep re-running the same DDS_0 / rate constant
+combinations. memo_odesolve() (for pysb models, a drop-in for odesolve()
+that integrates the model's OdeSystem) and memo_integrate() (for
+OdeSystems and cell_cycle_integrate)
+look every run up in a ResultCache first. The key is a hash of
+
+- the reaction network (network_key() of the model, or the rate laws and
+  stoichiometry of the OdeSystem)
+- the full parameter vector and the initial conditions (None: the model's)
+- the time grid
+- the integrate() options (tolerances, method, ...), which must be plain
+  data (numbers, strings, None and lists or arrays of them); a profiler is
+  left out, since it does not change the result
+
+so only a truly identical request is served from the cache. Results live in
+memory (the most recently used, up to `memory_bytes` of arrays) and on disk
+as .npz files, evicted least-recently-used beyond `max_bytes`. The disk
+tier is pruned every `prune_every` writes, or as soon as the bytes written
+since the last pruning could take it over `max_bytes`.
+
+Runs that are merely close can still benefit: nearest() finds the cached
+run of the same network with the most similar parameter vector, and
+warm_start() returns its state at a given time, e.g. as the initial guess of
+cell_cycle_continuation.steady_state() or limit_cycle().
+"""
+
+from __future__ import division
+
+import hashlib
+import io
+import numbers
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from cell_cycle_cache import (DEFAULT_CACHE_DIR, atomic_write, cached_generate_equations,
+                              network_key, prune_cache)
+from cell_cycle_codegen import source_key
+from cell_cycle_integrate import integrate, observable_array
+from cell_cycle_sweep import ode_system
+
+MEMO_FORMAT = 2
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+# Options that do not change the result and are left out of keys
+UNKEYED_OPTIONS = ('profiler',)
+
+
+def _plain(name, value):
+    """Stable text of an option value, which must be plain data"""
+    if value is None or isinstance(value, (bool, str, type(u''))):
+        return repr(value)
+    if isinstance(value, numbers.Integral):
+        return repr(int(value))
+    if isinstance(value, numbers.Real):
+        return repr(float(value))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(_plain(name, v) for v in value)
+    if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+        return 'array(%s, %s)' % (value.shape, hashlib.sha1(
+            np.ascontiguousarray(value, dtype=float).tobytes()).hexdigest())
+    raise TypeError("Cannot key option %s=%r: only numbers, strings, None and lists or "
+                    "arrays of them can be" % (name, value))
+
+
+def result_key(network, params, y0, tspan, options):
+    """Hex digest identifying one simulation request; raises TypeError for
+    an option that is not plain data"""
+    h = hashlib.sha1(('cell_cycle result %d %s\n' % (MEMO_FORMAT, network)).encode('utf-8'))
+    h.update(np.asarray(params, dtype=float).tobytes())
+    h.update(b'y0' if y0 is None else np.asarray(y0, dtype=float).tobytes())
+    h.update(np.asarray(tspan, dtype=float).tobytes())
+    for name in sorted(options):
+        if name not in UNKEYED_OPTIONS:
+            h.update(('%s=%s\n' % (name, _plain(name, options[name]))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _nbytes(entry):
+    return sum(value.nbytes for value in entry.values())
+
+
+def _distance(p, q):
+    """RMS of the relative differences of two parameter vectors"""
+    scale = np.maximum(np.maximum(abs(p), abs(q)), 1e-300)
+    return np.sqrt(np.mean(((p - q) / scale) ** 2))
+
+
+class ResultCache(object):
+    """Two-level (memory, disk) LRU store of simulation results
+
+    An entry holds the arrays `params`, `tspan` and whatever the caller
+    stores with it (species trajectories 'y', observables 'yobs', ...),
+    plus the network it belongs to. Pass cache_dir=False for memory only.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES,
+                 memory_bytes=DEFAULT_MEMORY_BYTES, prune_every=32):
+        if cache_dir is None:
+            cache_dir = os.path.join(DEFAULT_CACHE_DIR, 'results')
+        self.cache_dir = cache_dir or None
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.prune_every = prune_every
+        self.hits = self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = None  # estimate; None until the first pruning
+        self._puts = 0
+        self._index = None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, 'result-%s.npz' % key)
+
+    def _remember(self, key, entry):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= _nbytes(old)
+        self._memory[key] = entry
+        self._memory_used += _nbytes(entry)
+        while self._memory_used > self.memory_bytes and self._memory:
+            self._memory_used -= _nbytes(self._memory.popitem(last=False)[1])
+
+    def get(self, key):
+        """The entry stored under `key` as a dict of arrays, or None"""
+        entry = self._memory.get(key)
+        if entry is None and self.cache_dir is not None:
+            try:
+                with np.load(self._path(key)) as data:
+                    entry = dict((name, data[name]) for name in data.files)
+                os.utime(self._path(key), None)
+            except (IOError, OSError, ValueError):
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(key, entry)
+        return dict((name, value.copy()) for name, value in entry.items())
+
+    def put(self, key, network, params, tspan, **arrays):
+        entry = dict((name, np.asarray(value)) for name, value in arrays.items())
+        entry['network'] = np.array(network)
+        entry['params'] = np.asarray(params, dtype=float)
+        entry['tspan'] = np.asarray(tspan, dtype=float)
+        self._remember(key, entry)
+        if self.cache_dir is not None:
+            buf = io.BytesIO()
+            np.savez(buf, **entry)
+            data = buf.getvalue()
+            atomic_write(self._path(key), data)
+            self._puts += 1
+            if self._disk_used is not None:
+                self._disk_used += len(data)
+            if self._disk_used is None or self._disk_used > self.max_bytes or \
+                    self._puts >= self.prune_every:
+                self._disk_used = prune_cache(self.cache_dir, self.max_bytes, suffix='.npz')
+                self._puts = 0
+        if self._index is not None:
+            self._index[key] = (str(network), entry['params'])
+
+    def _load_index(self):
+        """key -> (network, params) of every stored entry, read once"""
+        if self._index is None:
+            self._index = {}
+            names = os.listdir(self.cache_dir) if self.cache_dir is not None and \
+                os.path.isdir(self.cache_dir) else []
+            for name in names:
+                if not (name.startswith('result-') and name.endswith('.npz')):
+                    continue
+                try:
+                    with np.load(os.path.join(self.cache_dir, name)) as data:
+                        self._index[name[7:-4]] = (str(data['network']), data['params'])
+                except (IOError, OSError, ValueError, KeyError):
+                    continue
+            for key, entry in self._memory.items():
+                self._index[key] = (str(entry['network']), entry['params'])
+        return self._index
+
+    def nearest(self, network, params):
+        """(distance, entry) of the cached run of `network` whose parameter
+        vector is closest to `params`, or (inf, None)"""
+        params = np.asarray(params, dtype=float)
+        best, best_key = np.inf, None
+        for key, (net, p) in list(self._load_index().items()):
+            if net == network and p.shape == params.shape:
+                d = _distance(params, p)
+                if d < best:
+                    best, best_key = d, key
+        entry = None if best_key is None else self.get(best_key)
+        if entry is None:
+            if best_key is not None:
+                del self._index[best_key]  # evicted from disk meanwhile
+            return np.inf, None
+        return best, entry
+
+
+def network_id(target):
+    """The network part of result keys for a pysb model or an OdeSystem"""
+    if hasattr(target, 'rate_exprs'):
+        # hashing every rate law costs more than a memory hit; do it once
+        # per system
+        key = getattr(target, '_network_id', None)
+        if key is None:
+            key = target._network_id = source_key(target)
+        return key
+    cached_generate_equations(target)
+    return network_key(target)
+
+
+def warm_start(cache, target, params, t=None, field='y'):
+    """Species state of the cached run of `target` (a model or OdeSystem)
+    with the closest parameter vector, at the time closest to t (default:
+    its last time point); returns (distance, state) or (inf, None)"""
+    distance, entry = cache.nearest(network_id(target), params)
+    if entry is None or field not in entry:
+        return np.inf, None
+    row = -1 if t is None else int(np.abs(entry['tspan'] - t).argmin())
+    return distance, entry[field][row]
+
+
+_default_cache = None
+
+
+def default_cache():
+    """The per-process ResultCache in the default cache directory"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
+
+
+# Per-process OdeSystems of the models seen, keyed on network
+_systems = {}
+
+
+def memo_odesolve(model, tspan, param_values=None, y0=None, cache=None, **options):
+    """odesolve() through a ResultCache (default: default_cache())
+
+    The model's OdeSystem is built once per process and integrated with
+    cell_cycle_integrate.integrate(), which gets the extra keyword
+    arguments. `param_values` is a full list in model order or a dict of
+    overrides. Returns the observable record array; the species
+    trajectories are cached with it for warm starts (as field 'y').
+    """
+    cache = default_cache() if cache is None else cache
+    network = network_id(model)
+    if network not in _systems:
+        _systems[network] = ode_system(model)
+    system = _systems[network]
+    if param_values is None or isinstance(param_values, dict):
+        param_values = system.parameter_vector(param_values)
+    key = result_key(network, param_values, y0, tspan, options)
+    entry = cache.get(key)
+    if entry is None:
+        y, _ = integrate(system, tspan, param_values, y0, **options)
+        entry = {'y': y, 'yobs': observable_array(system, y)}
+        cache.put(key, network, param_values, tspan, **entry)
+    return entry['yobs'].view(np.recarray)
+
+
+def memo_integrate(system, tspan, p=None, y0=None, cache=None, **options):
+    """cell_cycle_integrate.integrate() through a ResultCache
+
+    Returns (y, stats) like integrate(); on a hit stats is None. Runs with
+    a callback or schedule are not cached.
+    """
+    if options.get('callback') is not None or options.get('schedule') is not None:
+        return integrate(system, tspan, p, y0, **options)
+    cache = default_cache() if cache is None else cache
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    network = network_id(system)
+    key = result_key(network, p, y0, tspan, options)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry['y'], None
+    y, stats = integrate(system, tspan, p, y0, **options)
+    cache.put(key, network, p, tspan, y=y)
+    return y, stats
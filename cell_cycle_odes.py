@@ -0,0 +1,328 @@
+"""Vectorized evaluation of the generated cell cycle ODEs.
+
+pysb's Solver evaluates the right-hand side for one parameter set at a time.
+OdeSystem turns a generated network into rate laws over a species vector y
+and a parameter vector p (observables and Expressions such as create_Mdm2
+are substituted in), a stoichiometry matrix and the analytic sparsity
+pattern of the Jacobian. Every method accepts leading batch dimensions:
+with y of shape (N, n_species) and p of shape (N, n_parameters) one call
+evaluates all N right-hand sides or Jacobians at once.
+"""
+
+from __future__ import division
+
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import scipy.sparse
+import sympy
+from scipy.integrate import solve_ivp
+
+from cell_cycle_cache import (DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, atomic_write,
+                              cached_generate_equations, network_key, prune_cache)
+
+SYSTEM_FORMAT = 1
+
+
+def _fill(values, shape, n):
+    out = np.empty(shape + (n,))
+    for i, v in enumerate(values):
+        out[..., i] = v
+    return out
+
+
+def _system_path(model, cache_dir):
+    h = hashlib.sha1(('cell_cycle system %d\n%s\n' % (SYSTEM_FORMAT, network_key(model)))
+                     .encode('utf-8'))
+    for p in model.parameters:
+        h.update(('P %s\n' % p.name).encode('utf-8'))
+    return os.path.join(cache_dir, 'system-%s.pkl' % h.hexdigest())
+
+
+def _read_system(path):
+    try:
+        with open(path, 'rb') as f:
+            system = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    return system if isinstance(system, OdeSystem) else None
+
+
+class OdeSystem(object):
+    """Rate laws, stoichiometry and analytic Jacobian of a generated network
+
+    Build one with OdeSystem.from_model(model). The instance holds no pysb
+    objects, so it can be pickled and sent to worker processes.
+    """
+
+    def __init__(self, species_names, parameter_names, parameter_values,
+                 observable_names, observable_matrix, rate_exprs,
+                 stoichiometry, ic_species, ic_parameters):
+        self.species_names = list(species_names)
+        self.parameter_names = list(parameter_names)
+        self.parameters = np.array(parameter_values, dtype=float)
+        self.observable_names = list(observable_names)
+        self.observable_matrix = np.asarray(observable_matrix, dtype=float)
+        self.rate_exprs = list(rate_exprs)
+        self.stoichiometry = np.asarray(stoichiometry, dtype=float)
+        self.ic_species = np.asarray(ic_species, dtype=int)
+        self.ic_parameters = np.asarray(ic_parameters, dtype=int)
+
+        self.n_species = len(self.species_names)
+        self.n_parameters = len(self.parameter_names)
+        self.n_reactions = len(self.rate_exprs)
+        self._parameter_index = dict((name, i) for i, name in enumerate(self.parameter_names))
+        self._observable_index = dict((name, i) for i, name in enumerate(self.observable_names))
+        self.y_symbols = sympy.symbols('__s0:%d' % self.n_species) if self.n_species else ()
+        self.p_symbols = sympy.symbols('__p0:%d' % self.n_parameters) if self.n_parameters else ()
+        self._compile()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_rate_function', '_drate_function', '_dpdrate_function'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile_functions()
+        if 'dvp_exprs' in state:
+            self._dpdrate_function = sympy.lambdify((self.y_symbols, self.p_symbols),
+                                                    self.dvp_exprs, modules='numpy')
+
+    @classmethod
+    def from_model(cls, model, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        """Build the ODE system of a pysb model, generating its network
+        (through the network cache) if that has not happened yet
+
+        The system is cached next to the network (default cache directory:
+        that of cached_generate_equations()), keyed on the network structure
+        and the parameter names. A hit skips the network and the symbolic
+        work, leaving only the lambdify of unpickling, and does not
+        populate the model's network. Parameter values always come from
+        the model.
+        """
+        cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+        path = _system_path(model, cache_dir)
+        system = _read_system(path)
+        if system is None:
+            system = cls._build(model, cache_dir)
+            atomic_write(path, pickle.dumps(system, 2))
+            prune_cache(cache_dir, max_bytes)
+        else:
+            os.utime(path, None)
+        system.parameters = np.array([p.value for p in model.parameters], dtype=float)
+        return system
+
+    @classmethod
+    def _build(cls, model, cache_dir):
+        cached_generate_equations(model, cache_dir)
+        n_species = len(model.species)
+        y_symbols = sympy.symbols('__s0:%d' % n_species)
+        p_symbols = sympy.symbols('__p0:%d' % len(model.parameters))
+        params = dict((p.name, p_symbols[i]) for i, p in enumerate(model.parameters))
+        observables = dict((o.name, sum((c * y_symbols[s] for s, c in
+                                         zip(o.species, o.coefficients)), sympy.Integer(0)))
+                           for o in model.observables)
+        expressions = dict((e.name, e) for e in model.expressions)
+        expanded = {}
+
+        def resolve(symbol):
+            name = symbol.name
+            if name in params:
+                return params[name]
+            if name in observables:
+                return observables[name]
+            if name in expressions:
+                if name not in expanded:
+                    expanded[name] = substitute(expressions[name].expr)
+                return expanded[name]
+            if name.startswith('__s'):
+                return y_symbols[int(name[3:])]
+            raise ValueError("Cannot resolve symbol %r in a rate law" % name)
+
+        def substitute(expr):
+            expr = sympy.sympify(expr)
+            return expr.xreplace(dict((s, resolve(s)) for s in expr.free_symbols))
+
+        rate_exprs = []
+        stoichiometry = np.zeros((n_species, len(model.reactions)))
+        for j, rxn in enumerate(model.reactions):
+            rate_exprs.append(substitute(rxn['rate']))
+            for s in rxn['reactants']:
+                stoichiometry[s, j] -= 1
+            for s in rxn['products']:
+                stoichiometry[s, j] += 1
+
+        observable_matrix = np.zeros((len(model.observables), n_species))
+        for i, o in enumerate(model.observables):
+            for s, c in zip(o.species, o.coefficients):
+                observable_matrix[i, s] += c
+
+        param_index = dict((p.name, i) for i, p in enumerate(model.parameters))
+        ic_species, ic_parameters = [], []
+        for cp, param in model.initial_conditions:
+            ic_species.append(model.get_species_index(cp))
+            ic_parameters.append(param_index[param.name])
+
+        return cls([str(cp) for cp in model.species],
+                   [p.name for p in model.parameters],
+                   [p.value for p in model.parameters],
+                   [o.name for o in model.observables], observable_matrix,
+                   rate_exprs, stoichiometry, ic_species, ic_parameters)
+
+    def _compile(self):
+        """Derive the sparsity pattern of dv/dy and of the Jacobian"""
+        dv_rows, dv_cols, dv_exprs = [], [], []
+        for j, expr in enumerate(self.rate_exprs):
+            for k, y in enumerate(self.y_symbols):
+                if y in expr.free_symbols:
+                    dv_rows.append(j)
+                    dv_cols.append(k)
+                    # powsimp turns y**n/y into y**(n - 1), which is finite at y = 0
+                    dv_exprs.append(sympy.powsimp(sympy.diff(expr, y)))
+        self.dv_rows = np.array(dv_rows, dtype=int)
+        self.dv_cols = np.array(dv_cols, dtype=int)
+        self.dv_exprs = dv_exprs
+
+        # J = S . dv/dy; each Jacobian entry (i, k) is a fixed linear
+        # combination of dv/dy entries, held in the matrix _dv_to_jac
+        entries = {}
+        combos = []
+        for e, (j, k) in enumerate(zip(dv_rows, dv_cols)):
+            for i in np.nonzero(self.stoichiometry[:, j])[0]:
+                key = (int(i), k)
+                if key not in entries:
+                    entries[key] = len(entries)
+                combos.append((e, entries[key], self.stoichiometry[i, j]))
+        keys = sorted(entries, key=entries.get)
+        self.jac_rows = np.array([i for i, _ in keys], dtype=int)
+        self.jac_cols = np.array([k for _, k in keys], dtype=int)
+        self._dv_to_jac = scipy.sparse.csr_matrix(
+            ([c for _, _, c in combos], ([e for e, _, _ in combos], [n for _, n, _ in combos])),
+            shape=(len(dv_exprs), len(keys)))
+        self._compile_functions()
+
+    def _compile_functions(self):
+        args = (self.y_symbols, self.p_symbols)
+        self._rate_function = sympy.lambdify(args, self.rate_exprs, modules='numpy')
+        self._drate_function = sympy.lambdify(args, self.dv_exprs, modules='numpy')
+
+    @property
+    def jac_nnz(self):
+        return len(self.jac_rows)
+
+    def parameter_index(self, name):
+        return self._parameter_index[name]
+
+    def observable_index(self, name):
+        return self._observable_index[name]
+
+    def parameter_vector(self, overrides=None):
+        """Return the default parameter vector with `overrides` (a dict of
+        parameter name -> value) applied"""
+        p = self.parameters.copy()
+        for name, value in (overrides or {}).items():
+            p[self.parameter_index(name)] = value
+        return p
+
+    def parameter_matrix(self, overrides):
+        """Stack parameter_vector(o) for every dict o in `overrides` into an
+        array of shape (len(overrides), n_parameters)"""
+        return np.array([self.parameter_vector(o) for o in overrides])
+
+    def initial_values(self, p=None):
+        """Initial species values for parameter vector(s) `p`"""
+        p = self.parameters if p is None else np.asarray(p, dtype=float)
+        y0 = np.zeros(p.shape[:-1] + (self.n_species,))
+        y0[..., self.ic_species] = p[..., self.ic_parameters]
+        return y0
+
+    def _call(self, function, y, p, n):
+        y = np.asarray(y, dtype=float)
+        p = np.asarray(p, dtype=float)
+        shape = np.broadcast(y[..., 0], p[..., 0]).shape
+        values = function(np.moveaxis(y, -1, 0), np.moveaxis(p, -1, 0))
+        return _fill(values, shape, n)
+
+    def rates(self, y, p):
+        """Reaction rates, shape (..., n_reactions)"""
+        return self._call(self._rate_function, y, p, self.n_reactions)
+
+    def rhs(self, y, p):
+        """dy/dt, shape (..., n_species)"""
+        return self.rates(y, p).dot(self.stoichiometry.T)
+
+    def jacobian(self, y, p):
+        """Nonzero Jacobian entries at (jac_rows, jac_cols), shape (..., jac_nnz)"""
+        dv = self._call(self._drate_function, y, p, len(self.dv_exprs))
+        flat = dv.reshape(-1, dv.shape[-1])
+        return np.asarray(self._dv_to_jac.T.dot(flat.T).T).reshape(dv.shape[:-1] + (self.jac_nnz,))
+
+    def jacobian_matrix(self, y, p):
+        """Jacobian of a single state as a scipy.sparse CSC matrix"""
+        return scipy.sparse.csc_matrix((self.jacobian(y, p), (self.jac_rows, self.jac_cols)),
+                                       shape=(self.n_species, self.n_species))
+
+    def _compile_parameter_derivatives(self):
+        """Derive dv/dp on first use; most callers never need it"""
+        rows, cols, exprs = [], [], []
+        for j, expr in enumerate(self.rate_exprs):
+            for k, q in enumerate(self.p_symbols):
+                if q in expr.free_symbols:
+                    rows.append(j)
+                    cols.append(k)
+                    exprs.append(sympy.powsimp(sympy.diff(expr, q)))
+        self.dvp_rows = np.array(rows, dtype=int)
+        self.dvp_cols = np.array(cols, dtype=int)
+        self.dvp_exprs = exprs
+        self._dpdrate_function = sympy.lambdify((self.y_symbols, self.p_symbols), exprs,
+                                                modules='numpy')
+
+    def parameter_jacobian(self, y, p):
+        """d(dy/dt)/dp, shape (..., n_species, n_parameters)"""
+        if not hasattr(self, 'dvp_exprs'):
+            self._compile_parameter_derivatives()
+        # Derivatives by a Hill exponent contain y**n*log(y), which is nan at
+        # y = 0 but tends to 0 there
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dvp = self._call(self._dpdrate_function, y, p, len(self.dvp_exprs))
+        dvp[np.isnan(dvp)] = 0.0
+        dv = np.zeros(dvp.shape[:-1] + (self.n_reactions, self.n_parameters))
+        dv[..., self.dvp_rows, self.dvp_cols] = dvp
+        return np.einsum('ij,...jk->...ik', self.stoichiometry, dv)
+
+    def observables(self, y):
+        """Observable values, shape (..., n_observables)"""
+        return np.asarray(y).dot(self.observable_matrix.T)
+
+
+def integrate_ensemble(system, tspan, p, y0=None, rtol=1e-6, atol=1e-9):
+    """Integrate N parameter/initial-condition sets as one stiff system
+
+    `p` has shape (N, n_parameters) and `y0` (default: initial_values(p))
+    shape (N, n_species). Every step costs one batched rhs() call and the
+    block-diagonal Jacobian one batched jacobian() call. Returns species
+    trajectories of shape (N, len(tspan), n_species).
+    """
+    p = np.atleast_2d(np.asarray(p, dtype=float))
+    y0 = system.initial_values(p) if y0 is None else np.atleast_2d(y0)
+    N, n = y0.shape
+    offsets = (np.arange(N) * n)[:, None]
+    rows = (offsets + system.jac_rows).ravel()
+    cols = (offsets + system.jac_cols).ravel()
+
+    def fun(t, y):
+        return system.rhs(y.reshape(N, n), p).ravel()
+
+    def jac(t, y):
+        return scipy.sparse.csc_matrix((system.jacobian(y.reshape(N, n), p).ravel(),
+                                        (rows, cols)), shape=(N * n, N * n))
+
+    sol = solve_ivp(fun, (tspan[0], tspan[-1]), y0.ravel(), method='BDF', t_eval=tspan,
+                    jac=jac, rtol=rtol, atol=atol)
+    if not sol.success:
+        raise RuntimeError("Ensemble integration failed: %s" % sol.message)
+    return sol.y.T.reshape(len(tspan), N, n).transpose(1, 0, 2)
@@ -0,0 +1,142 @@
+"""Headless rendering of saved simulation results.
+
+Figures are described by FigureSpecs and rendered from a trajectory store
+(see cell_cycle_store) by a process pool, using matplotlib's object-oriented
+API on the Agg canvas so no display or interactive backend is involved.
+Each PNG gets a .sha1 sidecar holding a digest of the plotted data, the spec
+and the style; a figure is only redrawn when that digest changes. Restyling
+a plot therefore redraws it from the saved results without re-simulating,
+and untouched figures are skipped entirely.
+
+Usage: python cell_cycle_plots.py STORE [OUTDIR]
+"""
+
+import hashlib
+import multiprocessing
+import os
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from cell_cycle_cache import atomic_write, makedirs
+from cell_cycle_store import TrajectoryReader
+
+STYLE = {
+    'linewidth': 3,
+    'legend_size': 16,
+    'label_size': 22,
+    'tick_size': 18,
+    'title_size': 22,
+    'xlabel': "Time (arbitrary units)",
+}
+
+PROTEIN_OBSERVABLES = ["OBS_p27", "OBS_CycE", "OBS_CycA", "OBS_CycB", "OBS_aCycE_CDK2"]
+APC_OBSERVABLES = ["OBS_APC_Ccdc20"]
+
+FigureSpec = namedtuple('FigureSpec', ['filename', 'run', 'observables', 'labels', 'title',
+                                       'ylabel', 'legend_loc'])
+
+
+def _label(obs):
+    return re.match(r"OBS_(\w+)", obs).group(1)
+
+
+def damage_figures(damage_levels):
+    """The two standard figures per damage level of run_cell_cycle.py
+
+    `damage_levels` is a list of (DDS_0, name, APC legend location), in the
+    order the runs were stored.
+    """
+    specs = []
+    for run, (level, name, apc_loc) in enumerate(damage_levels):
+        title = "Protein Dynamics (DNA Damage = %g)" % level
+        specs.append(FigureSpec("Whole Cell Cycle %s DNA Damage1.png" % name, run,
+                                PROTEIN_OBSERVABLES, [_label(o) for o in PROTEIN_OBSERVABLES],
+                                title, "Protein Level", 0))
+        specs.append(FigureSpec("Whole Cell Cycle %s DNA Damage2.png" % name, run,
+                                APC_OBSERVABLES, ["APC_Cdc20"], title,
+                                "Protein Level (APC_Cdc20)", apc_loc))
+    return specs
+
+
+def _digest(tspan, data, spec, style):
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(tspan, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(data, dtype=float).tobytes())
+    h.update(repr((tuple(spec), sorted(style.items()))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def render_figure(store, spec, outdir, style=STYLE, force=False):
+    """Render one figure unless its sidecar digest is unchanged; returns
+    True if the figure was (re)drawn"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    reader = TrajectoryReader(store)
+    data = reader.run(spec.run, spec.observables)
+    path = os.path.join(outdir, spec.filename)
+    digest = _digest(reader.tspan, data, spec, style)
+    if not force and os.path.exists(path):
+        try:
+            with open(path + '.sha1') as f:
+                if f.read().strip() == digest:
+                    return False
+        except IOError:
+            pass
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    for label, y in zip(spec.labels, data):
+        ax.plot(reader.tspan, y, label=label, linewidth=style['linewidth'])
+    ax.legend(loc=spec.legend_loc, prop={'size': style['legend_size']})
+    ax.set_xlabel(style['xlabel'], fontsize=style['label_size'])
+    ax.set_ylabel(spec.ylabel, fontsize=style['label_size'])
+    ax.tick_params(labelsize=style['tick_size'])
+    ax.set_title(spec.title, fontsize=style['title_size'])
+    makedirs(outdir)
+    fig.savefig(path, format='png')
+    atomic_write(path + '.sha1', digest.encode('utf-8'))
+    return True
+
+
+def _render(args):
+    return render_figure(*args)
+
+
+def render_figures(store, specs, outdir='.', processes=None, style=STYLE, force=False):
+    """Render `specs` from `store` into `outdir` over a process pool
+
+    Returns the filenames that were redrawn; unchanged figures are skipped.
+    """
+    jobs = [(store, spec, outdir, style, force) for spec in specs]
+    if not jobs:
+        return []
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(jobs)))
+    if processes == 1:
+        drawn = [_render(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            drawn = pool.map(_render, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    return [spec.filename for spec, redrawn in zip(specs, drawn) if redrawn]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__.strip().splitlines()[-1])
+    reader = TrajectoryReader(sys.argv[1])
+    levels = reader.metadata.get('damage_levels')
+    if not levels:
+        sys.exit("%s has no damage_levels metadata to build figures from" % sys.argv[1])
+    for filename in render_figures(sys.argv[1], damage_figures(levels),
+                                   sys.argv[2] if len(sys.argv) == 3 else '.'):
+        print("Rendered %s" % filename)
@@ -0,0 +1,185 @@
+"""Vectorized simulation of a proliferating cell population.
+
+Every living cell runs the Iwamoto network with its own parameter vector.
+Cells are rows of one state matrix of shape (n_cells, n_species) and are
+integrated together as a single block-diagonal system by the sparse ROS2
+Rosenbrock method of cell_cycle_integrate. The population is checked every
+`dt` for events, with the same criteria as cell_cycle_fate:
+
+- division: OBS_MPF crosses mpf_threshold upwards and the following
+  OBS_APC_Ccdc20 peak above apc_threshold completes mitosis. The species of
+  the mother are split between two daughters by fractions drawn around 1/2
+  (spread `partition_noise`); each daughter has half the volume, so a
+  daughter receiving fraction f has concentrations 2 f y.
+- death: OBS_p53 stays above p53_threshold for p53_duration, or OBS_Int
+  exceeds int_threshold.
+
+When the population would exceed `max_cells`, cells are removed at random
+to keep it at that size. The lineage (parent, generation, birth and end
+times and fate of every cell ever simulated) is kept as flat arrays, not as
+per-cell objects.
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse
+
+from cell_cycle_fate import DEFAULT_THRESHOLDS as FATE_THRESHOLDS
+from cell_cycle_integrate import _Rosenbrock
+
+DEFAULT_THRESHOLDS = dict((key, FATE_THRESHOLDS[key]) for key in
+                          ('mpf_threshold', 'apc_threshold', 'p53_threshold', 'p53_duration'))
+DEFAULT_THRESHOLDS['int_threshold'] = np.inf
+
+LINEAGE_FATES = ('alive', 'divided', 'dead', 'removed')
+
+_OBSERVABLES = ('OBS_MPF', 'OBS_APC_Ccdc20', 'OBS_p53', 'OBS_Int')
+
+PopulationResult = namedtuple('PopulationResult', ['times', 'alive', 'divisions', 'deaths',
+                                                   'lineage', 'ids', 'states', 'parameters',
+                                                   'stats'])
+
+
+class _Lineage(object):
+    """Append-only lineage records, indexed by cell id"""
+
+    def __init__(self):
+        self.parent, self.generation, self.birth, self.end, self.fate = [], [], [], [], []
+
+    def add(self, parents, generations, t):
+        first = len(self.parent)
+        self.parent.extend(parents)
+        self.generation.extend(generations)
+        self.birth.extend([t] * len(parents))
+        self.end.extend([np.nan] * len(parents))
+        self.fate.extend([0] * len(parents))
+        return np.arange(first, len(self.parent))
+
+    def finish(self, ids, t, fate):
+        for i in ids:
+            self.end[i] = t
+            self.fate[i] = LINEAGE_FATES.index(fate)
+
+    def table(self):
+        dtype = [('id', int), ('parent', int), ('generation', int), ('birth', float),
+                 ('end', float), ('fate', 'S7')]
+        rows = [(i, self.parent[i], self.generation[i], self.birth[i], self.end[i],
+                 LINEAGE_FATES[self.fate[i]]) for i in range(len(self.parent))]
+        return np.array(rows, dtype=dtype).view(np.recarray)
+
+
+def simulate_population(system, t_end, p=None, y0=None, n_cells=1, dt=1.0, max_cells=10000,
+                        partition_noise=0.0, thresholds=None, seed=None, rtol=1e-6, atol=1e-9):
+    """Simulate a population from `n_cells` founder cells until `t_end`
+
+    `p` is one parameter vector or one per founder; daughters inherit
+    their mother's. `y0` defaults to system.initial_values(p). Returns a
+    PopulationResult with the number of living cells and the cumulative
+    divisions and deaths at every check time, the lineage table, and the
+    ids, states and parameters of the cells alive at the end.
+    """
+    th = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    unknown = set(th) - set(DEFAULT_THRESHOLDS)
+    if unknown:
+        raise TypeError("Unknown thresholds: %s" % ', '.join(sorted(unknown)))
+    rng = np.random.RandomState(seed)
+    n = system.n_species
+    P = np.array(np.broadcast_to(system.parameters if p is None else p,
+                                 (n_cells, system.n_parameters)), dtype=float)
+    Y = np.array(np.broadcast_to(system.initial_values(P) if y0 is None else y0,
+                                 (n_cells, n)), dtype=float)
+    # OBS_Int is only needed (and the system only needs to have it) when
+    # it can kill cells
+    names = _OBSERVABLES if np.isfinite(th['int_threshold']) else _OBSERVABLES[:3]
+    rows = [system.observable_index(name) for name in names]
+    obs_matrix = system.observable_matrix[rows]
+
+    lineage = _Lineage()
+    ids = lineage.add([-1] * n_cells, [0] * n_cells, 0.0)
+    entered = np.zeros(n_cells, dtype=bool)
+    apc = np.full((n_cells, 2), np.nan)
+    p53_since = np.full(n_cells, np.nan)
+    pattern = {}
+
+    def fun(t, y):
+        return system.rhs(y.reshape(P.shape[0], n), P).ravel()
+
+    def jac(t, y):
+        N = P.shape[0]
+        if pattern.get('N') != N:
+            offsets = (np.arange(N) * n)[:, None]
+            pattern.update(N=N, rows=(offsets + system.jac_rows).ravel(),
+                           cols=(offsets + system.jac_cols).ravel())
+        return scipy.sparse.csc_matrix((system.jacobian(y.reshape(N, n), P).ravel(),
+                                        (pattern['rows'], pattern['cols'])), shape=(N * n, N * n))
+
+    solver = _Rosenbrock(fun, jac, 0.0, Y.ravel(), rtol, atol, np.inf)
+    previous = Y.dot(obs_matrix.T)
+    times, alive, divisions, deaths = [0.0], [n_cells], [0], [0]
+    t = 0.0
+    while t < t_end and len(ids):
+        t_next = min(t + dt, t_end)
+        while solver.t < t_next:
+            solver.step(t_next)
+        t = t_next
+        Y = solver.y.reshape(-1, n)
+        obs = Y.dot(obs_matrix.T)
+        mpf, apc_now, p53 = obs.T[:3]
+
+        newly = ~entered & (previous[:, 0] < th['mpf_threshold']) & (mpf >= th['mpf_threshold'])
+        apc[newly] = np.nan
+        entered |= newly
+        a0, a1 = apc[:, 0], apc[:, 1]
+        with np.errstate(invalid='ignore'):
+            divide = entered & (a1 >= a0) & (a1 > apc_now) & (a1 >= th['apc_threshold'])
+        rising = np.isnan(p53_since) & (p53 >= th['p53_threshold'])
+        p53_since[rising] = t
+        p53_since[p53 < th['p53_threshold']] = np.nan
+        with np.errstate(invalid='ignore'):
+            die = t - p53_since >= th['p53_duration']
+        if len(names) > 3:
+            die |= obs[:, 3] > th['int_threshold']
+        divide &= ~die
+        apc = np.column_stack([a1, apc_now])
+        apc[~entered] = np.nan
+        previous = obs
+
+        n_divide, n_die = int(divide.sum()), int(die.sum())
+        if n_divide or n_die:
+            lineage.finish(ids[die], t, 'dead')
+            lineage.finish(ids[divide], t, 'divided')
+            keep = ~(die | divide)
+            mothers = np.nonzero(divide)[0]
+            f = np.clip(0.5 + partition_noise * rng.standard_normal((len(mothers), n)),
+                        0.0, 1.0)
+            daughters = np.vstack([2 * f * Y[mothers], 2 * (1 - f) * Y[mothers]])
+            generation = np.array(lineage.generation)[ids[mothers]] + 1
+            new_ids = lineage.add(np.tile(ids[mothers], 2), np.tile(generation, 2), t)
+
+            Y = np.vstack([Y[keep], daughters])
+            P = np.vstack([P[keep], P[mothers], P[mothers]])
+            ids = np.concatenate([ids[keep], new_ids])
+            entered = np.concatenate([entered[keep], np.zeros(2 * len(mothers), dtype=bool)])
+            apc = np.vstack([apc[keep], np.full((2 * len(mothers), 2), np.nan)])
+            p53_since = np.concatenate([p53_since[keep], np.full(2 * len(mothers), np.nan)])
+            previous = Y.dot(obs_matrix.T)
+
+            if len(ids) > max_cells:
+                chosen = np.sort(rng.choice(len(ids), max_cells, replace=False))
+                dropped = np.setdiff1d(np.arange(len(ids)), chosen)
+                lineage.finish(ids[dropped], t, 'removed')
+                Y, P, ids, entered = Y[chosen], P[chosen], ids[chosen], entered[chosen]
+                apc, p53_since, previous = apc[chosen], p53_since[chosen], previous[chosen]
+            if len(ids):
+                solver.reset(t, Y.ravel())
+
+        times.append(t)
+        alive.append(len(ids))
+        divisions.append(divisions[-1] + n_divide)
+        deaths.append(deaths[-1] + n_die)
+
+    return PopulationResult(np.array(times), np.array(alive), np.array(divisions),
+                            np.array(deaths), lineage.table(), ids, Y, P, solver.stats)
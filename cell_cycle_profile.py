@@ -0,0 +1,181 @@
+"""Optional instrumentation of integrate().
+
+Pass a Profiler as integrate(profiler=...) to find out where a slow run
+spends its time. It collects
+
+- the number of calls and total time of the right-hand side, the Jacobian
+  and (Rosenbrock only) the sparse LU factorizations
+- a histogram of log10 step sizes per method. Rosenbrock reports every
+  accepted step; LSODA and VODE are observed once per output interval, so
+  their steps count with the interval's mean step size
+- accepted and rejected steps and the largest stiffness estimate per bin
+  of simulation time (`time_bin` wide), which shows e.g. the solver labouring
+  around the Mdm2 switch
+- method switches of method='auto'
+
+One Profiler may watch many runs; merge() combines profiles from worker
+processes. summary() returns a JSON-serializable dict and save() writes it.
+With callback(event, t, value) every step, rejection ('reject'), switch and
+stiffness estimate is also passed on as it happens. Without a profiler,
+integrate() uses the system's functions directly, so there is no overhead.
+
+profile_rates() times every rate law on its own, to find the expressions
+(such as the create_Int or sig_deg terms) that dominate an RHS call.
+"""
+
+from __future__ import division
+
+import json
+import math
+import time
+from bisect import bisect_right
+from collections import defaultdict
+
+import numpy as np
+import sympy
+
+from cell_cycle_cache import atomic_write
+
+# Default step size histogram: log10(h) from -12 to 4 in half decades
+STEP_BINS = tuple(np.arange(-12.0, 4.01, 0.5))
+TIMERS = ('rhs', 'jacobian', 'lu')
+
+
+class Profiler(object):
+    """Timers and step statistics collected by integrate()"""
+
+    def __init__(self, time_bin=100.0, step_bins=STEP_BINS, callback=None):
+        self.time_bin = float(time_bin)
+        self.step_bins = list(step_bins)
+        self.callback = callback
+        self.runs = 0
+        self.calls = dict((name, 0) for name in TIMERS)
+        self.seconds = dict((name, 0.0) for name in TIMERS)
+        self.step_sizes = defaultdict(lambda: [0] * (len(self.step_bins) + 1))
+        self.steps = defaultdict(int)
+        self.rejected = defaultdict(int)
+        self.stiffness = {}
+        self.switches = []
+
+    def timed(self, name, function):
+        """`function` wrapped to count its calls and time under `name`"""
+        calls, seconds = self.calls, self.seconds
+
+        def wrapper(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                seconds[name] += time.time() - start
+                calls[name] += 1
+        return wrapper
+
+    def _bin(self, t):
+        return math.floor(t / self.time_bin) * self.time_bin
+
+    def step(self, method, t, h, count=1):
+        """Record `count` accepted steps of size h ending near t"""
+        if h > 0:
+            self.step_sizes[method][bisect_right(self.step_bins, math.log10(h))] += count
+        self.steps[self._bin(t)] += count
+        if self.callback is not None:
+            self.callback('step', t, h)
+
+    def reject(self, method, t, h, count=1):
+        self.rejected[self._bin(t)] += count
+        if self.callback is not None:
+            self.callback('reject', t, h)
+
+    def interval(self, method, t0, t1, steps, rejected):
+        """Record an output interval [t0, t1] of an ODEPACK method"""
+        if steps:
+            self.step(method, t1, (t1 - t0) / steps, steps)
+        if rejected:
+            self.reject(method, t1, None, rejected)
+
+    def estimate(self, t, ratio):
+        """Record the stiffness ratio of method='auto' at t"""
+        key = self._bin(t)
+        self.stiffness[key] = max(ratio, self.stiffness.get(key, 0.0))
+        if self.callback is not None:
+            self.callback('stiffness', t, ratio)
+
+    def switch(self, t, old, new):
+        self.switches.append((t, old, new))
+        if self.callback is not None:
+            self.callback('switch', t, new)
+
+    def merge(self, other):
+        """Add the counts of another Profiler (e.g. from a worker process)"""
+        self.runs += other.runs
+        for name in TIMERS:
+            self.calls[name] += other.calls[name]
+            self.seconds[name] += other.seconds[name]
+        for method, counts in other.step_sizes.items():
+            mine = self.step_sizes[method]
+            for i, c in enumerate(counts):
+                mine[i] += c
+        for key, count in other.steps.items():
+            self.steps[key] += count
+        for key, count in other.rejected.items():
+            self.rejected[key] += count
+        for key, ratio in other.stiffness.items():
+            self.stiffness[key] = max(ratio, self.stiffness.get(key, 0.0))
+        self.switches.extend(other.switches)
+        return self
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['callback'] = None
+        state['step_sizes'] = dict(self.step_sizes)
+        state['steps'] = dict(self.steps)
+        state['rejected'] = dict(self.rejected)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        step_sizes, steps, rejected = self.step_sizes, self.steps, self.rejected
+        self.step_sizes = defaultdict(lambda: [0] * (len(self.step_bins) + 1), step_sizes)
+        self.steps = defaultdict(int, steps)
+        self.rejected = defaultdict(int, rejected)
+
+    def summary(self):
+        """The collected statistics as a JSON-serializable dict; time-binned
+        counts are lists of [bin start, value] in time order"""
+        timers = dict((name, {'calls': self.calls[name], 'seconds': self.seconds[name],
+                              'mean': self.seconds[name] / self.calls[name]
+                              if self.calls[name] else None})
+                      for name in TIMERS)
+        return {
+            'runs': self.runs,
+            'timers': timers,
+            'step_bins': [float(b) for b in self.step_bins],
+            'step_sizes': dict((m, list(c)) for m, c in self.step_sizes.items()),
+            'time_bin': self.time_bin,
+            'steps': sorted([float(k), v] for k, v in self.steps.items()),
+            'rejected': sorted([float(k), v] for k, v in self.rejected.items()),
+            'stiffness': sorted([float(k), float(v)] for k, v in self.stiffness.items()),
+            'switches': [[float(t), old, new] for t, old, new in self.switches],
+        }
+
+    def save(self, path):
+        atomic_write(path, json.dumps(self.summary(), indent=2, sort_keys=True).encode('utf-8'))
+
+
+def profile_rates(system, y, p=None, repeat=100):
+    """Time each rate law of `system` at state y on its own
+
+    Returns (seconds per evaluation, reaction index, expression) tuples,
+    most expensive first.
+    """
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    args = (system.y_symbols, system.p_symbols)
+    y, p = list(np.asarray(y, dtype=float)), list(p)
+    timings = []
+    for j, expr in enumerate(system.rate_exprs):
+        f = sympy.lambdify(args, expr, modules='numpy')
+        start = time.time()
+        for _ in range(repeat):
+            f(y, p)
+        timings.append(((time.time() - start) / repeat, j, expr))
+    return sorted(timings, key=lambda item: -item[0])
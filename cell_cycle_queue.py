@@ -0,0 +1,438 @@
+"""Sweeps spread over many machines through a shared-directory work queue.
+
+submit() splits a sweep (one dict of parameter overrides per run) into
+tasks of `batch_size` runs and writes them as files into a queue directory
+on a filesystem every node can see. Any number of workers, started on any
+node with run_worker() or `python cell_cycle_queue.py work QUEUE`, then
+pull tasks until none are left; no broker or server is involved.
+
+Layout of a queue directory:
+
+    queue.json                     the sweep: model spec, tspan, options
+    pending/task-00000.json        tasks waiting for a worker
+    running/task-00000.json@host-pid   claimed tasks
+    done/task-00000.json           finished tasks
+    failed/task-00000.json         tasks that used up their attempts
+    shards/task-00000/             results, a cell_cycle_store trajectory store
+
+A worker claims a task by renaming it from pending/ to running/. The
+rename is atomic, so at most one worker takes a task, but over NFS a
+retransmitted rename can report ENOENT to the worker that won; claim()
+then looks for its own claim file before moving on, and if a stale
+attribute cache hides that too, the task sits in running/ unworked until
+recover() puts it back after `timeout`. A worker touches its claim after
+every run; claims not touched for `timeout` seconds belong to a crashed
+worker and are put back by recover(), which idle workers call. A run that
+raises puts the task back with its attempt count raised, or into failed/
+after `max_attempts`. A shard is written under a temporary name and renamed
+into place, so an existing shard always means a complete task, and
+stopping and restarting workers resumes the sweep where it stopped.
+
+merge() concatenates the shards into one trajectory store in run order,
+with the full parameter vector of every run.
+"""
+
+from __future__ import division
+
+import argparse
+import errno
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import time
+
+import numpy as np
+
+from cell_cycle_builder import ModelSpec, get_system
+from cell_cycle_cache import atomic_write, makedirs
+from cell_cycle_integrate import integrate
+from cell_cycle_store import TrajectoryReader, TrajectoryWriter
+from cell_cycle_sweep import DAMAGE_PARAMETER
+
+QUEUE_FORMAT = 1
+STATES = ('pending', 'running', 'done', 'failed')
+DEFAULT_OBSERVABLES = ('OBS_MPF', 'OBS_APC_Ccdc20', 'OBS_p53', 'OBS_CycE')
+DEFAULT_TIMEOUT = 3600.0
+
+
+def _write_json(path, data):
+    atomic_write(path, json.dumps(data, indent=1).encode('utf-8'))
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _missing(e):
+    return e.errno in (errno.ENOENT, errno.ESTALE)
+
+
+def worker_name():
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+class Task(object):
+    """A claimed task: its number, runs and failure history"""
+
+    def __init__(self, queue, name, path, data):
+        self.queue = queue
+        self.name = name
+        self.path = path
+        self.index = data['task']
+        self.runs = data['runs']
+        self.attempts = data['attempts']
+        self.errors = data['errors']
+
+    def heartbeat(self):
+        """Mark the claim as alive"""
+        try:
+            os.utime(self.path, None)
+        except OSError as e:
+            if not _missing(e):  # recovered meanwhile; the shard still counts
+                raise
+
+    def _data(self):
+        return {'task': self.index, 'runs': self.runs, 'attempts': self.attempts,
+                'errors': self.errors}
+
+
+class WorkQueue(object):
+    """A queue directory created by submit()"""
+
+    def __init__(self, path):
+        self.path = path
+        self.sweep = _read_json(os.path.join(path, 'queue.json'))
+        if self.sweep['format'] != QUEUE_FORMAT:
+            raise IOError("Unsupported queue format %r" % self.sweep['format'])
+        self.spec = ModelSpec(**self.sweep['spec'])
+        self.tspan = np.linspace(*self.sweep['tspan'])
+
+    def _dir(self, state):
+        return os.path.join(self.path, state)
+
+    def shard(self, index):
+        return os.path.join(self.path, 'shards', 'task-%05d' % index)
+
+    def _list(self, state):
+        try:
+            return sorted(n for n in os.listdir(self._dir(state)) if n.startswith('task-'))
+        except OSError as e:
+            if _missing(e):
+                return []
+            raise
+
+    def claim(self, worker=None):
+        """Take the first pending task, or return None if there is none"""
+        worker = worker or worker_name()
+        for name in self._list('pending'):
+            path = os.path.join(self._dir('running'), '%s@%s' % (name, worker))
+            try:
+                os.rename(os.path.join(self._dir('pending'), name), path)
+            except OSError as e:
+                if not _missing(e):
+                    raise
+                if not os.path.exists(path):
+                    continue  # claimed by another worker
+                # a retransmitted rename of ours that had already succeeded
+            os.utime(path, None)
+            task = Task(self, name, path, _read_json(path))
+            if os.path.isdir(self.shard(task.index)):
+                # a presumed dead worker finished it after all
+                self._move(task, 'done')
+                continue
+            return task
+        return None
+
+    def _move(self, task, state):
+        _write_json(os.path.join(self._dir(state), task.name), task._data())
+        try:
+            os.remove(task.path)
+        except OSError as e:
+            if not _missing(e):
+                raise
+
+    def complete(self, task, shard):
+        """Install the finished store `shard` as the task's result"""
+        try:
+            os.rename(shard, self.shard(task.index))
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            shutil.rmtree(shard)  # another worker got there first
+        self._move(task, 'done')
+
+    def fail(self, task, error):
+        """Return a task after an error, or give up on it after
+        max_attempts; returns the state it went to"""
+        task.attempts += 1
+        task.errors.append(error)
+        state = 'failed' if task.attempts >= self.sweep['max_attempts'] else 'pending'
+        self._move(task, state)
+        return state
+
+    def recover(self, timeout=DEFAULT_TIMEOUT):
+        """Put back the claims not touched for `timeout` seconds, counting an
+        attempt for each; returns their names"""
+        recovered = []
+        now = time.time()
+        for claim in self._list('running'):
+            path = os.path.join(self._dir('running'), claim)
+            try:
+                if now - os.path.getmtime(path) < timeout:
+                    continue
+                task = Task(self, claim.split('@')[0], path, _read_json(path))
+            except (IOError, OSError):
+                continue  # finished or recovered meanwhile
+            self.fail(task, 'claim by %s timed out' % claim.split('@', 1)[1])
+            recovered.append(task.name)
+        return recovered
+
+    def retry_failed(self):
+        """Move the failed tasks back to pending with fresh attempts"""
+        names = self._list('failed')
+        for name in names:
+            path = os.path.join(self._dir('failed'), name)
+            data = _read_json(path)
+            data['attempts'] = 0
+            _write_json(os.path.join(self._dir('pending'), name), data)
+            os.remove(path)
+        return names
+
+    def status(self):
+        """Number of tasks in each of STATES and of runs done"""
+        counts = dict((state, len(self._list(state))) for state in STATES)
+        counts['tasks'] = self.sweep['n_tasks']
+        counts['runs'] = self.sweep['n_runs']
+        counts['runs_done'] = sum(TrajectoryReader(self.shard(i)).n_runs
+                                  for i in self._done())
+        return counts
+
+    def _done(self):
+        return [i for i in range(self.sweep['n_tasks']) if os.path.isdir(self.shard(i))]
+
+    def errors(self):
+        """task name -> error messages, for the tasks that failed at least
+        once"""
+        errors = {}
+        for state in ('pending', 'done', 'failed'):
+            for name in self._list(state):
+                try:
+                    data = _read_json(os.path.join(self._dir(state), name))
+                except (IOError, OSError):
+                    continue
+                if data['errors']:
+                    errors[name] = data['errors']
+        return errors
+
+    def merge(self, output, partial=False, chunk_size=64, compress=True):
+        """Write all shards into one trajectory store at `output`, in run
+        order; partial=True skips unfinished tasks instead of refusing"""
+        done = self._done()
+        if len(done) < self.sweep['n_tasks'] and not partial:
+            raise RuntimeError("%d of %d tasks are not finished"
+                               % (self.sweep['n_tasks'] - len(done), self.sweep['n_tasks']))
+        sweep = self.sweep
+        readers = [(i, TrajectoryReader(self.shard(i))) for i in done]
+        runs = [i * sweep['batch_size'] + k for i, reader in readers for k in range(len(reader))]
+        metadata = {'spec': sweep['spec'], 'runs': runs,
+                    'overrides': [sweep['overrides'][j] for j in runs]}
+        writer = TrajectoryWriter(output, self.tspan, sweep['observables'], sweep['decimation'],
+                                  chunk_size, compress, n_params=sweep['n_params'],
+                                  metadata=metadata)
+        with writer:
+            for _, reader in readers:
+                data = np.stack([reader[name] for name in sweep['observables']], axis=-1)
+                for row, params in zip(data, reader.params):
+                    writer.append_selected(row, params)
+        return writer
+
+
+def submit(path, overrides, spec=None, tspan=(0.0, 6000.0, 600), observables=DEFAULT_OBSERVABLES,
+           decimation=1, batch_size=1, max_attempts=3, **options):
+    """Create a queue at `path` for one run per dict in `overrides`
+
+    `spec` is the cell_cycle_builder.ModelSpec every worker builds; `tspan`
+    is (start, stop, n); extra keyword arguments (method, rtol, atol, ...)
+    go to cell_cycle_integrate.integrate().
+    """
+    if os.path.exists(os.path.join(path, 'queue.json')):
+        raise IOError("A work queue already exists at %s" % path)
+    spec = ModelSpec() if spec is None else spec
+    overrides = [dict(o) for o in overrides]
+    if not overrides:
+        raise ValueError("At least one parameter set is required")
+    system = get_system(spec)
+    for o in overrides:
+        system.parameter_vector(o)  # unknown names fail here, not on the workers
+    for name in observables:
+        system.observable_index(name)
+    for state in STATES:
+        makedirs(os.path.join(path, state))
+    makedirs(os.path.join(path, 'shards'))
+    tasks = [overrides[i:i + batch_size] for i in range(0, len(overrides), batch_size)]
+    for i, runs in enumerate(tasks):
+        _write_json(os.path.join(path, 'pending', 'task-%05d.json' % i),
+                    {'task': i, 'runs': runs, 'attempts': 0, 'errors': []})
+    # written last: a queue without it is incomplete
+    _write_json(os.path.join(path, 'queue.json'), {
+        'format': QUEUE_FORMAT,
+        'spec': {'modules': list(spec.modules), 'parameters': dict(spec.parameters),
+                 'name': spec.name},
+        'tspan': [float(tspan[0]), float(tspan[1]), int(tspan[2])],
+        'observables': list(observables),
+        'decimation': int(decimation),
+        'options': options,
+        'batch_size': int(batch_size),
+        'max_attempts': int(max_attempts),
+        'n_tasks': len(tasks),
+        'n_runs': len(overrides),
+        'n_params': len(system.parameters),
+        'overrides': overrides,
+    })
+    return WorkQueue(path)
+
+
+def submit_dna_damage(path, levels, base=None, **kwargs):
+    """submit() one run per DNA damage level (DDS_0), with `base` overrides
+    of the other parameters"""
+    return submit(path, [dict(base or {}, **{DAMAGE_PARAMETER: level}) for level in levels],
+                  **kwargs)
+
+
+def _run_task(queue, task, worker):
+    system = get_system(queue.spec)
+    sweep = queue.sweep
+    rows = [system.observable_index(name) for name in sweep['observables']]
+    tmp = os.path.join(queue.path, 'shards', '.task-%05d.%s' % (task.index, worker))
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    writer = TrajectoryWriter(tmp, queue.tspan, sweep['observables'], sweep['decimation'],
+                              len(task.runs), n_params=len(system.parameters),
+                              metadata={'task': task.index, 'worker': worker})
+    try:
+        with writer:
+            for overrides in task.runs:
+                p = system.parameter_vector(overrides)
+                y, _ = integrate(system, queue.tspan, p, **sweep['options'])
+                writer.append_selected(system.observables(y)[::sweep['decimation'], rows], p)
+                task.heartbeat()
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return tmp
+
+
+def run_worker(path, worker=None, timeout=DEFAULT_TIMEOUT, max_tasks=None, verbose=False):
+    """Process tasks of the queue at `path` until none are pending, taking
+    back stale claims when idle; returns the number of tasks done"""
+    queue = WorkQueue(path)
+    worker = worker or worker_name()
+    count = 0
+    while max_tasks is None or count < max_tasks:
+        task = queue.claim(worker)
+        if task is None and queue.recover(timeout):
+            task = queue.claim(worker)
+        if task is None:
+            break
+        try:
+            shard = _run_task(queue, task, worker)
+        except Exception as e:
+            state = queue.fail(task, '%s: %s' % (type(e).__name__, e))
+            if verbose:
+                print("%s: %s failed (%s), %s" % (worker, task.name, e, state))
+            continue
+        queue.complete(task, shard)
+        count += 1
+        if verbose:
+            print("%s: %s done" % (worker, task.name))
+    return count
+
+
+def _worker_process(args):
+    path, timeout = args
+    return run_worker(path, timeout=timeout, verbose=True)
+
+
+def work(path, processes=None, timeout=DEFAULT_TIMEOUT):
+    """Run `processes` workers (default: one per CPU) on this node"""
+    processes = processes or multiprocessing.cpu_count()
+    if processes == 1:
+        return run_worker(path, timeout=timeout, verbose=True)
+    pool = multiprocessing.Pool(processes)
+    try:
+        return sum(pool.map(_worker_process, [(path, timeout)] * processes, 1))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _assignment(text):
+    name, _, value = text.partition('=')
+    if not value:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE, got %r" % text)
+    return name, float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared-directory work queue for sweeps")
+    commands = parser.add_subparsers(dest='command')
+    p = commands.add_parser('submit', help="create a DNA damage sweep")
+    p.add_argument('queue')
+    p.add_argument('--levels', type=float, nargs='+', required=True, help="DDS_0 values")
+    p.add_argument('--set', type=_assignment, action='append', default=[], metavar='NAME=VALUE',
+                   help="override another parameter for every run")
+    p.add_argument('--tspan', type=float, nargs=3, default=(0.0, 6000.0, 600),
+                   metavar=('START', 'STOP', 'N'))
+    p.add_argument('--observables', nargs='+', default=list(DEFAULT_OBSERVABLES))
+    p.add_argument('--decimation', type=int, default=1)
+    p.add_argument('--batch-size', type=int, default=1)
+    p.add_argument('--max-attempts', type=int, default=3)
+    p.add_argument('--method', default='auto')
+    p = commands.add_parser('work', help="process tasks on this node")
+    p.add_argument('queue')
+    p.add_argument('--processes', type=int)
+    p.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                   help="seconds after which a silent claim is taken back")
+    p = commands.add_parser('status', help="show progress")
+    p.add_argument('queue')
+    p = commands.add_parser('retry', help="requeue failed tasks")
+    p.add_argument('queue')
+    p = commands.add_parser('merge', help="combine the shards into one store")
+    p.add_argument('queue')
+    p.add_argument('output')
+    p.add_argument('--partial', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'submit':
+        queue = submit_dna_damage(args.queue, args.levels, dict(args.set),
+                                  tspan=(args.tspan[0], args.tspan[1], int(args.tspan[2])),
+                                  observables=args.observables, decimation=args.decimation,
+                                  batch_size=args.batch_size, max_attempts=args.max_attempts,
+                                  method=args.method)
+        print("%d runs in %d tasks" % (queue.sweep['n_runs'], queue.sweep['n_tasks']))
+    elif args.command == 'work':
+        print("%d tasks done" % work(args.queue, args.processes, args.timeout))
+    elif args.command == 'status':
+        queue = WorkQueue(args.queue)
+        status = queue.status()
+        print("%(runs_done)d of %(runs)d runs done; tasks: %(pending)d pending, "
+              "%(running)d running, %(done)d done, %(failed)d failed" % status)
+        for name, errors in sorted(queue.errors().items()):
+            print("%s: %s" % (name, errors[-1]))
+    elif args.command == 'retry':
+        print("%d tasks requeued" % len(WorkQueue(args.queue).retry_failed()))
+    elif args.command == 'merge':
+        writer = WorkQueue(args.queue).merge(args.output, args.partial)
+        print("%d runs written to %s" % (writer.n_runs, args.output))
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""Time-scale based reduction of the generated cell cycle ODEs.
+
+The Cdc25 states, the APC/Ccdc20/Ccdh1 complexes and the CycB/CDK1_cyto/
+CDK1_nuc forms equilibrate much faster than the cycle itself. reduce_system()
+integrates the full model over the standard damage sweep, and marks a
+species as fast when its relaxation time 1 / |J_ii| stays below `fast_time`
+at every sampled state. The fast species are split into blocks that do not
+act on each other, and each block is eliminated:
+
+- lumping: combinations c . y_F that change only slowly (c^T J_FF small
+  compared with 1 / fast_time at every sample, e.g. the total of a rapidly
+  interconverting pair) become state variables of the reduced system
+- quasi-steady state: the remaining fast directions are slaved to the slow
+  variables through Q^T f_F(y) = 0
+
+The fast species must enter their own rate of change linearly (first-order
+conversions, binding to a slow partner), so Q^T f_F = 0 together with the
+lumps is a small linear system, solved symbolically once. Substituting the
+solution into the rate laws gives a smaller OdeSystem (ReducedSystem.system)
+with its own analytic Jacobian, integrated like any other. Species that
+enter nonlinearly, and the slowest species of blocks larger than
+`max_block`, stay in the reduced model. error_report() compares it with the
+full model on the standard damage sweep.
+"""
+
+from __future__ import division
+
+import re
+import time
+from collections import namedtuple
+
+import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.csgraph
+import sympy
+
+from cell_cycle_fate import FateClassifier
+from cell_cycle_integrate import integrate
+from cell_cycle_odes import OdeSystem, _fill
+
+STANDARD_TSPAN = np.linspace(0, 6000, 600)
+STANDARD_DAMAGE_LEVELS = (0.0, 0.002, 0.004, 0.008, 0.016)
+DAMAGE_PARAMETER = 'DDS_0'
+
+# Species of the subnetworks with the fast equilibria
+FAST_CANDIDATES = r'Cdc25|APC|CDK1'
+
+ReductionError = namedtuple('ReductionError', ['level', 'max_error', 'fate_full', 'fate_reduced',
+                                               'time_full', 'time_reduced', 'faster'])
+
+
+def fast_blocks(system, fast):
+    """`fast` split into the connected components of the fast-fast
+    Jacobian pattern"""
+    fast = np.array(sorted(fast), dtype=int)
+    position = dict((int(i), k) for k, i in enumerate(fast))
+    pairs = [(position[i], position[k]) for i, k in zip(system.jac_rows, system.jac_cols)
+             if i in position and k in position]
+    graph = scipy.sparse.coo_matrix((np.ones(len(pairs)), ([a for a, _ in pairs],
+                                                           [b for _, b in pairs])),
+                                    shape=(len(fast), len(fast)))
+    n, labels = scipy.sparse.csgraph.connected_components(graph, directed=True,
+                                                          connection='weak')
+    return [list(fast[labels == c]) for c in range(n)]
+
+
+def nonlinear_species(system, fast):
+    """Species of `fast` whose rate of change depends nonlinearly on the
+    fast species"""
+    symbols = set(system.y_symbols[i] for i in fast)
+    rows = system.stoichiometry[list(fast)]
+    offending = set()
+    for j in np.nonzero(np.abs(rows).sum(axis=0))[0]:
+        expr = system.rate_exprs[j]
+        for s in symbols & expr.free_symbols:
+            if symbols & sympy.diff(expr, s).free_symbols:
+                offending.update(system.y_symbols.index(x) for x in symbols & expr.free_symbols)
+    return offending
+
+
+class ReducedSystem(object):
+    """An OdeSystem with its `fast` species lumped or in quasi-steady state
+
+    `samples` is a list of (y, p) full states from which the lumped
+    combinations are found, block by block: left singular vectors of the
+    stacked fast Jacobian blocks whose (RMS) rate of change is below
+    1 / fast_time. The reduced state is the slow species followed by the
+    lumps; `system` is the reduced OdeSystem, and rhs(), jacobian_matrix()
+    and the rest of the OdeSystem interface are its.
+    """
+
+    def __init__(self, system, fast, samples, fast_time=1.0):
+        self.full = system
+        self.fast_time = fast_time
+        self.blocks = fast_blocks(system, fast)
+        self.fast = np.array([i for block in self.blocks for i in block], dtype=int)
+        self.slow = np.setdiff1d(np.arange(system.n_species), self.fast)
+        jacobians = [system.jacobian_matrix(y, p).toarray() for y, p in samples]
+        self.Q, self.C = [], []
+        for block in self.blocks:
+            stacked = np.hstack([J[np.ix_(block, block)] for J in jacobians])
+            U, s, _ = np.linalg.svd(stacked)
+            rank = int((s * fast_time >= np.sqrt(len(samples))).sum())
+            self.Q.append(U[:, :rank])
+            self.C.append(U[:, rank:].T)
+        self.lumps = scipy.linalg.block_diag(*self.C) if self.blocks else \
+            np.zeros((0, 0))
+        self.system = self._build()
+
+    def _build(self):
+        full = self.full
+        n_slow, n_lump = len(self.slow), len(self.lumps)
+        slow = sympy.symbols('__u0:%d' % n_slow) if n_slow else ()
+        lumps = sympy.symbols('__l0:%d' % n_lump) if n_lump else ()
+        substitution = dict((full.y_symbols[i], slow[k]) for k, i in enumerate(self.slow))
+        solution, offset = [], 0
+        for block, Q, C in zip(self.blocks, self.Q, self.C):
+            y = [full.y_symbols[i] for i in block]
+            f = [sum((full.stoichiometry[i, j] * full.rate_exprs[j]
+                      for j in np.nonzero(full.stoichiometry[i])[0]), sympy.Integer(0))
+                 .xreplace(substitution) for i in block]
+            A = sympy.Matrix([[sympy.diff(fi, yk) for yk in y] for fi in f])
+            b = sympy.Matrix(f).xreplace(dict((yk, 0) for yk in y))
+            Qt = sympy.Matrix(Q.T.tolist()) if len(Q.T) else sympy.zeros(0, len(block))
+            M = Qt.multiply(A).col_join(sympy.Matrix(C.tolist()) if len(C) else
+                                        sympy.zeros(0, len(block)))
+            r = (-Qt.multiply(b)).col_join(
+                sympy.Matrix(lumps[offset:offset + len(C)]))
+            solution.extend(M.LUsolve(r))
+            offset += len(C)
+        substitution.update((full.y_symbols[i], sympy.sympify(e))
+                            for i, e in zip(self.fast, solution))
+
+        symbols = sympy.symbols('__s0:%d' % (n_slow + n_lump)) if n_slow + n_lump else ()
+        rename = dict(zip(slow + lumps, symbols))
+        rates = [e.xreplace(substitution).xreplace(rename) for e in full.rate_exprs]
+        self.expand_exprs = [e.xreplace(rename) for e in solution]
+
+        S = np.vstack([full.stoichiometry[self.slow],
+                       self.lumps.dot(full.stoichiometry[self.fast])])
+        S[np.abs(S) < 1e-10] = 0.0
+        kept = np.nonzero(np.abs(S).sum(axis=0))[0]
+        names = [full.species_names[i] for i in self.slow] + \
+            ['lump(%s)' % ' + '.join('%.3g*%s' % (w, full.species_names[self.fast[k]])
+                                     for k, w in enumerate(c) if abs(w) > 1e-8)
+             for c in self.lumps]
+        ic = [(k, c) for k, i in enumerate(self.slow)
+              for s, c in zip(full.ic_species, full.ic_parameters) if s == i]
+        # Observables of fast species are nonlinear in the reduced state;
+        # observables() computes them from expand()
+        system = OdeSystem(names, full.parameter_names, full.parameters, [],
+                           np.zeros((0, len(names))), [rates[j] for j in kept], S[:, kept],
+                           [k for k, _ in ic], [c for _, c in ic])
+        self._compile_expand(system)
+        return system
+
+    def _compile_expand(self, system):
+        self._expand_function = sympy.lambdify((system.y_symbols, system.p_symbols),
+                                               self.expand_exprs, modules='numpy')
+
+    def __getattr__(self, name):
+        if name == 'system':
+            raise AttributeError(name)
+        return getattr(self.system, name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_expand_function', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile_expand(self.system)
+
+    @property
+    def observable_names(self):
+        return self.full.observable_names
+
+    def observable_index(self, name):
+        return self.full.observable_index(name)
+
+    def restrict(self, y):
+        """Reduced state(s) of full state(s) y"""
+        y = np.asarray(y, dtype=float)
+        return np.concatenate([y[..., self.slow], y[..., self.fast].dot(self.lumps.T)], axis=-1)
+
+    def initial_values(self, p=None):
+        return self.restrict(self.full.initial_values(p))
+
+    def expand(self, x, p=None):
+        """Full state(s) on the slow manifold for reduced state(s) x"""
+        x = np.asarray(x, dtype=float)
+        p = self.parameters if p is None else np.asarray(p, dtype=float)
+        shape = np.broadcast(x[..., 0], p[..., 0]).shape
+        y = np.empty(shape + (self.full.n_species,))
+        y[..., self.slow] = x[..., :len(self.slow)]
+        if len(self.fast):
+            y[..., self.fast] = _fill(self._expand_function(np.moveaxis(x, -1, 0),
+                                                            np.moveaxis(p, -1, 0)),
+                                      shape, len(self.fast))
+        return y
+
+    def condition(self, y, p):
+        """Largest condition number of the blocks' slow-manifold equations
+        at full state y"""
+        J = self.full.jacobian_matrix(y, p).toarray()
+        return max([np.linalg.cond(np.vstack([Q.T.dot(J[np.ix_(block, block)]), C]))
+                    for block, Q, C in zip(self.blocks, self.Q, self.C)] or [1.0])
+
+    def observables(self, x, p=None):
+        return self.full.observables(self.expand(x, p))
+
+    def integrate(self, tspan, p=None, y0=None, callback=None, **options):
+        """Integrate the reduced system; returns (full species trajectories,
+        stats). `y0` and the states passed to `callback(t, y)` are full."""
+        p = self.parameters if p is None else np.asarray(p, dtype=float)
+        x0 = self.restrict(self.full.initial_values(p) if y0 is None else y0)
+        wrapped = None if callback is None else (lambda t, x: callback(t, self.expand(x, p)))
+        x, stats = integrate(self.system, tspan, p, x0, callback=wrapped, **options)
+        return self.expand(x, p), stats
+
+
+def _reference_states(system, tspan, levels, n_samples, parameter, **options):
+    samples = []
+    for level in levels:
+        p = system.parameter_vector({parameter: level})
+        y, _ = integrate(system, tspan, p, **options)
+        for row in np.linspace(0, len(y) - 1, min(n_samples, len(y))).astype(int):
+            samples.append((y[row], p))
+    return samples
+
+
+def relaxation_rates(system, samples):
+    """Smallest -J_ii of every species over the sampled (y, p) states"""
+    return -np.array([system.jacobian_matrix(y, p).diagonal() for y, p in samples]).max(axis=0)
+
+
+def reduce_system(system, tspan=STANDARD_TSPAN, levels=STANDARD_DAMAGE_LEVELS, fast_time=1.0,
+                  candidates=FAST_CANDIDATES, n_samples=50, max_cond=1e10, max_block=4,
+                  parameter=DAMAGE_PARAMETER, **options):
+    """Build a ReducedSystem from the full model's behaviour on a sweep
+
+    Species matching the regular expression `candidates` (None: all) are
+    fast when their relaxation time stays below `fast_time`, and they enter
+    the fast rates of change linearly. The slowest species of a block with
+    more than `max_block` species (whose symbolic solution would grow too
+    large) is put back until none has; so is the slowest fast species while
+    the slow-manifold equations are ill-conditioned at some sample
+    (condition number above max_cond). Extra keyword arguments go to
+    integrate().
+    """
+    samples = _reference_states(system, tspan, levels, n_samples, parameter, **options)
+    rates = relaxation_rates(system, samples)
+    fast = [i for i, name in enumerate(system.species_names)
+            if rates[i] * fast_time >= 1 and (candidates is None or re.search(candidates, name))]
+    nonlinear = nonlinear_species(system, fast)
+    while nonlinear:
+        fast = [i for i in fast if i not in nonlinear]
+        nonlinear = nonlinear_species(system, fast)
+    while fast:
+        large = [block for block in fast_blocks(system, fast) if len(block) > max_block]
+        if large:
+            for block in large:
+                fast.remove(min(block, key=lambda i: rates[i]))
+            continue
+        reduced = ReducedSystem(system, fast, samples, fast_time=fast_time)
+        if max(reduced.condition(y, p) for y, p in samples) <= max_cond:
+            return reduced
+        fast.remove(min(fast, key=lambda i: rates[i]))
+    return ReducedSystem(system, [], samples)
+
+
+def error_report(reduced, tspan=STANDARD_TSPAN, levels=STANDARD_DAMAGE_LEVELS, observables=None,
+                 thresholds=None, settle=None, parameter=DAMAGE_PARAMETER, **options):
+    """Compare `reduced` with its full system at every damage level
+
+    max_error maps each observable to its largest deviation relative to
+    the observable's range in the full solution, from `settle` after the
+    start on (default: 10 * fast_time, past the initial layer in which the
+    fast species of the full model reach the slow manifold). Fates are
+    classified on both trajectories, and `faster` tells whether the
+    reduced integration took less wall time than the full one. Returns a
+    list of ReductionErrors.
+    """
+    settle = 10 * reduced.fast_time if settle is None else settle
+    after = np.asarray(tspan) >= tspan[0] + settle
+    full = reduced.full
+    names = full.observable_names if observables is None else list(observables)
+    rows = [full.observable_index(name) for name in names]
+    report = []
+    for level in levels:
+        p = full.parameter_vector({parameter: level})
+        start = time.time()
+        y_full, _ = integrate(full, tspan, p, **options)
+        time_full = time.time() - start
+        start = time.time()
+        y_reduced, _ = reduced.integrate(tspan, p, **options)
+        time_reduced = time.time() - start
+
+        a = full.observables(y_full[after])[:, rows]
+        b = full.observables(y_reduced[after])[:, rows]
+        span = np.maximum(a.max(axis=0) - a.min(axis=0), 1e-12)
+        error = np.abs(a - b).max(axis=0) / span
+        fates = []
+        for y in (y_full, y_reduced):
+            classifier = FateClassifier(full, p, **(thresholds or {}))
+            for t, row in zip(tspan, y):
+                if classifier(t, row):
+                    break
+            fates.append(classifier.record().fate)
+        report.append(ReductionError(level, dict(zip(names, error)), fates[0], fates[1],
+                                     time_full, time_reduced, time_reduced < time_full))
+    return report
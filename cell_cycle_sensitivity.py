@@ -0,0 +1,244 @@
+"""Global sensitivity of cell-fate outcomes to rate constants.
+
+run_sensitivity() samples parameters such as the shared_k* rate constants
+log-uniformly within bounds, classifies the fate of every sample with the
+event-driven classifier of cell_cycle_fate over a process pool that shares
+one OdeSystem, and updates the sensitivity indices as each block of results
+streams in. Two analyses are available:
+
+- SobolAnalysis: first-order (Saltelli 2010) and total (Jansen) Sobol
+  indices from a Saltelli design; each design row costs k + 2 simulations
+- MorrisAnalysis: elementary effects (mu, mu*, sigma) along r one-at-a-time
+  trajectories on a p-level grid; each trajectory costs k + 1 simulations
+
+Outputs are scalar functions of a FateRecord (by default: indicators of the
+three fates and the decision time). Progress is checkpointed to a pickle so
+an interrupted multi-hour run resumes where it stopped; the design itself is
+regenerated from its seed.
+"""
+
+from __future__ import division
+
+import os
+import pickle
+
+import numpy as np
+
+from cell_cycle_cache import atomic_write
+from cell_cycle_fate import imap_fates
+
+DEFAULT_OUTPUTS = (
+    ('divided', lambda r: float(r.fate == 'divided')),
+    ('apoptotic', lambda r: float(r.fate == 'apoptotic')),
+    ('arrested', lambda r: float(r.fate == 'arrested')),
+    ('fate_time', lambda r: r.t_final if r.time is None else r.time),
+)
+
+
+def rate_constants(system, prefix='shared_k'):
+    """Names of the parameters of `system` starting with `prefix`"""
+    return [name for name in system.parameter_names if name.startswith(prefix)]
+
+
+def default_bounds(system, names, factor=2.0):
+    """Bounds [v / factor, v * factor] around each parameter's nominal value"""
+    return [(system.parameters[system.parameter_index(n)] / factor,
+             system.parameters[system.parameter_index(n)] * factor) for n in names]
+
+
+class _Analysis(object):
+
+    kind = None
+
+    def __init__(self, names, bounds, n, seed, output_names):
+        self.names = list(names)
+        self.bounds = np.array(bounds, dtype=float)
+        if self.bounds.shape != (len(self.names), 2) or (self.bounds <= 0).any():
+            raise ValueError("Need positive (low, high) bounds for every parameter")
+        self.n = int(n)
+        self.seed = seed
+        self.output_names = list(output_names)
+        self.rows_done = 0
+        self._design()
+
+    @property
+    def k(self):
+        return len(self.names)
+
+    def config(self):
+        return (self.kind, self.names, self.bounds.tolist(), self.n, self.seed, self.output_names)
+
+    def scale(self, u):
+        """Map unit-cube points to parameter values, log-uniformly"""
+        lo, hi = np.log(self.bounds[:, 0]), np.log(self.bounds[:, 1])
+        return np.exp(lo + u * (hi - lo))
+
+    def state(self):
+        return dict((key, getattr(self, key)) for key in self._accumulators)
+
+    def restore(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+class SobolAnalysis(_Analysis):
+    """First-order and total Sobol indices from n Saltelli design rows"""
+
+    kind = 'sobol'
+    _accumulators = ('rows_done', '_sum', '_sum2', '_first', '_total')
+
+    def _design(self):
+        rng = np.random.RandomState(self.seed)
+        self._A = rng.random_sample((self.n, self.k))
+        self._B = rng.random_sample((self.n, self.k))
+        m = len(self.output_names)
+        self._sum = np.zeros(m)
+        self._sum2 = np.zeros(m)
+        self._first = np.zeros((self.k, m))
+        self._total = np.zeros((self.k, m))
+
+    def row(self, j):
+        """Unit-cube points of design row j: A_j, B_j, then A_j with column i
+        taken from B_j for each parameter i"""
+        AB = np.tile(self._A[j], (self.k, 1))
+        AB[np.arange(self.k), np.arange(self.k)] = self._B[j]
+        return np.vstack([self._A[j], self._B[j], AB])
+
+    def update(self, values):
+        """Add the outputs (k + 2, n_outputs) of the next design row"""
+        fA, fB, fAB = values[0], values[1], values[2:]
+        self._sum += fA + fB
+        self._sum2 += fA * fA + fB * fB
+        self._first += fB * (fAB - fA)
+        self._total += (fA - fAB) ** 2
+        self.rows_done += 1
+
+    def indices(self):
+        """dict output -> {'S1': (k,), 'ST': (k,)} from the rows so far"""
+        n = self.rows_done
+        if n == 0:
+            raise ValueError("No design rows evaluated yet")
+        mean = self._sum / (2 * n)
+        var = self._sum2 / (2 * n) - mean ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            S1 = self._first / n / var
+            ST = self._total / (2 * n) / var
+        return dict((name, {'S1': S1[:, i], 'ST': ST[:, i]})
+                    for i, name in enumerate(self.output_names))
+
+
+class MorrisAnalysis(_Analysis):
+    """Morris elementary effects from n trajectories on a `levels` grid"""
+
+    kind = 'morris'
+    _accumulators = ('rows_done', '_count', '_mean', '_mean_abs', '_m2')
+
+    def __init__(self, names, bounds, n, seed, output_names, levels=4):
+        self.levels = levels
+        self.delta = levels / (2.0 * (levels - 1))
+        _Analysis.__init__(self, names, bounds, n, seed, output_names)
+
+    def config(self):
+        return _Analysis.config(self) + (self.levels,)
+
+    def _design(self):
+        rng = np.random.RandomState(self.seed)
+        grid = np.arange(self.levels) / (self.levels - 1.0)
+        self._start = rng.choice(grid, (self.n, self.k))
+        self._order = np.array([rng.permutation(self.k) for _ in range(self.n)])
+        m = len(self.output_names)
+        self._count = np.zeros(self.k)
+        self._mean = np.zeros((self.k, m))
+        self._mean_abs = np.zeros((self.k, m))
+        self._m2 = np.zeros((self.k, m))
+
+    def _steps(self, j):
+        """Sign of the step taken for each parameter in trajectory j"""
+        return np.where(self._start[j] + self.delta <= 1.0, 1.0, -1.0)
+
+    def row(self, j):
+        """Unit-cube points of trajectory j: k + 1 points, each moving one
+        parameter (in random order) by +-delta"""
+        steps = self._steps(j)
+        points = [self._start[j].copy()]
+        for i in self._order[j]:
+            x = points[-1].copy()
+            x[i] += steps[i] * self.delta
+            points.append(x)
+        return np.array(points)
+
+    def update(self, values):
+        """Add the outputs (k + 1, n_outputs) of the next trajectory"""
+        j = self.rows_done
+        steps = self._steps(j)
+        for step, i in enumerate(self._order[j]):
+            ee = (values[step + 1] - values[step]) * steps[i] / self.delta
+            self._count[i] += 1
+            d = ee - self._mean[i]
+            self._mean[i] += d / self._count[i]
+            self._m2[i] += d * (ee - self._mean[i])
+            self._mean_abs[i] += (abs(ee) - self._mean_abs[i]) / self._count[i]
+        self.rows_done += 1
+
+    def indices(self):
+        """dict output -> {'mu', 'mu_star', 'sigma'}, each of shape (k,)"""
+        if self.rows_done == 0:
+            raise ValueError("No trajectories evaluated yet")
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigma = np.sqrt(self._m2 / (self._count[:, None] - 1))
+        return dict((name, {'mu': self._mean[:, i], 'mu_star': self._mean_abs[:, i],
+                            'sigma': sigma[:, i]})
+                    for i, name in enumerate(self.output_names))
+
+
+def _save_checkpoint(path, analysis):
+    atomic_write(path, pickle.dumps({'config': analysis.config(), 'state': analysis.state()}, 2))
+
+
+def _load_checkpoint(path, analysis):
+    if path is None or not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    if saved['config'] != analysis.config():
+        raise ValueError("Checkpoint %s belongs to a different analysis" % path)
+    analysis.restore(saved['state'])
+
+
+def run_sensitivity(system, tspan, analysis, outputs=DEFAULT_OUTPUTS, base=None,
+                    checkpoint=None, checkpoint_every=10, processes=None, callback=None,
+                    **classify_options):
+    """Evaluate the remaining design rows of `analysis` and return it
+
+    `outputs` is a sequence of (name, function of FateRecord) matching
+    analysis.output_names; `base` is a dict of parameter overrides applied to
+    every sample (e.g. a DDS_0 level). If `checkpoint` names a file, progress
+    is loaded from it and saved every `checkpoint_every` rows and at the end.
+    `callback(analysis)` is called after every row, so indices() can be
+    watched while the run proceeds. Extra keyword arguments go to
+    cell_cycle_fate.classify(), except `stats`, a dict that collects the
+    solver counters of all runs (see cell_cycle_fate.imap_fates()).
+    """
+    if [name for name, _ in outputs] != analysis.output_names:
+        raise ValueError("outputs do not match analysis.output_names")
+    _load_checkpoint(checkpoint, analysis)
+    p_base = system.parameter_vector(base)
+    columns = [system.parameter_index(name) for name in analysis.names]
+
+    def blocks():
+        for j in range(analysis.rows_done, analysis.n):
+            p = np.tile(p_base, (len(analysis.row(j)), 1))
+            p[:, columns] = analysis.scale(analysis.row(j))
+            yield p
+
+    try:
+        for records in imap_fates(system, tspan, blocks(), processes, **classify_options):
+            analysis.update(np.array([[f(r) for _, f in outputs] for r in records]))
+            if callback is not None:
+                callback(analysis)
+            if checkpoint is not None and analysis.rows_done % checkpoint_every == 0:
+                _save_checkpoint(checkpoint, analysis)
+    finally:
+        if checkpoint is not None:
+            _save_checkpoint(checkpoint, analysis)
+    return analysis
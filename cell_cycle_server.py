@@ -0,0 +1,302 @@
+"""Local simulation service that keeps the model and its workers warm.
+
+A script that only wants "simulate at these parameters" otherwise pays for
+importing pysb and sympy, the declare_* sequence, BioNetGen and compiling
+the rate laws every time. The server does all of that once, then keeps a
+ProcessPoolExecutor whose workers already hold the OdeSystem, so a request
+costs only its integrations.
+
+Requires Python 3 (asyncio). Start it with
+
+    python cell_cycle_server.py --socket /tmp/cell_cycle.sock
+    python cell_cycle_server.py --port 8765          # localhost only
+
+The protocol is one JSON object per line in each direction. A request
+
+    {"id": 1, "op": "simulate", "runs": [{"DDS_0": 0.004}, ...],
+     "tspan": {"start": 0, "stop": 6000, "n": 600},
+     "observables": ["OBS_p53"], "method": "auto"}
+
+("tspan" may also be an explicit list of times; "runs" are parameter
+overrides) is answered by one line per run, in completion order:
+
+    {"id": 1, "index": 0, "observables": {"OBS_p53": [...]}, "stats": {...}}
+
+and a final {"id": 1, "done": true}. "op": "classify" answers with
+{"id", "index", "fate": {FateRecord fields}} per run instead, stopping each
+integration once the fate is decided; "info" returns the parameter,
+species and observable names. Failures are reported as {"id", "error"}
+(with "index" when a single run failed). Client is a small blocking client
+for scripts and notebooks.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import stat
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cell_cycle_builder import ModelSpec, get_system
+from cell_cycle_fate import classify
+from cell_cycle_integrate import integrate
+
+OPS = ('simulate', 'classify', 'info', 'ping')
+MAX_LINE = 64 * 1024 * 1024
+
+# Per-process OdeSystem of the worker processes
+_system = None
+
+
+def _init_worker(system):
+    global _system
+    _system = system
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _simulate(p, tspan, rows, options):
+    y, stats = integrate(_system, tspan, p, **options)
+    return _system.observables(y)[:, rows].T, stats
+
+
+def _classify(p, tspan, thresholds, options):
+    return classify(_system, tspan, p, thresholds=thresholds, **options)
+
+
+def _json_default(value):
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+def _encode(message):
+    return (json.dumps(message, default=_json_default) + '\n').encode('utf-8')
+
+
+DEFAULT_TSPAN = {'start': 0.0, 'stop': 6000.0, 'n': 600}
+
+
+def _tspan(spec):
+    if isinstance(spec, dict):
+        return np.linspace(spec['start'], spec['stop'], spec['n'])
+    return np.asarray(spec, dtype=float)
+
+
+class SimulationServer(object):
+    """Serves simulation requests for one model variant over a warm pool"""
+
+    def __init__(self, spec=None, processes=None):
+        self.system = get_system(spec or ModelSpec())
+        self.processes = processes or os.cpu_count()
+        self.pool = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.pool = ProcessPoolExecutor(self.processes, initializer=_init_worker,
+                                        initargs=(self.system,))
+        # Start every worker now rather than on the first request
+        await asyncio.gather(*[loop.run_in_executor(self.pool, _warm_up)
+                               for _ in range(self.processes)])
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                except ValueError as e:
+                    writer.write(_encode({'error': 'invalid JSON: %s' % e}))
+                    continue
+                await self.respond(request, writer)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, request, writer):
+        rid = request.get('id')
+        op = request.get('op', 'simulate')
+        try:
+            if op not in OPS:
+                raise ValueError("unknown op %r" % op)
+            if op == 'ping':
+                writer.write(_encode({'id': rid, 'done': True}))
+            elif op == 'info':
+                system = self.system
+                writer.write(_encode({'id': rid, 'parameters': system.parameter_names,
+                                      'species': system.species_names,
+                                      'observables': system.observable_names, 'done': True}))
+            else:
+                await self.run_batch(rid, op, request, writer)
+        except (KeyError, TypeError, ValueError) as e:
+            writer.write(_encode({'id': rid, 'error': '%s: %s' % (type(e).__name__, e)}))
+        await writer.drain()
+
+    async def run_batch(self, rid, op, request, writer):
+        system = self.system
+        loop = asyncio.get_running_loop()
+        tspan = _tspan(request.get('tspan', DEFAULT_TSPAN))
+        options = dict((k, request[k]) for k in ('method', 'rtol', 'atol') if k in request)
+        p = [system.parameter_vector(overrides) for overrides in request.get('runs', [{}])]
+        if op == 'simulate':
+            names = request.get('observables') or system.observable_names
+            rows = [system.observable_index(name) for name in names]
+            jobs = [loop.run_in_executor(self.pool, _simulate, q, tspan, rows, options)
+                    for q in p]
+        else:
+            thresholds = request.get('thresholds')
+            jobs = [loop.run_in_executor(self.pool, _classify, q, tspan, thresholds, options)
+                    for q in p]
+
+        async def indexed(i, job):
+            try:
+                return i, await job, None
+            except Exception as e:
+                return i, None, '%s: %s' % (type(e).__name__, e)
+
+        for done in asyncio.as_completed([indexed(i, job) for i, job in enumerate(jobs)]):
+            i, result, error = await done
+            if error is not None:
+                message = {'id': rid, 'index': i, 'error': error}
+            elif op == 'simulate':
+                message = {'id': rid, 'index': i, 'observables': dict(zip(names, result[0])),
+                           'stats': result[1]}
+            else:
+                message = {'id': rid, 'index': i, 'fate': result[0]._asdict(),
+                           'stats': result[1]}
+            writer.write(_encode(message))
+            await writer.drain()
+        writer.write(_encode({'id': rid, 'done': True}))
+
+
+def _remove_socket(path):
+    """Remove the stale Unix socket at `path`; anything else there is left
+    alone and raises IOError"""
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise IOError("%s exists and is not a socket" % path)
+    os.remove(path)
+
+
+async def serve(path=None, port=None, spec=None, processes=None):
+    """Run a SimulationServer on the Unix socket `path` or on localhost:port"""
+    if path is not None:
+        _remove_socket(path)
+    server = SimulationServer(spec, processes)
+    await server.start()
+    if path is not None:
+        listener = await asyncio.start_unix_server(server.handle, path, limit=MAX_LINE)
+    else:
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', port, limit=MAX_LINE)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+        if path is not None and os.path.exists(path) and stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.remove(path)
+
+
+class Client(object):
+    """Blocking client; `address` is a Unix socket path or a port number"""
+
+    def __init__(self, address):
+        if isinstance(address, int):
+            self.sock = socket.create_connection(('127.0.0.1', address))
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.stream = self.sock.makefile('rb')
+        self._next_id = 0
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def request(self, op, **fields):
+        """Send one request and yield its responses up to the final one;
+        responses left unread when the generator is closed are discarded"""
+        self._next_id += 1
+        self.sock.sendall(_encode(dict(fields, id=self._next_id, op=op)))
+        finished = False
+        try:
+            while True:
+                line = self.stream.readline()
+                if not line:
+                    finished = True
+                    raise IOError("Connection closed by the server")
+                message = json.loads(line.decode('utf-8'))
+                if 'error' in message and 'index' not in message:
+                    finished = True
+                    raise RuntimeError(message['error'])
+                if message.get('done'):
+                    finished = True
+                    if op == 'info':
+                        yield message
+                    return
+                yield message
+        finally:
+            while not finished:
+                line = self.stream.readline()
+                finished = not line or json.loads(line.decode('utf-8')).get('done') or False
+
+    def simulate(self, runs, tspan=DEFAULT_TSPAN, observables=None, **options):
+        """Yield (index, {observable: array}, stats) per run as they finish"""
+        for message in self.request('simulate', runs=list(runs), tspan=tspan,
+                                    observables=observables, **options):
+            if 'error' in message:
+                raise RuntimeError("run %d: %s" % (message['index'], message['error']))
+            yield (message['index'],
+                   dict((k, np.array(v)) for k, v in message['observables'].items()),
+                   message['stats'])
+
+    def classify(self, runs, tspan=DEFAULT_TSPAN, thresholds=None, **options):
+        """Yield (index, fate dict) per run as they finish"""
+        for message in self.request('classify', runs=list(runs), tspan=tspan,
+                                    thresholds=thresholds, **options):
+            if 'error' in message:
+                raise RuntimeError("run %d: %s" % (message['index'], message['error']))
+            yield message['index'], message['fate']
+
+    def info(self):
+        return next(self.request('info'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve cell cycle simulations")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket', help="Unix socket path")
+    where.add_argument('--port', type=int, help="TCP port on 127.0.0.1")
+    parser.add_argument('--processes', type=int)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.socket, args.port, processes=args.processes))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
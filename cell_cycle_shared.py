@@ -15,13 +15,12 @@ from pysb.util import *
 from pysb.macros import *
 from pysb.bng import *
 from pysb.integrate import odesolve
-import pylab as pl
 from numpy import linspace
 from sympy import sympify
 
 # Model()
 
-def set_dna_damage(damage):
+def set_dna_damage(model, damage):
     model.parameters['DDS_0'].value = damage
 
 def declare_monomers():
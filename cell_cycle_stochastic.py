@@ -0,0 +1,270 @@
+"""Stochastic simulation of the generated cell cycle network.
+
+The rate laws of OdeSystem are macroscopic (concentration per unit time) and
+include Hill terms such as create_Mdm2, so they are turned into propensities
+through a system size `omega`: a species at concentration y is present as
+round(omega * y) molecules and reaction j fires with propensity
+omega * v_j(X / omega). Larger omega means smaller noise.
+
+StochasticSimulator offers
+- 'ssa': Gillespie's direct method. After reaction j fires only the
+  propensities that depend on a species it changed are recomputed (a
+  dependency graph derived from the sparsity of the rate laws).
+- 'tau': adaptive explicit tau-leaping (Cao, Gillespie & Petzold 2006).
+  The leap size bounds the relative change of every propensity by
+  `epsilon`, critical reactions (fewer than `n_critical` firings from
+  exhausting a reactant) fire at most once per leap, and when the leap would
+  be shorter than a few SSA steps a burst of exact SSA steps is taken
+  instead.
+
+run_ensemble() runs thousands of trajectories over a process pool. Each
+trajectory has its own random stream seeded from (seed, index), so results
+do not depend on the number of processes. Each trajectory's fate is classified
+with cell_cycle_fate's FateClassifier. The result holds fate fractions and
+quantile bands of chosen observables, not the trajectories.
+"""
+
+from __future__ import division
+
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+import sympy
+
+from cell_cycle_fate import FATES, FateClassifier
+
+METHODS = ('ssa', 'tau')
+DEFAULT_OBSERVABLES = ('OBS_MPF', 'OBS_APC_Ccdc20', 'OBS_p53', 'OBS_CycE')
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+EnsembleResult = namedtuple('EnsembleResult', ['n', 'fractions', 'records', 'tspan',
+                                               'quantiles', 'bands'])
+
+
+class StochasticSimulator(object):
+    """SSA / adaptive tau-leaping for one OdeSystem at system size `omega`"""
+
+    def __init__(self, system, omega=1000.0, method='tau', epsilon=0.03, n_critical=10,
+                 ssa_factor=10.0, ssa_steps=100):
+        if method not in METHODS:
+            raise ValueError("Unknown method %r; expected one of %s" % (method, ', '.join(METHODS)))
+        self.system = system
+        self.omega = float(omega)
+        self.method = method
+        self.epsilon = epsilon
+        self.n_critical = n_critical
+        self.ssa_factor = ssa_factor
+        self.ssa_steps = ssa_steps
+
+        S = system.stoichiometry
+        self._changes = [(np.nonzero(S[:, j])[0], S[np.nonzero(S[:, j])[0], j])
+                         for j in range(system.n_reactions)]
+        # Reactions whose rate law reads species i
+        readers = [set() for _ in range(system.n_species)]
+        for j, k in zip(system.dv_rows, system.dv_cols):
+            readers[k].add(int(j))
+        self.dependents = [np.array(sorted(set().union(*[readers[i] for i in idx])), dtype=int)
+                           for idx, _ in self._changes]
+
+        self._functions = []
+        for expr in system.rate_exprs:
+            y_idx = [i for i, s in enumerate(system.y_symbols) if s in expr.free_symbols]
+            p_idx = [k for k, s in enumerate(system.p_symbols) if s in expr.free_symbols]
+            symbols = [system.y_symbols[i] for i in y_idx] + [system.p_symbols[k] for k in p_idx]
+            self._functions.append((sympy.lambdify(symbols, expr, modules='math'), y_idx, p_idx))
+
+        # Tau selection: net consumption and the highest order of a reaction
+        # consuming each species
+        self._consumed = np.maximum(-S, 0)
+        order = self._consumed.sum(axis=0)
+        self._g = np.array([max([1.0] + [order[j] for j in np.nonzero(self._consumed[i])[0]])
+                            for i in range(system.n_species)])
+
+    def propensities(self, X, p):
+        """All propensities for molecule counts X"""
+        return np.maximum(self.omega * self.system.rates(X / self.omega, p), 0.0)
+
+    def _propensity(self, j, X, p):
+        f, y_idx, p_idx = self._functions[j]
+        args = [X[i] / self.omega for i in y_idx] + [p[k] for k in p_idx]
+        return max(self.omega * f(*args), 0.0)
+
+    def _leap_size(self, X, a, noncritical):
+        """Largest tau keeping the expected relative propensity changes below
+        epsilon (Cao, Gillespie & Petzold 2006, eq. 33)"""
+        S = self.system.stoichiometry
+        an = np.where(noncritical, a, 0.0)
+        mu = S.dot(an)
+        sigma2 = (S * S).dot(an)
+        reactant = self._consumed.dot(noncritical) > 0
+        if not reactant.any():
+            return np.inf
+        bound = np.maximum(self.epsilon * X[reactant] / self._g[reactant], 1.0)
+        with np.errstate(divide='ignore'):
+            tau = np.minimum(bound / abs(mu[reactant]), bound ** 2 / sigma2[reactant])
+        return tau.min()
+
+    def run(self, tspan, p=None, y0=None, rng=None, callback=None):
+        """Simulate one trajectory, recording molecule counts at `tspan`
+
+        `callback(t, y)` is called with concentrations at every output time
+        and stops the run by returning True, as in integrate(). Returns
+        (counts, stats) with counts of shape (len(tspan), n_species), or
+        fewer rows if stopped early.
+        """
+        system = self.system
+        tspan = np.asarray(tspan, dtype=float)
+        p = system.parameters if p is None else np.asarray(p, dtype=float)
+        y0 = system.initial_values(p) if y0 is None else np.asarray(y0, dtype=float)
+        rng = np.random.RandomState() if rng is None else rng
+        stats = {'method': self.method, 'ssa_steps': 0, 'leaps': 0, 'rejected': 0}
+
+        X = np.round(y0 * self.omega)
+        out = np.empty((len(tspan), system.n_species))
+        out[0] = X
+        if callback is not None and callback(tspan[0], X / self.omega):
+            return out[:1], stats
+        t, i, n_out = tspan[0], 1, len(tspan)
+        a = self.propensities(X, p)
+
+        while i < n_out:
+            a0 = a.sum()
+            if a0 <= 0:
+                t_new = np.inf
+                while i < n_out and tspan[i] < t_new:
+                    out[i] = X
+                    i += 1
+                    if callback is not None and callback(tspan[i - 1], X / self.omega):
+                        n_out = i
+                continue
+
+            if self.method == 'ssa':
+                tau1, bursts = 0.0, 1
+            else:
+                limit = np.where(self._consumed > 0, X[:, None] / np.maximum(self._consumed, 1),
+                                 np.inf).min(axis=0)
+                critical = (a > 0) & (limit < self.n_critical)
+                tau1, bursts = self._leap_size(X, a, ~critical), self.ssa_steps
+
+            if tau1 < self.ssa_factor / a0:
+                for _ in range(bursts):
+                    a0 = a.sum()
+                    t_new = t + rng.exponential(1 / a0) if a0 > 0 else np.inf
+                    while i < n_out and tspan[i] < t_new:
+                        out[i] = X
+                        i += 1
+                        if callback is not None and callback(tspan[i - 1], X / self.omega):
+                            n_out = i
+                    if i >= n_out or a0 <= 0:
+                        break
+                    j = min(np.searchsorted(np.cumsum(a), rng.random_sample() * a0, 'right'),
+                            len(a) - 1)
+                    idx, nu = self._changes[j]
+                    X[idx] += nu
+                    for k in self.dependents[j]:
+                        a[k] = self._propensity(k, X, p)
+                    t = t_new
+                    stats['ssa_steps'] += 1
+                continue
+
+            a_critical = np.where(critical, a, 0.0)
+            a0c = a_critical.sum()
+            tau2 = rng.exponential(1 / a0c) if a0c > 0 else np.inf
+            while True:
+                tau = min(tau1, tau2)
+                fire_critical = tau2 <= tau1
+                reached = t + tau >= tspan[i]
+                if reached:
+                    tau, fire_critical = tspan[i] - t, False
+                k = np.where(critical, 0, rng.poisson(np.where(critical, 0.0, a) * tau))
+                if fire_critical:
+                    k[min(np.searchsorted(np.cumsum(a_critical), rng.random_sample() * a0c,
+                                          'right'), len(a) - 1)] += 1
+                X_new = X + system.stoichiometry.dot(k)
+                if (X_new >= 0).all():
+                    break
+                tau1 /= 2
+                stats['rejected'] += 1
+            X = X_new
+            t = tspan[i] if reached else t + tau
+            stats['leaps'] += 1
+            if reached:
+                out[i] = X
+                i += 1
+                if callback is not None and callback(t, X / self.omega):
+                    n_out = i
+            a = self.propensities(X, p)
+
+        return out[:n_out], stats
+
+
+# Per-process state for run_ensemble()
+_worker = None
+
+
+def _init_worker(system, tspan, p, seed, rows, thresholds, stop_at_fate, options):
+    global _worker
+    _worker = (StochasticSimulator(system, **options), system, tspan, p, seed, rows,
+               thresholds, stop_at_fate)
+
+
+def _run_block(indices):
+    simulator, system, tspan, p, seed, rows, thresholds, stop_at_fate = _worker
+    records = []
+    values = np.full((len(indices), len(tspan), len(rows)), np.nan)
+    for b, index in enumerate(indices):
+        classifier = FateClassifier(system, **(thresholds or {}))
+        callback = classifier if stop_at_fate else (lambda t, y: classifier(t, y) and False)
+        counts, _ = simulator.run(tspan, p, rng=np.random.RandomState([seed, index]),
+                                  callback=callback)
+        records.append(classifier.record())
+        if rows:
+            values[b, :len(counts)] = system.observables(counts / simulator.omega)[:, rows]
+    return records, values
+
+
+def fate_fractions(records):
+    """Fraction of FateRecords with each fate in FATES"""
+    return dict((fate, sum(r.fate == fate for r in records) / max(len(records), 1))
+                for fate in FATES)
+
+
+def run_ensemble(system, tspan, n, p=None, seed=0, processes=None,
+                 observables=DEFAULT_OBSERVABLES, quantiles=DEFAULT_QUANTILES, thresholds=None,
+                 block_size=16, **options):
+    """Simulate `n` stochastic trajectories and summarize them
+
+    Trajectory i draws from np.random.RandomState([seed, i]). Extra keyword
+    arguments (omega, method, epsilon, ...) configure the
+    StochasticSimulator built once per worker. With no `observables` a
+    trajectory stops as soon as its fate is decided; otherwise it runs to
+    the end of tspan so the bands cover it. Returns an EnsembleResult whose
+    bands map each observable to an array (len(quantiles), len(tspan)).
+    """
+    tspan = np.asarray(tspan, dtype=float)
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    rows = [system.observable_index(name) for name in observables]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    blocks = [range(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    processes = max(1, min(processes, len(blocks)))
+    initargs = (system, tspan, p, seed, rows, thresholds, not rows, options)
+    if processes == 1:
+        _init_worker(*initargs)
+        results = [_run_block(block) for block in blocks]
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, initargs)
+        try:
+            results = pool.map(_run_block, blocks)
+        finally:
+            pool.close()
+            pool.join()
+
+    records = [r for block_records, _ in results for r in block_records]
+    bands = {}
+    if rows and results:
+        values = np.concatenate([v for _, v in results])
+        q = np.percentile(values, 100 * np.asarray(quantiles), axis=0)
+        bands = dict((name, q[:, :, c]) for c, name in enumerate(observables))
+    return EnsembleResult(n, fate_fractions(records), records, tspan, tuple(quantiles), bands)
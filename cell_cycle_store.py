@@ -0,0 +1,178 @@
+"""Streaming, chunked storage of selected observable trajectories.
+
+Keeping every run's full odesolve() record array in memory does not scale
+to large sweeps. A TrajectoryWriter records only the chosen observables,
+optionally keeping every `decimation`-th time point, buffers `chunk_size`
+runs and then writes them out as one chunk: either a compressed .npz file or,
+with compress=False, one .npy file per observable that can be memory-mapped.
+A JSON manifest is rewritten atomically after every chunk, so a store can be
+read while a sweep is still filling it, and memory use depends only on the
+chunk size.
+
+Layout of a store directory:
+
+    manifest.json
+    chunk-00000.npz                    (compress=True)
+    chunk-00000.OBS_p53.npy ...        (compress=False)
+"""
+
+import json
+import os
+
+import numpy as np
+
+from cell_cycle_cache import atomic_write, makedirs
+
+STORE_FORMAT = 1
+MANIFEST = 'manifest.json'
+
+
+def select_observables(yobs, names, decimation=1):
+    """Return the observables `names` of one run as an array of shape
+    (n_times, len(names)), keeping every `decimation`-th time point
+
+    `yobs` is a record array with one field per observable (odesolve(),
+    Solver.yobs or observable_array()) or a dict of name -> trajectory.
+    """
+    return np.column_stack([np.asarray(yobs[name], dtype=float)[::decimation] for name in names])
+
+
+class TrajectoryWriter(object):
+    """Append runs to a chunked trajectory store; use as a context manager
+    or call close() to flush the last partial chunk
+
+    `metadata` is any JSON-serializable dict describing the runs; it is
+    kept in the manifest for later stages such as plotting.
+    """
+
+    def __init__(self, path, tspan, observables, decimation=1, chunk_size=64, compress=True,
+                 n_params=0, metadata=None):
+        self.path = path
+        self.observables = list(observables)
+        self.decimation = int(decimation)
+        self.tspan = np.asarray(tspan, dtype=float)[::self.decimation]
+        self.chunk_size = int(chunk_size)
+        self.compress = compress
+        self.n_params = int(n_params)
+        self.metadata = metadata or {}
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            raise IOError("A trajectory store already exists at %s" % path)
+        makedirs(path)
+        self.chunks = []
+        self.n_runs = 0
+        self._data = np.empty((self.chunk_size, len(self.tspan), len(self.observables)))
+        self._params = np.empty((self.chunk_size, self.n_params))
+        self._fill = 0
+        self._write_manifest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, yobs, params=None):
+        """Record one run given as a full observable record array or dict"""
+        self.append_selected(select_observables(yobs, self.observables, self.decimation), params)
+
+    def append_selected(self, data, params=None):
+        """Record one run already reduced by select_observables()"""
+        self._data[self._fill] = data
+        if self.n_params:
+            self._params[self._fill] = params
+        self._fill += 1
+        if self._fill == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._fill:
+            return
+        name = 'chunk-%05d' % len(self.chunks)
+        data = self._data[:self._fill]
+        arrays = dict((obs, data[:, :, i]) for i, obs in enumerate(self.observables))
+        if self.n_params:
+            arrays['__params__'] = self._params[:self._fill]
+        if self.compress:
+            np.savez_compressed(os.path.join(self.path, name + '.npz'), **arrays)
+        else:
+            for key, array in arrays.items():
+                np.save(os.path.join(self.path, '%s.%s.npy' % (name, key)), array)
+        self.chunks.append({'name': name, 'runs': self._fill})
+        self.n_runs += self._fill
+        self._fill = 0
+        self._write_manifest()
+
+    def close(self):
+        self.flush()
+
+    def _write_manifest(self):
+        manifest = {
+            'format': STORE_FORMAT,
+            'observables': self.observables,
+            'tspan': self.tspan.tolist(),
+            'decimation': self.decimation,
+            'compress': self.compress,
+            'n_params': self.n_params,
+            'n_runs': self.n_runs,
+            'chunks': self.chunks,
+            'metadata': self.metadata,
+        }
+        atomic_write(os.path.join(self.path, MANIFEST),
+                     json.dumps(manifest, indent=1).encode('utf-8'))
+
+
+class TrajectoryReader(object):
+    """Read a store written by TrajectoryWriter"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest['format'] != STORE_FORMAT:
+            raise IOError("Unsupported trajectory store format %r" % manifest['format'])
+        self.observables = manifest['observables']
+        self.tspan = np.array(manifest['tspan'])
+        self.decimation = manifest['decimation']
+        self.compress = manifest['compress']
+        self.n_params = manifest['n_params']
+        self.n_runs = manifest['n_runs']
+        self.chunks = manifest['chunks']
+        self.metadata = manifest['metadata']
+
+    def __len__(self):
+        return self.n_runs
+
+    def load_chunk(self, chunk, key):
+        if self.compress:
+            with np.load(os.path.join(self.path, chunk['name'] + '.npz')) as f:
+                return f[key]
+        return np.load(os.path.join(self.path, '%s.%s.npy' % (chunk['name'], key)), mmap_mode='r')
+
+    def iter_chunks(self, key):
+        """Yield the observable `key` (or '__params__') chunk by chunk, each
+        an array of shape (runs in chunk, n_times)"""
+        for chunk in self.chunks:
+            yield self.load_chunk(chunk, key)
+
+    def __getitem__(self, key):
+        """All runs of observable `key` as one (n_runs, n_times) array"""
+        if key not in self.observables and not (key == '__params__' and self.n_params):
+            raise KeyError(key)
+        if not self.chunks:
+            width = self.n_params if key == '__params__' else len(self.tspan)
+            return np.empty((0, width))
+        return np.concatenate(list(self.iter_chunks(key)))
+
+    def run(self, index, keys):
+        """The trajectories of observables `keys` for run `index`, as an
+        array of shape (len(keys), n_times); reads only that run's chunk"""
+        offset = 0
+        for chunk in self.chunks:
+            if index < offset + chunk['runs']:
+                return np.array([self.load_chunk(chunk, key)[index - offset] for key in keys])
+            offset += chunk['runs']
+        raise IndexError("Store %s has no run %d" % (self.path, index))
+
+    @property
+    def params(self):
+        return self['__params__']
@@ -0,0 +1,267 @@
+"""Gaussian process emulator of fates and summary features.
+
+Optimization loops only need a few numbers per parameter set: the fate and
+summary features such as the MPF peak time, the OBS_p53 peak height and the
+APC/Cdc20 activation time. FateSurrogate learns them over DDS_0 and a few
+selected parameters from stored sweeps (from_store()) or from a fresh
+space-filling design (train()), with one Gaussian process per fate class
+(on its 0/1 indicator) and per feature:
+
+- inputs are scaled to the unit cube of `bounds` (log scale optional)
+- squared-exponential kernels with one length scale per input, fitted by
+  maximizing the marginal likelihood
+- a prediction of N points costs one (N, n_train) kernel evaluation and a
+  triangular solve, i.e. microseconds per point for a few hundred samples
+
+query() answers from the emulator when it is confident and otherwise
+simulates (integrate() and the same summaries as the training data),
+optionally adding the new sample so the surrogate improves where it is
+used.
+"""
+
+from __future__ import division
+
+import multiprocessing
+from collections import namedtuple
+
+import numpy as np
+import scipy.linalg
+import scipy.optimize
+
+from cell_cycle_fate import FATES, FateClassifier, _OBSERVABLES
+from cell_cycle_integrate import integrate
+from cell_cycle_store import TrajectoryReader
+
+FEATURES = ('mpf_peak_time', 'p53_peak', 'apc_time')
+
+Prediction = namedtuple('Prediction', ['fate', 'probabilities', 'uncertainty', 'features',
+                                       'feature_std', 'simulated'])
+
+
+def summarize(system, tspan, obs, thresholds=None):
+    """Fate and FEATURES of one run, from its (MPF, APC_Ccdc20, p53, CycE)
+    trajectories `obs` of shape (4, len(tspan)); missing features are NaN"""
+    classifier = FateClassifier(system, **(thresholds or {}))
+    for t, row in zip(tspan, np.asarray(obs).T):
+        if classifier.update(t, row):
+            break
+    record = classifier.record()
+    mpf, _, p53, _ = obs
+    apc_time = np.nan if record.apc_time is None else record.apc_time
+    return record.fate, (tspan[int(np.argmax(mpf))], float(np.max(p53)), apc_time)
+
+
+def _kernel(A, B, length):
+    d = (A[:, None, :] - B[None, :, :]) / length
+    return np.exp(-0.5 * (d * d).sum(axis=-1))
+
+
+class _GP(object):
+    """Zero-mean GP on standardized targets with a fitted ARD kernel"""
+
+    def __init__(self, X, y, noise=1e-4, optimize=True, length=None):
+        self.X = X
+        self.mean, self.scale = y.mean(), y.std() or 1.0
+        z = (y - self.mean) / self.scale
+        self.noise = noise
+        self.length = np.full(X.shape[1], 0.3) if length is None else np.asarray(length)
+        if optimize and len(X) > X.shape[1] + 1:
+            result = scipy.optimize.minimize(self._nll, np.log(self.length), args=(z,),
+                                             method='L-BFGS-B',
+                                             bounds=[(np.log(0.01), np.log(10.0))] * X.shape[1])
+            self.length = np.exp(result.x)
+        self._factor(z)
+
+    def _factor(self, z):
+        K = _kernel(self.X, self.X, self.length) + self.noise * np.eye(len(self.X))
+        self.L = scipy.linalg.cholesky(K, lower=True)
+        self.alpha = scipy.linalg.cho_solve((self.L, True), z)
+
+    def _nll(self, log_length, z):
+        K = _kernel(self.X, self.X, np.exp(log_length)) + self.noise * np.eye(len(self.X))
+        try:
+            L = scipy.linalg.cholesky(K, lower=True)
+        except np.linalg.LinAlgError:
+            return 1e20
+        alpha = scipy.linalg.cho_solve((L, True), z)
+        return 0.5 * z.dot(alpha) + np.log(np.diag(L)).sum()
+
+    def predict(self, Xs):
+        Ks = _kernel(Xs, self.X, self.length)
+        v = scipy.linalg.solve_triangular(self.L, Ks.T, lower=True)
+        var = np.maximum(1.0 - (v * v).sum(axis=0), 0.0)
+        return self.mean + self.scale * Ks.dot(self.alpha), self.scale * np.sqrt(var)
+
+
+# Per-process state for train()
+_worker = None
+
+
+def _init_worker(system, tspan, rows, thresholds, options):
+    global _worker
+    _worker = (system, tspan, rows, thresholds, options)
+
+
+def _simulate(p):
+    system, tspan, rows, thresholds, options = _worker
+    y, _ = integrate(system, tspan, p, **options)
+    return summarize(system, tspan[:len(y)], system.observables(y)[:, rows].T, thresholds)
+
+
+class FateSurrogate(object):
+    """Emulator of fate and FEATURES over the parameters `names`
+
+    X holds the training parameter values (n, len(names)), `fates` the fate
+    names and `features` an array (n, len(FEATURES)) with NaN where a
+    feature is undefined (e.g. no APC/Cdc20 activation in an arrested cell).
+    """
+
+    def __init__(self, system, tspan, names, bounds, X, fates, features, log=False,
+                 thresholds=None, noise=1e-4, **options):
+        self.system = system
+        self.tspan = np.asarray(tspan, dtype=float)
+        self.names = list(names)
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.log = np.broadcast_to(np.asarray(log, dtype=bool), (len(self.names),))
+        self.thresholds = thresholds
+        self.noise = noise
+        self.options = options
+        self.columns = [system.parameter_index(name) for name in self.names]
+        self.rows = [system.observable_index(name) for name in _OBSERVABLES]
+        self.X = np.asarray(X, dtype=float).reshape(-1, len(self.names))
+        self.fates = list(fates)
+        self.features = np.asarray(features, dtype=float).reshape(-1, len(FEATURES))
+        self.fit()
+
+    def _unit(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        lo, hi = self.bounds[:, 0].copy(), self.bounds[:, 1].copy()
+        X = np.where(self.log, np.log(np.where(self.log, X, 1.0)), X)
+        lo = np.where(self.log, np.log(np.where(self.log, lo, 1.0)), lo)
+        hi = np.where(self.log, np.log(np.where(self.log, hi, 1.0)), hi)
+        return (X - lo) / (hi - lo)
+
+    def fit(self, optimize=True):
+        """(Re)fit every GP to the training data; optimize=False keeps the
+        current length scales"""
+        U = self._unit(self.X)
+        old = getattr(self, '_gps', {})
+        self.classes = [f for f in FATES if f in self.fates]
+        self._gps = {}
+        for name in self.classes:
+            target = np.array([float(f == name) for f in self.fates])
+            previous = old.get(name)
+            self._gps[name] = _GP(U, target, self.noise, optimize or previous is None,
+                                  None if previous is None else previous.length)
+        for k, name in enumerate(FEATURES):
+            ok = np.isfinite(self.features[:, k])
+            previous = old.get(name)
+            if ok.sum() >= 2:
+                self._gps[name] = _GP(U[ok], self.features[ok, k], self.noise,
+                                      optimize or previous is None,
+                                      None if previous is None else previous.length)
+
+    def predict(self, X):
+        """Predictions for parameter values X (m, len(names)): a Prediction
+        of arrays; uncertainty is the largest standard deviation among the
+        class indicators plus the part of it not separating the two most
+        likely classes"""
+        U = self._unit(X)
+        means, stds = [], []
+        for name in self.classes:
+            m, s = self._gps[name].predict(U)
+            means.append(m)
+            stds.append(s)
+        means = np.clip(np.array(means), 0.0, 1.0)
+        stds = np.array(stds)
+        probabilities = means / np.maximum(means.sum(axis=0), 1e-12)
+        order = np.sort(probabilities, axis=0)
+        margin = order[-1] - (order[-2] if len(order) > 1 else 0.0)
+        uncertainty = np.maximum(stds.max(axis=0), 0.5 * (1 - margin))
+        fate = np.array(self.classes)[probabilities.argmax(axis=0)]
+        features, feature_std = {}, {}
+        for name in FEATURES:
+            if name in self._gps:
+                features[name], feature_std[name] = self._gps[name].predict(U)
+            else:
+                features[name] = feature_std[name] = np.full(len(U), np.nan)
+        return Prediction(fate, dict(zip(self.classes, probabilities)), uncertainty, features,
+                          feature_std, np.zeros(len(U), dtype=bool))
+
+    def simulate(self, x):
+        """Fate and features of parameter values x by integration"""
+        p = self.system.parameters.copy()
+        p[self.columns] = x
+        y, _ = integrate(self.system, self.tspan, p, **self.options)
+        return summarize(self.system, self.tspan[:len(y)],
+                         self.system.observables(y)[:, self.rows].T, self.thresholds)
+
+    def query(self, x, max_uncertainty=0.1, learn=True):
+        """Prediction for one point x (len(names),) from the emulator, or from
+        a simulation if its uncertainty exceeds max_uncertainty; with
+        learn=True simulated points join the training data"""
+        prediction = self.predict(x)
+        if prediction.uncertainty[0] <= max_uncertainty:
+            return Prediction(prediction.fate[0],
+                              dict((k, v[0]) for k, v in prediction.probabilities.items()),
+                              prediction.uncertainty[0],
+                              dict((k, v[0]) for k, v in prediction.features.items()),
+                              dict((k, v[0]) for k, v in prediction.feature_std.items()), False)
+        fate, features = self.simulate(x)
+        if learn:
+            self.X = np.vstack([self.X, np.asarray(x, dtype=float)[None]])
+            self.fates.append(fate)
+            self.features = np.vstack([self.features, [features]])
+            self.fit(optimize=False)
+        return Prediction(fate, dict((c, float(c == fate)) for c in self.classes), 0.0,
+                          dict(zip(FEATURES, features)), dict.fromkeys(FEATURES, 0.0), True)
+
+    @classmethod
+    def from_store(cls, system, path, names, bounds=None, **kwargs):
+        """Train on a trajectory store written with n_params (full parameter
+        vectors in model order) and the MPF, APC_Ccdc20, p53 and CycE
+        observables; `bounds` default to the stored range of each parameter"""
+        reader = TrajectoryReader(path)
+        columns = [system.parameter_index(name) for name in names]
+        X = reader.params[:, columns]
+        if bounds is None:
+            bounds = np.column_stack([X.min(axis=0), X.max(axis=0)])
+        obs = np.array([reader[name] for name in _OBSERVABLES])  # (4, runs, times)
+        thresholds = kwargs.get('thresholds')
+        summaries = [summarize(system, reader.tspan, obs[:, i], thresholds)
+                     for i in range(len(X))]
+        return cls(system, reader.tspan, names, bounds, X, [s[0] for s in summaries],
+                   [s[1] for s in summaries], **kwargs)
+
+    @classmethod
+    def train(cls, system, tspan, names, bounds, n=200, seed=0, processes=None, log=False,
+              thresholds=None, **kwargs):
+        """Simulate a Latin hypercube of n points within `bounds` and train
+        on it"""
+        rng = np.random.RandomState(seed)
+        d = len(names)
+        U = (np.argsort(rng.rand(n, d), axis=0) + rng.rand(n, d)) / n
+        bounds = np.asarray(bounds, dtype=float)
+        log = np.broadcast_to(np.asarray(log, dtype=bool), (d,))
+        lo = np.where(log, np.log(np.where(log, bounds[:, 0], 1.0)), bounds[:, 0])
+        hi = np.where(log, np.log(np.where(log, bounds[:, 1], 1.0)), bounds[:, 1])
+        X = lo + U * (hi - lo)
+        X = np.where(log, np.exp(X), X)
+        p = np.tile(system.parameters, (n, 1))
+        p[:, [system.parameter_index(name) for name in names]] = X
+        rows = [system.observable_index(name) for name in _OBSERVABLES]
+        options = dict((k, v) for k, v in kwargs.items() if k != 'noise')
+        initargs = (system, np.asarray(tspan, dtype=float), rows, thresholds, options)
+        processes = processes or multiprocessing.cpu_count()
+        if processes == 1:
+            _init_worker(*initargs)
+            summaries = [_simulate(q) for q in p]
+        else:
+            pool = multiprocessing.Pool(processes, _init_worker, initargs)
+            try:
+                summaries = pool.map(_simulate, p)
+            finally:
+                pool.close()
+                pool.join()
+        return cls(system, tspan, names, bounds, X, [s[0] for s in summaries],
+                   [s[1] for s in summaries], log=log, thresholds=thresholds, **kwargs)
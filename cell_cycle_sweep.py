@@ -0,0 +1,150 @@
+"""Parallel parameter sweeps over a single generated reaction network.
+
+Calling set_dna_damage() and odesolve() once per damage level mutates the
+model, regenerates the ODE right-hand side for every run and keeps a single
+core busy. The functions here generate the network once, give every run its
+own parameter vector (the model is never modified) and spread the
+integrations over a process pool. They use the same OdeSystem and
+cell_cycle_integrate.integrate() stack as the rest of the package, so a
+sweep and a single run with the same options give the same trajectories.
+Results come back stacked into one observable record array whose leading
+axis is the sweep axis, so that y["OBS_p53"][i] is the OBS_p53 trajectory
+of the i-th parameter set.
+"""
+
+from __future__ import division
+
+import multiprocessing
+
+import numpy as np
+
+from cell_cycle_integrate import add_stats, integrate, observable_array
+from cell_cycle_odes import OdeSystem
+from cell_cycle_reduce import ReducedSystem
+from cell_cycle_store import select_observables
+
+DAMAGE_PARAMETER = 'DDS_0'
+
+# Per-process (system, tspan, integrate() options), set once by _init_worker
+# and reused for every run, and the (observables, decimation) selection to
+# apply when streaming
+_worker = None
+_selection = None
+
+
+def parameter_values(model, overrides=None):
+    """Return the model's parameter values as a list, in model order, with
+    `overrides` (a dict of parameter name -> value) applied"""
+    values = [p.value for p in model.parameters]
+    if overrides:
+        index = dict((p.name, i) for i, p in enumerate(model.parameters))
+        for name, value in overrides.items():
+            if name not in index:
+                raise KeyError("Model has no parameter named %r" % name)
+            values[index[name]] = value
+    return values
+
+
+def ode_system(target):
+    """The OdeSystem of `target`, a pysb model or already an OdeSystem (or
+    a cell_cycle_reduce.ReducedSystem)"""
+    return target if hasattr(target, 'rate_exprs') else OdeSystem.from_model(target)
+
+
+def _init_worker(system, tspan, options, selection=None):
+    global _worker, _selection
+    _worker = system, tspan, options
+    _selection = selection
+
+
+def _run(job):
+    p, y0 = job
+    system, tspan, options = _worker
+    if isinstance(system, ReducedSystem):
+        # full states from the run's own p, from a full y0
+        y, stats = system.integrate(tspan, p, y0, **options)
+        yobs = observable_array(system.full, y)
+    else:
+        y, stats = integrate(system, tspan, p, y0, **options)
+        yobs = observable_array(system, y)
+    if _selection is not None:
+        yobs = select_observables(yobs, *_selection)
+    return yobs, add_stats({}, stats)
+
+
+def sweep_parameters(model, tspan, overrides, processes=None, writer=None, y0=None,
+                     stats=None, **integrate_options):
+    """Integrate `model` once for every dict in `overrides`
+
+    `model` is a pysb model, whose network is generated (or loaded from the
+    network cache) and turned into an OdeSystem once up front, an OdeSystem
+    or a cell_cycle_reduce.ReducedSystem, whose runs are expanded to full
+    states (y0 is full as well). Every run goes through
+    cell_cycle_integrate.integrate(), with `integrate_options` (method,
+    rtol, atol, ...). `processes` defaults to the number of CPUs; pass
+    processes=1 to run serially in the calling process.
+
+    Returns a record array of shape (len(overrides), len(tspan)) with one
+    field per observable. If a cell_cycle_store.TrajectoryWriter is given as
+    `writer`, workers reduce each run to the writer's observables and
+    decimation, runs are appended to it in order as they finish and the
+    writer is returned instead, so memory use does not grow with the sweep.
+
+    `y0` replaces the initial conditions: one species vector for every run,
+    or one per run (e.g. from cell_cycle_warmstart). If a dict is given as
+    `stats`, the solver counters of every run are added into it (see
+    cell_cycle_integrate.add_stats()).
+    """
+    system = ode_system(model)
+    runs = [system.parameter_vector(o) for o in overrides]
+    if not runs:
+        raise ValueError("At least one parameter set is required")
+    if y0 is None or np.ndim(y0) == 1:
+        y0 = [y0] * len(runs)
+    elif len(y0) != len(runs):
+        raise ValueError("Expected one initial state per parameter set")
+    jobs = list(zip(runs, y0))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(runs)))
+    selection = None if writer is None else (writer.observables, writer.decimation)
+    initargs = (system, np.asarray(tspan, dtype=float), integrate_options, selection)
+
+    pool = None
+    if processes == 1:
+        _init_worker(*initargs)
+        results = (_run(job) for job in jobs)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, initargs)
+        chunksize = max(1, len(runs) // (4 * processes))
+        results = pool.imap(_run, jobs, chunksize)
+    if stats is None:
+        stats = {}
+    try:
+        if writer is None:
+            rows = []
+            for data, counters in results:
+                rows.append(data)
+                add_stats(stats, counters)
+            return np.array(rows).view(np.recarray)
+        for i, (data, counters) in enumerate(results):
+            writer.append_selected(data, runs[i] if writer.n_params else None)
+            add_stats(stats, counters)
+        writer.flush()
+        return writer
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def sweep_dna_damage(model, tspan, levels, processes=None, writer=None, y0=None,
+                     stats=None, **integrate_options):
+    """Integrate `model` at every DNA damage level (DDS_0) in `levels`
+
+    Returns a record array of shape (len(levels), len(tspan)) with one field
+    per observable, or `writer`; see sweep_parameters().
+    """
+    overrides = [{DAMAGE_PARAMETER: level} for level in levels]
+    return sweep_parameters(model, tspan, overrides, processes, writer, y0, stats,
+                            **integrate_options)
@@ -0,0 +1,148 @@
+"""Start runs from a relaxed cell cycle state instead of the hand-set ICs.
+
+The shared_Y*_0, X*_0 and Y*_0 initial values are far from the cycle, and
+every run of a sweep spends the start of the 0-6000 horizon relaxing onto
+it. relaxed_state() does that relaxation once per base parameter set:
+
+1. integrate from the initial values for `relax_time`
+2. if the model oscillates, estimate the period from `observable` and move
+   on to its next upward crossing of its mean, so every warm start begins
+   at the same phase of the cycle (refine=True additionally converges the
+   orbit with cell_cycle_continuation.limit_cycle())
+
+and stores the result in a cell_cycle_memo.ResultCache, so later scripts
+and workers only look it up.
+
+A run with other parameters then starts from that state, with the species
+of every changed initial condition parameter reset to its new value: DDS_0
+is the initial amount of Signal and SignalDamp, so a damage level becomes
+a dose given to a cycling cell. `burn_in` first integrates the relaxed
+state for that long under the run's other parameters, for sweeps over rate
+constants that move the cycle itself.
+"""
+
+from __future__ import division
+
+from collections import namedtuple
+
+import numpy as np
+
+from cell_cycle_continuation import estimate_period, limit_cycle
+from cell_cycle_integrate import integrate
+from cell_cycle_memo import default_cache, network_id, result_key
+from cell_cycle_sweep import DAMAGE_PARAMETER, ode_system, sweep_parameters
+
+CycleState = namedtuple('CycleState', ['state', 'parameters', 'period', 'relax_time'])
+
+
+def _phase_aligned(system, y, p, period, observable, points=400, **options):
+    """State at the first upward crossing of the observable's mean within
+    the next 1.5 periods after y"""
+    tspan = np.linspace(0.0, 1.5 * period, points)
+    ys = integrate(system, tspan, p, y, **options)[0]
+    x = system.observables(ys)[:, system.observable_index(observable)]
+    level = x.mean()
+    up = np.nonzero((x[:-1] < level) & (x[1:] >= level))[0]
+    if not len(up):
+        return ys[-1]
+    i = up[0]
+    t_cross = tspan[i] + (level - x[i]) * (tspan[i + 1] - tspan[i]) / (x[i + 1] - x[i])
+    return integrate(system, [tspan[i], t_cross], p, ys[i], **options)[0][-1]
+
+
+def relaxed_state(system, p=None, relax_time=3000.0, observable='OBS_MPF', refine=False,
+                  cache=None, **options):
+    """The relaxed cycle state for parameter vector `p` (default: the
+    model's), computed once and kept in `cache` (default: the memo cache;
+    False: no caching). Extra keyword arguments go to integrate().
+    Returns a CycleState; its period is None if the model does not
+    oscillate.
+    """
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    cache = default_cache() if cache is None else cache
+    network = network_id(system)
+    key = result_key(network, p, None, [relax_time],
+                     dict(options, kind='relaxed', observable=observable, refine=refine))
+    entry = cache.get(key) if cache else None
+    if entry is not None:
+        period = float(entry['period'])
+        return CycleState(entry['y'][0], p, None if np.isnan(period) else period, relax_time)
+
+    tspan = np.linspace(0.0, relax_time, 2001)
+    ys = integrate(system, tspan, p, **options)[0]
+    half = len(tspan) // 2
+    x = system.observables(ys[half:])[:, system.observable_index(observable)]
+    period = estimate_period(tspan[half:], x)
+    y = ys[-1]
+    if period is not None:
+        y = _phase_aligned(system, y, p, period, observable, **options)
+        if refine:
+            cycle = limit_cycle(system, p, y, period, observable=observable)
+            y, period = cycle.state, cycle.period
+    if cache:
+        cache.put(key, network, p, [relax_time], y=y[None],
+                  period=np.nan if period is None else period)
+    return CycleState(y, p, period, relax_time)
+
+
+def warm_initial_values(system, cycle, p):
+    """Initial state for parameter vector `p` from the CycleState `cycle`:
+    its state with the species of every initial condition parameter that
+    differs from the cycle's parameters set to the new value"""
+    p = np.asarray(p, dtype=float)
+    y0 = np.array(cycle.state, dtype=float)
+    changed = p[system.ic_parameters] != cycle.parameters[system.ic_parameters]
+    y0[system.ic_species[changed]] = p[system.ic_parameters[changed]]
+    return y0
+
+
+def _burned_in(system, cycle, p, burn_in, **options):
+    """The cycle state integrated for burn_in under p, with the initial
+    condition parameters kept at the cycle's values"""
+    q = np.array(p, dtype=float)
+    q[system.ic_parameters] = cycle.parameters[system.ic_parameters]
+    y = integrate(system, [0.0, burn_in], q, cycle.state, **options)[0][-1]
+    return cycle._replace(state=y)
+
+
+def warm_integrate(system, tspan, p=None, cycle=None, burn_in=0.0, **options):
+    """integrate() from the relaxed state; `cycle` defaults to
+    relaxed_state() of the model's own parameters"""
+    p = system.parameters if p is None else np.asarray(p, dtype=float)
+    cycle = relaxed_state(system, **options) if cycle is None else cycle
+    if burn_in > 0:
+        cycle = _burned_in(system, cycle, p, burn_in, **options)
+    return integrate(system, tspan, p, warm_initial_values(system, cycle, p), **options)
+
+
+def warm_sweep_dna_damage(model, tspan, levels, base=None, relax_time=3000.0, system=None,
+                          burn_in=0.0, processes=None, writer=None, stats=None,
+                          **integrate_options):
+    """cell_cycle_sweep.sweep_dna_damage() with every run starting from the
+    relaxed state of the base parameters (`base`: overrides, DDS_0 = 0 by
+    default) instead of the model's initial values
+
+    With `burn_in`, each level's start is the relaxed state integrated for
+    that long under the level's parameters first (see warm_integrate()).
+    The relaxed state and the sweep use the OdeSystem of the model (pass
+    `system` to reuse one); `integrate_options` apply to the relaxation and
+    burn-in as well as to the runs.
+    """
+    system = ode_system(model) if system is None else system
+    base = dict({DAMAGE_PARAMETER: 0.0}, **(base or {}))
+    cycle = relaxed_state(system, system.parameter_vector(base), relax_time, **integrate_options)
+    overrides = [dict(base, **{DAMAGE_PARAMETER: level}) for level in levels]
+    y0, burned = [], {}
+    for o in overrides:
+        p = system.parameter_vector(o)
+        start = cycle
+        if burn_in > 0:
+            # Levels that differ only in initial conditions share a burn-in
+            q = p.copy()
+            q[system.ic_parameters] = cycle.parameters[system.ic_parameters]
+            if q.tobytes() not in burned:
+                burned[q.tobytes()] = _burned_in(system, cycle, q, burn_in, **integrate_options)
+            start = burned[q.tobytes()]
+        y0.append(warm_initial_values(system, start, p))
+    return sweep_parameters(system, tspan, overrides, processes, writer, y0, stats,
+                            **integrate_options)
@@ -4,17 +4,20 @@ from pysb.macros import *
 from pysb.bng import *
 from pysb.core import *
 from pysb.integrate import odesolve
-import pylab as pl
 from numpy import linspace
 from sympy import sympify
 from scipy import constants 
+import hashlib
+import os
+import shutil
 
- 
-import G1_S_v2
- 
-import G2_M_v2
- 
-import cell_cycle_shared
+
+from cell_cycle_builder import ModelSpec, build_model
+from cell_cycle_cache import cached_generate_equations, network_key
+from cell_cycle_plots import APC_OBSERVABLES, PROTEIN_OBSERVABLES, damage_figures, render_figures
+from cell_cycle_store import TrajectoryWriter
+from cell_cycle_sweep import sweep_dna_damage
+from cell_cycle_warmstart import warm_sweep_dna_damage
 
 # G1_S_v2.declare_monomers()
 # 
@@ -23,17 +26,8 @@ import cell_cycle_shared
 # from cell_cycle_shared import *
 # from cell_cycle_shared import declare_initial_conditions as shared_dic
 
-    
-Model()  
-    
-cell_cycle_shared.declare_monomers()
-G2_M_v2.declare_parameters()
-G1_S_v2.declare_parameters()
-cell_cycle_shared.declare_parameters()
-cell_cycle_shared.declare_initial_conditions()
-cell_cycle_shared.declare_observables()
-# cell_cycle_shared.declare_functions()
-G2_M_v2.declare_functions()
+
+model = build_model(ModelSpec())
 
 for m in model.monomers:
     print m
@@ -54,17 +48,7 @@ for exp in model.expressions:
     print exp
 
 
-G2_M_v2.declare_rules()
-G1_S_v2.simulate_signal_degradation()
-G1_S_v2.p16_p27_inhibition()
-G1_S_v2.CDK2_activation()
-G1_S_v2.Rb_E2F_activation()
-G1_S_v2.DNA_damage_pathway()
-cell_cycle_shared.declare_rules()
-     
-
-    
-generate_equations(model, verbose=True)
+cached_generate_equations(model, verbose=True, incremental=True)
 
 ### *** Checking and Printing Everything to Screen ***
 
@@ -126,129 +110,32 @@ generate_equations(model, verbose=True)
 
 t = linspace(0,6000,600)
 
-## ** Set DNA Damage (None) **
-set_dna_damage(0.0)
-y = odesolve(model,t,verbose=True)
- 
-pl.figure()
-for obs in ["OBS_p27", "OBS_CycE", "OBS_CycA", "OBS_CycB", "OBS_CycE_CDK2"]:
-    pl.plot(t, y[obs], label=re.match(r"OBS_(\w+)", obs).group(1), linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0)", fontsize=22)
-pl.savefig("Whole Cell Cycle No DNA Damage1.png", format= "png")
-
-pl.figure()
-pl.plot(t, y["OBS_APC_Ccdc20"], label="APC_Cdc20", linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level (APC_Cdc20)", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0)", fontsize=22)
-pl.savefig("Whole Cell Cycle No DNA Damage2.png", format= "png")
-
-## ** Set DNA Damage (Low) **
-set_dna_damage(0.002)
-y = odesolve(model,t,verbose=True)
- 
-pl.figure()
-for obs in ["OBS_p27", "OBS_CycE", "OBS_CycA", "OBS_CycB", "OBS_CycE_CDK2"]:
-    pl.plot(t, y[obs], label=re.match(r"OBS_(\w+)", obs).group(1), linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.002)", fontsize=22)
-pl.savefig("Whole Cell Cycle Low DNA Damage1.png", format= "png")
-
-pl.figure()
-pl.plot(t, y["OBS_APC_Ccdc20"], label="APC_Cdc20", linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level (APC_Cdc20)", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.002)", fontsize=22)
-pl.savefig("Whole Cell Cycle Low DNA Damage2.png", format= "png")
-
-## ** Set DNA Damage (Medium) **
-set_dna_damage(0.004)
-y = odesolve(model,t,verbose=True)
- 
-pl.figure()
-for obs in ["OBS_p27", "OBS_CycE", "OBS_CycA", "OBS_CycB", "OBS_CycE_CDK2"]:
-    pl.plot(t, y[obs], label=re.match(r"OBS_(\w+)", obs).group(1), linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.004)", fontsize=22)
-pl.savefig("Whole Cell Cycle Medium DNA Damage1.png", format= "png")
-
-pl.figure()
-pl.plot(t, y["OBS_APC_Ccdc20"], label="APC_Cdc20", linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level (APC_Cdc20)", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.004)", fontsize=22)
-pl.savefig("Whole Cell Cycle Medium DNA Damage2.png", format= "png")
-
-## ** Set DNA Damage (High) **
-set_dna_damage(0.008)
-y = odesolve(model,t,verbose=True)
- 
-pl.figure()
-for obs in ["OBS_p27", "OBS_CycE", "OBS_CycA", "OBS_CycB", "OBS_CycE_CDK2"]:
-    pl.plot(t, y[obs], label=re.match(r"OBS_(\w+)", obs).group(1), linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.008)", fontsize=22)
-pl.savefig("Whole Cell Cycle High DNA Damage1.png", format= "png")
-
-pl.figure()
-pl.plot(t, y["OBS_APC_Ccdc20"], label="APC_Cdc20", linewidth=3)
-pl.legend(loc='upper left', prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level (APC_Cdc20)", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.008)", fontsize=22)
-pl.savefig("Whole Cell Cycle High DNA Damage2.png", format= "png")
-
-## ** Set DNA Damage (Extreme) **
-set_dna_damage(0.016)
-y = odesolve(model,t,verbose=True)
- 
-pl.figure()
-for obs in ["OBS_p27", "OBS_CycE", "OBS_CycA", "OBS_CycB", "OBS_CycE_CDK2"]:
-    pl.plot(t, y[obs], label=re.match(r"OBS_(\w+)", obs).group(1), linewidth=3)
-pl.legend(loc=0, prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.016)", fontsize=22)
-pl.savefig("Whole Cell Cycle Extreme DNA Damage1.png", format= "png")
-
-pl.figure()
-pl.plot(t, y["OBS_APC_Ccdc20"], label="APC_Cdc20", linewidth=3)
-pl.legend(loc='upper left', prop={'size': 16})
-pl.xlabel("Time (arbitrary units)", fontsize=22)
-pl.ylabel("Protein Level (APC_Cdc20)", fontsize=22)
-pl.xticks(fontsize=18)
-pl.yticks(fontsize=18)
-pl.title("Protein Dynamics (DNA Damage = 0.016)", fontsize=22)
-pl.savefig("Whole Cell Cycle Extreme DNA Damage2.png", format= "png")
-
-pl.show()
\ No newline at end of file
+## ** DNA Damage Levels: (DDS_0, name, legend location of the APC_Cdc20 plot) **
+damage_levels = [(0.0, "No", 0),
+                 (0.002, "Low", 0),
+                 (0.004, "Medium", 0),
+                 (0.008, "High", 'upper left'),
+                 (0.016, "Extreme", 'upper left')]
+
+## ** Start every level from the relaxed, undamaged cycle instead of the initial values **
+warm_start = False
+
+## ** Simulate once into a results store keyed by the network, parameters and time grid **
+run_key = hashlib.sha1(repr((network_key(model), [p.value for p in model.parameters],
+                             list(t), damage_levels, warm_start)).encode('utf-8')).hexdigest()[:12]
+store = os.path.join("results", "damage_sweep-%s" % run_key)
+
+if not os.path.exists(store):
+    if os.path.exists(store + ".partial"):
+        shutil.rmtree(store + ".partial")
+    with TrajectoryWriter(store + ".partial", t, PROTEIN_OBSERVABLES + APC_OBSERVABLES,
+                          metadata={'damage_levels': damage_levels}) as writer:
+        levels = [level for level, _, _ in damage_levels]
+        if warm_start:
+            warm_sweep_dna_damage(model, t, levels, writer=writer)
+        else:
+            sweep_dna_damage(model, t, levels, writer=writer)
+    os.rename(store + ".partial", store)
+
+## ** Render figures headless; figures whose data and style are unchanged are skipped **
+render_figures(store, damage_figures(damage_levels))
@@ -0,0 +1,92 @@
+"""Small synthetic OdeSystems for the tests.
+
+They are written with species and parameter names instead of a pysb model,
+so the tests need neither BioNetGen nor the cell cycle modules, and use the
+observable names the fate machinery expects (OBS_MPF, OBS_APC_Ccdc20,
+OBS_p53, OBS_CycE).
+"""
+
+from __future__ import division
+
+import numpy as np
+import sympy
+
+from cell_cycle_odes import OdeSystem
+
+
+def make_system(species, parameters, reactions, observables=(), initial=()):
+    """OdeSystem from names
+
+    `parameters` is a list of (name, value), `reactions` a list of (rate law
+    as a string over species and parameter names, reactants, products),
+    `observables` a list of (name, species) and `initial` a list of
+    (species, parameter) initial conditions.
+    """
+    names = [name for name, _ in parameters]
+    symbols = dict((s, sympy.Symbol('__s%d' % i)) for i, s in enumerate(species))
+    symbols.update((p, sympy.Symbol('__p%d' % k)) for k, p in enumerate(names))
+    rates = [sympy.sympify(rate, locals=symbols) for rate, _, _ in reactions]
+    S = np.zeros((len(species), len(reactions)))
+    for j, (_, reactants, products) in enumerate(reactions):
+        for s in reactants:
+            S[species.index(s), j] -= 1
+        for s in products:
+            S[species.index(s), j] += 1
+    M = np.zeros((len(observables), len(species)))
+    for i, (_, members) in enumerate(observables):
+        for s in members:
+            M[i, species.index(s)] += 1
+    return OdeSystem(species, names, [value for _, value in parameters],
+                     [name for name, _ in observables], M, rates, S,
+                     [species.index(s) for s, _ in initial],
+                     [names.index(p) for _, p in initial])
+
+
+def oscillator():
+    """A Brusselator cycle (X, Y) whose production of X is repressed by a
+    damage-induced p53 analogue P, plus a conserved, fast-converting pair
+    A <-> B
+
+    With DDS_0 = 0 the cycle oscillates with a period of about 7; a dose of
+    DDS_0 >~ 1 (the initial amount of the decaying signal Sig) raises P
+    through a Hill term with the integer exponent n and stops it.
+    """
+    species = ['X', 'Y', 'Sig', 'P', 'A', 'B']
+    parameters = [('a', 1.0), ('b', 3.0), ('DDS_0', 0.0), ('kd', 0.01), ('kp', 2.0),
+                  ('K', 0.5), ('n', 4.0), ('kdeg', 0.5), ('Ki', 0.5), ('A_0', 1.0),
+                  ('kf', 2.0), ('kr', 1.0), ('X_0', 1.0), ('Y_0', 1.0)]
+    reactions = [
+        ('a/(1 + (P/Ki)**2)', [], ['X']),
+        ('b*X', ['X'], ['Y']),
+        ('X**2*Y', ['X', 'X', 'Y'], ['X', 'X', 'X']),
+        ('X', ['X'], []),
+        ('kd*Sig', ['Sig'], []),
+        ('kp*Sig**n/(K**n + Sig**n)', [], ['P']),
+        ('kdeg*P', ['P'], []),
+        ('kf*A', ['A'], ['B']),
+        ('kr*B', ['B'], ['A']),
+    ]
+    observables = [('OBS_MPF', ['X']), ('OBS_APC_Ccdc20', ['Y']), ('OBS_p53', ['P']),
+                   ('OBS_CycE', ['X']), ('OBS_AB', ['A', 'B'])]
+    initial = [('X', 'X_0'), ('Y', 'Y_0'), ('Sig', 'DDS_0'), ('A', 'A_0')]
+    return make_system(species, parameters, reactions, observables, initial)
+
+
+def birth_death():
+    """Production at rate k and first-order decay at rate g: the stationary
+    distribution is Poisson with mean omega * k / g"""
+    return make_system(['X'], [('k', 2.0), ('g', 0.5)],
+                       [('k', [], ['X']), ('g*X', ['X'], [])], [('OBS_X', ['X'])])
+
+
+def robertson():
+    """Robertson's stiff chemical kinetics problem"""
+    return make_system(['A', 'B', 'C'], [('k1', 0.04), ('k2', 3e7), ('k3', 1e4), ('A_0', 1.0)],
+                       [('k1*A', ['A'], ['B']), ('k2*B**2', ['B', 'B'], ['B', 'C']),
+                        ('k3*B*C', ['B', 'C'], ['A', 'C'])],
+                       [('OBS_A', ['A']), ('OBS_C', ['C'])], [('A', 'A_0')])
+
+
+# Fate thresholds scaled to oscillator()
+THRESHOLDS = {'mpf_threshold': 2.0, 'apc_threshold': 2.5, 'p53_threshold': 1.0,
+              'p53_duration': 20.0, 'cyce_threshold': 1.5, 'arrest_time': 50.0}
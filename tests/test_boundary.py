@@ -0,0 +1,68 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+import cell_cycle_boundary
+from cell_cycle_boundary import fate_map
+from cell_cycle_fate import FateRecord
+
+from .systems import oscillator
+
+
+def _fates(fate):
+    """A classify_fates() stand-in deciding fate(x, y) from the kp and kd
+    columns, which records every simulated row"""
+    rows = []
+
+    def classify_fates(system, tspan, p, processes=None, **options):
+        kp, kd = system.parameter_index('kp'), system.parameter_index('kd')
+        rows.extend(p)
+        return [FateRecord(fate(q[kp], q[kd]), None, None, None, None, None, None, tspan[-1])
+                for q in p]
+    return classify_fates, rows
+
+
+def _uniform(fm, fate):
+    return np.array([[fm.classes.index(fate(x, y)) for y in fm.y] for x in fm.x])
+
+
+def test_straight_boundary_is_exact_with_fewer_simulations(monkeypatch):
+    fate = lambda x, y: 'apoptotic' if x + y > 1.03 else 'divided'
+    classify, rows = _fates(fate)
+    monkeypatch.setattr(cell_cycle_boundary, 'classify_fates', classify)
+    system = oscillator()
+    fm = fate_map(system, [0, 10], ('kp', 0, 1), ('kd', 0, 1), coarse=(4, 4), levels=3,
+                  base={'a': 2.0})
+    assert fm.x_name == 'kp' and fm.y_name == 'kd'
+    assert fm.labels.shape == (33, 33) and fm.classes == ('divided', 'apoptotic')
+    assert np.array_equal(fm.labels, _uniform(fm, fate))
+    assert fm.n_simulations == len(rows) == fm.sampled.sum() < 33 * 33
+    assert len(set(map(tuple, rows))) == len(rows)
+    assert all(q[system.parameter_index('a')] == 2.0 for q in rows)
+    assert len(fm.boundary) and np.allclose(fm.boundary.sum(axis=1), 1.03, atol=1 / 32)
+
+
+def test_neighbors_catch_boundaries_between_equal_corners(monkeypatch):
+    # A narrow bump of the boundary into cells whose corners all agree
+    fate = lambda x, y: 'arrested' if y > 0.5 + 0.2 * np.exp(-((x - 0.6) / 0.03) ** 2) \
+        else 'divided'
+    monkeypatch.setattr(cell_cycle_boundary, 'classify_fates', _fates(fate)[0])
+    system = oscillator()
+    options = dict(coarse=(4, 4), levels=3)
+    fm = fate_map(system, [0, 10], ('kp', 0, 1), ('kd', 0, 1), **options)
+    assert np.array_equal(fm.labels, _uniform(fm, fate))
+    plain = fate_map(system, [0, 10], ('kp', 0, 1), ('kd', 0, 1), neighbors=False, **options)
+    assert not np.array_equal(plain.labels, _uniform(plain, fate))
+    assert plain.n_simulations < fm.n_simulations
+
+
+def test_log_axes_and_labels(monkeypatch):
+    monkeypatch.setattr(cell_cycle_boundary, 'classify_fates',
+                        _fates(lambda x, y: 'divided' if x < 1 else 'arrested')[0])
+    fm = fate_map(oscillator(), [0, 10], ('kp', 0.01, 100, 'log'), ('kd', 0, 1),
+                  coarse=(2, 2), levels=2, label=lambda record: record.fate[0])
+    assert np.allclose(fm.x, np.logspace(-2, 2, 9))
+    assert fm.classes == ('a', 'd')
+    with pytest.raises(ValueError):
+        fate_map(oscillator(), [0, 10], ('kp', 0, 1, 'cubic'), ('kd', 0, 1))
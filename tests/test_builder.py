@@ -0,0 +1,93 @@
+from __future__ import division
+
+import sys
+import textwrap
+
+import pytest
+
+import cell_cycle_builder
+from cell_cycle_builder import MODULES, ModelSpec, build_model
+
+# A stand-in for the declaring modules: the same self-export and
+# alias_model_components() pattern, one rule per model module
+_DECLARE = '''
+from pysb import Monomer, Parameter, Rule, Initial, Observable
+from pysb.util import alias_model_components
+
+
+def declare_monomers():
+    Monomer('A')
+    Monomer('B')
+
+
+def declare_parameters():
+    Parameter('A_0', 1.0)
+    Parameter('k1', 1.0)
+    Parameter('k2', 2.0)
+    alias_model_components()
+
+
+def declare_observables():
+    Initial(A(), A_0)
+    Observable('OBS_A', A())
+
+
+def g2_m():
+    Rule('g2_m', A() >> B(), k1)
+
+
+def g1_s():
+    Rule('g1_s', B() >> A(), k2)
+
+
+def shared():
+    Rule('shared', B() >> None, k2)
+'''
+
+
+@pytest.fixture
+def declarations(tmpdir, monkeypatch):
+    tmpdir.join('fake_declare.py').write(textwrap.dedent(_DECLARE))
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.delitem(sys.modules, 'fake_declare', raising=False)
+    monkeypatch.setattr(cell_cycle_builder, '_SOURCES', ('fake_declare',))
+    monkeypatch.setattr(cell_cycle_builder, '_BASE_STEPS',
+                        tuple(('fake_declare', f) for f in
+                              ('declare_monomers', 'declare_parameters',
+                               'declare_observables')))
+    monkeypatch.setattr(cell_cycle_builder, '_MODULE_STEPS',
+                        tuple((m, (('fake_declare', m),)) for m in MODULES))
+
+
+def test_specs_are_normalized():
+    spec = ModelSpec(('shared', 'g2_m'), {'k2': 3.0, 'k1': 0.5})
+    assert spec.modules == ('g2_m', 'shared')
+    assert spec.parameters == (('k1', 0.5), ('k2', 3.0))
+    assert spec == ModelSpec(['g2_m', 'shared'], [('k2', 3.0), ('k1', 0.5)])
+    assert spec.key() == ModelSpec(('g2_m', 'shared'), {'k1': 0.5, 'k2': 3.0}).key()
+    assert spec.key() != ModelSpec().key()
+    other = spec.replace(parameters={'k1': 2.0}, name='other')
+    assert other.parameters == (('k1', 2.0), ('k2', 3.0)) and other.name == 'other'
+    assert other.modules == spec.modules
+    with pytest.raises(ValueError):
+        ModelSpec(('g2_m', 'mitosis'))
+
+
+def test_models_are_independent(declarations):
+    full = build_model()
+    g1_s = build_model(ModelSpec(('g1_s',), {'k2': 5.0}))
+    assert [r.name for r in full.rules] == ['g2_m', 'g1_s', 'shared']
+    assert [r.name for r in g1_s.rules] == ['g1_s']
+    assert g1_s.parameters['k2'].value == 5.0 and full.parameters['k2'].value == 2.0
+    assert full.name == 'cell_cycle_g2_m_g1_s_shared'
+    assert full.monomers['A'] is not g1_s.monomers['A']
+    assert not hasattr(sys.modules['fake_declare'], 'k1')
+    assert not hasattr(cell_cycle_builder, full.name) and not hasattr(cell_cycle_builder, 'A')
+
+
+def test_models_are_built_once_per_process(declarations, monkeypatch):
+    monkeypatch.setattr(cell_cycle_builder, '_models', {})
+    spec = ModelSpec(('g2_m',))
+    model = cell_cycle_builder.get_model(spec)
+    assert cell_cycle_builder.get_model(ModelSpec(['g2_m'])) is model
+    assert cell_cycle_builder.get_model() is not model
@@ -0,0 +1,122 @@
+from __future__ import division
+
+import os
+
+import numpy as np
+import pytest
+import sympy
+from pysb import Model, Monomer, Observable, Parameter, Rule
+from pysb.bng import generate_equations
+
+import cell_cycle_odes
+from cell_cycle_cache import _dump_species, _species_key, cached_generate_equations, network_key
+from cell_cycle_odes import OdeSystem
+
+
+def _bng_available():
+    try:
+        from pysb.pathfinder import get_path
+        get_path('bng')
+    except Exception:
+        return False
+    return True
+
+
+needs_bng = pytest.mark.skipif(not _bng_available(), reason="needs BioNetGen")
+
+
+def binding_model():
+    """A + B <-> AB and AB -> A + B* on a small two-monomer network"""
+    model = Model(_export=False)
+    A = Monomer('A', ['b'], _export=False)
+    B = Monomer('B', ['a', 's'], {'s': ['u', 'p']}, _export=False)
+    for component in [A, B, Parameter('kf', 1.0, _export=False),
+                      Parameter('kr', 0.5, _export=False), Parameter('kc', 0.1, _export=False),
+                      Parameter('A_0', 10.0, _export=False), Parameter('B_0', 5.0, _export=False)]:
+        model.add_component(component)
+    p = model.parameters
+    model.initial(A(b=None), p['A_0'])
+    model.initial(B(a=None, s='u'), p['B_0'])
+    model.add_component(Rule('bind', A(b=None) + B(a=None, s='u') | A(b=1) % B(a=1, s='u'),
+                             p['kf'], p['kr'], _export=False))
+    model.add_component(Rule('convert', A(b=1) % B(a=1, s='u') >> A(b=None) + B(a=None, s='p'),
+                             p['kc'], _export=False))
+    model.add_component(Observable('OBS_Bp', B(s='p'), _export=False))
+    return model
+
+
+@needs_bng
+def test_hit_and_miss(tmpdir):
+    assert cached_generate_equations(binding_model(), str(tmpdir)) is False
+    model = binding_model()
+    assert cached_generate_equations(model, str(tmpdir)) is True
+    assert len(model.species) == 4 and len(model.reactions) == 3
+
+
+@needs_bng
+def test_generated_model_is_not_a_hit_and_gets_stored(tmpdir):
+    model = binding_model()
+    generate_equations(model)
+    assert cached_generate_equations(model, str(tmpdir)) is None
+    assert os.path.exists(os.path.join(str(tmpdir), 'network-%s.pkl' % network_key(model)))
+    assert cached_generate_equations(binding_model(), str(tmpdir)) is True
+
+
+def test_species_key_is_canonical():
+    # A ring of four M(x, y) joined x to y, listed in two orders
+    ring = [('M', {'x': 1, 'y': 2}), ('M', {'x': 3, 'y': 1}),
+            ('M', {'x': 2, 'y': 4}), ('M', {'x': 4, 'y': 3})]
+    relisted = [('M', {'x': 7, 'y': 8}), ('M', {'x': 8, 'y': 5}),
+                ('M', {'x': 5, 'y': 6}), ('M', {'x': 6, 'y': 7})]
+    assert _species_key(ring) == _species_key(relisted)
+    # Same monomers and states, different wiring
+    parallel = [('M', {'x': 1, 'y': 2}), ('M', {'x': 1, 'y': 2})]
+    crossed = [('M', {'x': 1, 'y': 2}), ('M', {'x': 2, 'y': 1})]
+    assert _species_key(parallel) != _species_key(crossed)
+    assert _species_key([('A', {'b': 1}), ('B', {'a': 1, 's': 'u'})]) == \
+        _species_key([('B', {'a': 3, 's': 'u'}), ('A', {'b': 3})])
+
+
+@needs_bng
+def test_incremental_matches_full_generation(tmpdir, capsys):
+    assert cached_generate_equations(binding_model(), str(tmpdir)) is False
+    model = binding_model()
+    model.rules['convert'].rate_forward = model.parameters['kr']
+    assert cached_generate_equations(model, str(tmpdir), verbose=True, incremental=True) is False
+    assert "Regenerated 1 of 2 rules incrementally" in capsys.readouterr().out
+
+    full = binding_model()
+    full.rules['convert'].rate_forward = full.parameters['kr']
+    generate_equations(full)
+    keys = dict((_species_key(_dump_species(cp)), i) for i, cp in enumerate(model.species))
+    index = [keys[_species_key(_dump_species(cp))] for cp in full.species]
+    assert sorted(index) == list(range(len(model.species)))
+    renumber = dict((sympy.Symbol('__s%d' % j), sympy.Symbol('__s%d' % i))
+                    for j, i in enumerate(index))
+    for j, i in enumerate(index):
+        # Compare by name: the two models' Parameters are distinct symbols
+        ode = sympy.sympify(str(full.odes[j])).xreplace(renumber)
+        assert sympy.simplify(ode - sympy.sympify(str(model.odes[i]))) == 0
+    assert len(model.reactions) == len(full.reactions)
+
+
+@needs_bng
+def test_ode_system_is_cached_with_the_network(tmpdir, monkeypatch):
+    cache_dir = str(tmpdir)
+    first = OdeSystem.from_model(binding_model(), cache_dir)
+    assert [n for n in os.listdir(cache_dir) if n.startswith('system-')]
+
+    def no_generation(*args, **kwargs):
+        raise AssertionError("the cached system should be used")
+
+    monkeypatch.setattr(cell_cycle_odes, 'cached_generate_equations', no_generation)
+    model = binding_model()
+    model.parameters['kf'].value = 3.0
+    second = OdeSystem.from_model(model, cache_dir)
+    assert not model.species
+    assert second.species_names == first.species_names
+    assert second.parameters[second.parameter_index('kf')] == 3.0
+    y = first.initial_values() + 0.5
+    assert np.allclose(second.rhs(y, first.parameters), first.rhs(y, first.parameters))
+    assert np.allclose(second.jacobian(y, second.parameters),
+                       first.jacobian(y, second.parameters))
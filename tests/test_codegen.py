@@ -0,0 +1,53 @@
+from __future__ import division
+
+import pickle
+
+import numpy as np
+
+from cell_cycle_codegen import CompiledSystem, cached_source, exponent_columns, generate_source
+
+from .systems import oscillator
+
+
+def _states(system, n=5):
+    rng = np.random.RandomState(3)
+    return rng.rand(n, system.n_species) * 2 + 0.1
+
+
+def test_compiled_matches_lambdified(tmpdir):
+    system = oscillator()
+    compiled = CompiledSystem(system, backend='python', cache_dir=str(tmpdir))
+    p = system.parameter_vector()
+    for y in _states(system):
+        assert np.allclose(compiled.rhs(y, p), system.rhs(y, p), rtol=1e-12, atol=1e-12)
+        assert np.allclose(compiled.jacobian(y, p), system.jacobian(y, p), rtol=1e-12,
+                           atol=1e-12)
+    y = _states(system, 1)[0]
+    assert np.allclose(compiled.jacobian_matrix(y, p).toarray(),
+                       system.jacobian_matrix(y, p).toarray())
+    clone = pickle.loads(pickle.dumps(compiled))
+    assert np.allclose(clone.rhs(y, p), system.rhs(y, p))
+
+
+def test_integer_exponent_parameter_is_squared_out(tmpdir):
+    system = oscillator()
+    n = system.parameter_names.index('n')
+    assert exponent_columns(system) == [n]
+    source = generate_source(system, {n: 4})
+    assert '**' not in source
+    assert '**' in generate_source(system)
+
+
+def test_exponent_change_compiles_new_variant(tmpdir):
+    system = oscillator()
+    compiled = CompiledSystem(system, backend='python', cache_dir=str(tmpdir))
+    n = system.parameter_names.index('n')
+    y = _states(system, 1)[0]
+    for value in (4.0, 3.0, 2.5):
+        p = system.parameter_vector()
+        p[n] = value
+        assert np.allclose(compiled.rhs(y, p), system.rhs(y, p), rtol=1e-12)
+        assert np.allclose(compiled.jacobian(y, p), system.jacobian(y, p), rtol=1e-12)
+    assert len(compiled._functions) == 3
+    assert cached_source(system, str(tmpdir), constants={n: 4}) != \
+        cached_source(system, str(tmpdir), constants={n: 3})
@@ -0,0 +1,56 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from cell_cycle_continuation import (conservation_basis, continue_steady_state, limit_cycle,
+                                     steady_state)
+from cell_cycle_integrate import integrate
+
+from .systems import oscillator
+
+
+def _index(system, *names):
+    return [system.species_names.index(name) for name in names]
+
+
+def test_conservation_laws():
+    system = oscillator()
+    Q, L = conservation_basis(system)
+    assert L.shape == (1, system.n_species)
+    rng = np.random.RandomState(0)
+    for _ in range(3):
+        y = rng.rand(system.n_species)
+        assert abs(L.dot(system.rhs(y, system.parameters))).max() < 1e-12
+    a, b = _index(system, 'A', 'B')
+    assert abs(L[0, a]) == pytest.approx(abs(L[0, b])) and abs(L[0]).sum() == \
+        pytest.approx(abs(L[0, a]) + abs(L[0, b]))
+
+
+def test_steady_state_of_stable_brusselator():
+    system = oscillator()
+    p = system.parameter_vector({'b': 1.5, 'A_0': 3.0})
+    y = steady_state(system, p)
+    x, yy, a, b = _index(system, 'X', 'Y', 'A', 'B')
+    # X* = a, Y* = b / a; A and B share the conserved total 3 as kr : kf
+    assert y[[x, yy, a, b]] == pytest.approx([1.0, 1.5, 1.0, 2.0], abs=1e-8)
+    assert abs(system.rhs(y, p)).max() < 1e-9
+
+
+def test_hopf_bifurcation_of_brusselator():
+    system = oscillator()
+    branch = continue_steady_state(system, 'b', 3.0, system.parameter_vector({'b': 1.5}))
+    hopf = [s for s in branch.special_points if s.kind == 'hopf']
+    # the Brusselator loses stability at b = 1 + a**2
+    assert len(hopf) == 1 and hopf[0].value == pytest.approx(2.0, abs=0.02)
+    assert branch.stable[branch.values < 1.95].all()
+    assert not branch.stable[branch.values > 2.05].any()
+
+
+def test_limit_cycle_is_periodic_with_trivial_multiplier():
+    system = oscillator()
+    cycle = limit_cycle(system, relax_time=100.0)
+    assert cycle.period == pytest.approx(7.15, abs=0.05)
+    assert abs(np.abs(cycle.multipliers) - 1.0).min() < 1e-4
+    y, _ = integrate(system, [0.0, cycle.period], y0=cycle.state, rtol=1e-10, atol=1e-12)
+    assert np.allclose(y[-1], cycle.state, atol=1e-6)
@@ -0,0 +1,145 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from cell_cycle_fate import (DEFAULT_THRESHOLDS, FateClassifier, _Segment, classify,
+                             classify_fates, fate_table, imap_fates)
+from cell_cycle_inputs import Schedule
+from cell_cycle_integrate import add_stats, integrate
+
+from .systems import THRESHOLDS, oscillator
+
+TSPAN = np.linspace(0, 100, 1001)
+
+
+def _feed(classifier, times, mpf, apc, p53, cyce):
+    for row in zip(times, mpf, apc, p53, cyce):
+        if classifier.update(row[0], row[1:]):
+            break
+    return classifier.record()
+
+
+def test_mitosis_is_divided_with_interpolated_times():
+    classifier = FateClassifier(oscillator(), **THRESHOLDS)
+    t = np.linspace(0, 20, 41)
+    mpf = t / 4.0                       # crosses 2.0 at t = 8
+    apc = 3.0 - (t - 13.2) ** 2 / 10    # peaks at t = 13.2
+    record = _feed(classifier, t, mpf, apc, np.zeros_like(t), np.zeros_like(t))
+    assert record.fate == 'divided'
+    assert record.mpf_time == pytest.approx(8.0)
+    assert record.apc_time == pytest.approx(13.2)
+    assert record.t_final < t[-1]
+
+
+def test_sustained_p53_is_apoptotic_and_a_dip_restarts_the_clock():
+    classifier = FateClassifier(oscillator(), **THRESHOLDS)
+    t = np.linspace(0, 60, 121)
+    zeros = np.zeros_like(t)
+    p53 = np.where(t < 5, t / 2.5, 1.5)  # crosses 1.0 at t = 2.5
+    record = _feed(classifier, t, zeros, zeros, p53, zeros)
+    assert record.fate == 'apoptotic'
+    assert record.time == pytest.approx(2.5 + THRESHOLDS['p53_duration'])
+
+    classifier.reset()
+    dip = np.where((t > 15) & (t < 16), 0.5, p53)
+    record = _feed(classifier, t, zeros, zeros, dip, zeros)
+    assert record.fate == 'apoptotic'
+    assert record.p53_time == pytest.approx(15.75)
+    assert record.time == pytest.approx(15.75 + THRESHOLDS['p53_duration'])
+
+
+def test_arrest_phase_depends_on_cyclin_e():
+    classifier = FateClassifier(oscillator(), **THRESHOLDS)
+    t = np.linspace(0, 60, 121)
+    zeros = np.zeros_like(t)
+    assert _feed(classifier, t, zeros, zeros, zeros, zeros).arrest_phase == 'G1'
+    classifier.reset()
+    assert _feed(classifier, t, zeros, zeros, zeros, np.full_like(t, 2.0) * (t > 1)) \
+        .arrest_phase == 'G2'
+
+
+def test_levels_already_above_threshold_count_from_the_start():
+    classifier = FateClassifier(oscillator(), **THRESHOLDS)
+    t = np.linspace(0, 60, 121)
+    zeros, high = np.zeros_like(t), np.full_like(t, 5.0)
+    record = _feed(classifier, t, zeros, zeros, high, high)
+    assert record.fate == 'apoptotic' and record.time == THRESHOLDS['p53_duration']
+    assert record.p53_time == 0 and record.cyce_time == 0
+    classifier.reset()
+    record = _feed(classifier, t, zeros, zeros, zeros, high)
+    assert record.fate == 'arrested' and record.arrest_phase == 'G2'
+
+
+def test_slopes_follow_the_schedule():
+    system = oscillator()
+    p = system.parameters
+    schedule = Schedule().set(5.0, 'a', 0.0)
+    classifier = FateClassifier(system, p, schedule, **THRESHOLDS)
+    y = system.initial_values()
+    classifier(0.0, y)
+    classifier(10.0, y)
+    expected = classifier._matrix.dot(system.rhs(y, system.parameter_vector({'a': 0.0})))
+    assert np.allclose(classifier._last[2], expected)
+
+
+def test_unknown_threshold_is_rejected():
+    with pytest.raises(TypeError):
+        FateClassifier(oscillator(), mpf=1.0)
+    assert set(THRESHOLDS) == set(DEFAULT_THRESHOLDS)
+
+
+@pytest.mark.parametrize('level, fate', [(0.0, 'divided'), (0.5, 'apoptotic')])
+def test_classify_stops_early(level, fate):
+    system = oscillator()
+    record, stats = classify(system, TSPAN, system.parameter_vector({'DDS_0': level}),
+                             thresholds=THRESHOLDS)
+    assert record.fate == fate
+    assert stats['terminated'] and record.t_final < 30
+
+
+def test_classify_fates_is_independent_of_processes():
+    system = oscillator()
+    p = system.parameter_matrix([{'DDS_0': d} for d in (0.0, 0.1, 0.5, 2.0)])
+    serial = classify_fates(system, TSPAN, p, processes=1, thresholds=THRESHOLDS)
+    parallel = classify_fates(system, TSPAN, p, processes=2, thresholds=THRESHOLDS)
+    assert serial == parallel
+    stats = {}
+    for _ in imap_fates(system, TSPAN, [p[:2], p[2:]], processes=2, thresholds=THRESHOLDS,
+                        stats=stats):
+        pass
+    expected = {}
+    for q in p:
+        add_stats(expected, classify(system, TSPAN, q, thresholds=THRESHOLDS)[1])
+    assert stats == expected
+    table = fate_table(serial)
+    assert len(table) == 4 and table.fate[0] == b'divided'
+
+
+def test_interpolant_finds_excursions_between_output_times():
+    # Values and slopes of g(t) = t * (1 - t): zero at both ends, peak 1/4
+    segment = _Segment(0.0, 0.0, 1.0, 1.0, 0.0, -1.0)
+    (up, rising), (down, falling) = segment.crossings(0.2)
+    assert rising and not falling
+    assert up == pytest.approx(0.5 - np.sqrt(0.05)) and down == pytest.approx(0.5 + np.sqrt(0.05))
+    assert segment.peaks(0.0) == [pytest.approx(0.5)]
+    assert _Segment(0.0, 0.0, None, 1.0, 0.0, None).crossings(0.2) == []
+
+
+def test_classify_refines_events_on_a_coarse_grid():
+    system = oscillator()
+    options = dict(thresholds=THRESHOLDS, rtol=1e-10, atol=1e-12)
+    fine = classify(system, np.arange(0, 30.005, 0.01), **options)[0]
+    tspan = np.arange(0, 30.25, 0.5)
+    coarse = classify(system, tspan, **options)[0]
+    y = integrate(system, tspan, rtol=1e-10, atol=1e-12)[0]
+    linear = FateClassifier(system, **THRESHOLDS)
+    for t, row in zip(tspan, y):
+        if linear(t, row):
+            break
+    linear = linear.record()
+    assert coarse.fate == linear.fate == fine.fate == 'divided'
+    for name in ('mpf_time', 'apc_time'):
+        error = abs(getattr(coarse, name) - getattr(fine, name))
+        assert error < 1e-2
+        assert error * 5 < abs(getattr(linear, name) - getattr(fine, name))
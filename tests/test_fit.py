@@ -0,0 +1,57 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from cell_cycle_fit import fit, integrate_sensitivities, observable_sensitivities
+from cell_cycle_integrate import integrate
+
+from .systems import birth_death, oscillator
+
+TSPAN = np.linspace(0, 10, 41)
+
+
+def test_sensitivities_of_birth_death_are_exact():
+    system = birth_death()
+    k, g = system.parameters
+    y, S = integrate_sensitivities(system, TSPAN, wrt=['k', 'g'], rtol=1e-10, atol=1e-12)
+    decay = np.exp(-g * TSPAN)
+    assert np.allclose(y[:, 0], k / g * (1 - decay), atol=1e-7)
+    assert np.allclose(S[:, 0, 0], (1 - decay) / g, atol=1e-7)
+    assert np.allclose(S[:, 0, 1], -k / g ** 2 * (1 - decay) + k / g * TSPAN * decay, atol=1e-7)
+
+
+def test_sensitivities_match_finite_differences():
+    system = oscillator()
+    wrt = ['b', 'X_0']
+    _, S = integrate_sensitivities(system, TSPAN, wrt=wrt, rtol=1e-10, atol=1e-12)
+    G = observable_sensitivities(system, S, ['OBS_MPF', 'OBS_APC_Ccdc20'])
+    rows = [system.observable_index(name) for name in ['OBS_MPF', 'OBS_APC_Ccdc20']]
+    h = 1e-6
+
+    def observed(q):
+        y, _ = integrate(system, TSPAN, q, method='lsoda', rtol=1e-11, atol=1e-13)
+        return system.observables(y)[:, rows]
+
+    for c, name in enumerate(wrt):
+        value = system.parameters[system.parameter_index(name)]
+        difference = observed(system.parameter_vector({name: value + h})) - \
+            observed(system.parameter_vector({name: value - h}))
+        assert np.allclose(G[:, :, c], difference / (2 * h), rtol=1e-4, atol=1e-5)
+
+
+def test_fit_recovers_parameters():
+    system = oscillator()
+    true = system.parameter_vector({'a': 1.2, 'b': 2.5})
+    y, _ = integrate(system, TSPAN, true, method='lsoda', rtol=1e-10, atol=1e-12)
+    obs = system.observables(y)
+    data = dict((name, obs[:, system.observable_index(name)])
+                for name in ('OBS_MPF', 'OBS_APC_Ccdc20'))
+    data['OBS_MPF'][::5] = np.nan  # missing points are skipped
+    result = fit(system, TSPAN, data, ['a', 'b'], bounds={'b': (1.0, 5.0)}, rtol=1e-9,
+                 atol=1e-11)
+    assert result.success
+    assert result.parameters['a'] == pytest.approx(1.2, rel=1e-4)
+    assert result.parameters['b'] == pytest.approx(2.5, rel=1e-4)
+    assert result.p[system.parameter_index('b')] == result.parameters['b']
+    assert result.n_integrations < 50
@@ -0,0 +1,89 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+from cell_cycle_inputs import Schedule, damage_pulses, damage_schedule
+from cell_cycle_integrate import integrate
+
+from .systems import make_system, oscillator
+
+
+def _reference(system, tspan, p, y0=None):
+    y0 = system.initial_values(p) if y0 is None else y0
+    sol = solve_ivp(lambda t, y: system.rhs(y, p), (tspan[0], tspan[-1]), y0, method='Radau',
+                    t_eval=tspan, jac=lambda t, y: system.jacobian_matrix(y, p).toarray(),
+                    rtol=1e-10, atol=1e-12)
+    return sol.y.T
+
+
+def damage_signal():
+    """The two damage signal species, initialized by DDS_0 and decaying at
+    rates kd and 2 kd, and a species X made at rate k"""
+    return make_system(['Signal()', 'SignalDamp()', 'X'],
+                       [('DDS_0', 0.0), ('kd', 0.5), ('k', 0.0)],
+                       [('kd*__s0', ['Signal()'], []), ('2*kd*__s1', ['SignalDamp()'], []),
+                        ('k', [], ['X'])],
+                       initial=[('Signal()', 'DDS_0'), ('SignalDamp()', 'DDS_0')])
+
+
+def test_schedule_equals_restarted_runs():
+    system = oscillator()
+    tspan = np.linspace(0, 20, 41)
+    schedule = Schedule().add(10.0, 'Sig', 2.0).set(10.0, 'kp', 3.0)
+    y, stats = integrate(system, tspan, schedule=schedule, method='lsoda', rtol=1e-9,
+                         atol=1e-11)
+    assert stats['breakpoints'] == 1
+    first = _reference(system, tspan[:21], system.parameters)
+    y_break = first[-1].copy()
+    y_break[system.species_names.index('Sig')] += 2.0
+    second = _reference(system, tspan[20:], system.parameter_vector({'kp': 3.0}), y_break)
+    assert np.allclose(y[:20], first[:20], rtol=1e-5, atol=1e-7)
+    assert np.allclose(y[20:], second, rtol=1e-5, atol=1e-7)
+
+
+def test_damage_schedule_resets_the_signal():
+    system = damage_signal()
+    tspan = np.linspace(0, 20, 41)
+    schedule = damage_schedule([(5.0, 1.0), (10.0, 0.0)])
+    y, stats = integrate(system, tspan, schedule=schedule, method='lsoda', rtol=1e-10,
+                         atol=1e-12)
+    assert stats['breakpoints'] == 2
+    on = (tspan >= 5) & (tspan < 10)
+    assert np.allclose(y[on, 0], np.exp(-0.5 * (tspan[on] - 5)), atol=1e-7)
+    assert np.allclose(y[on, 1], np.exp(-1.0 * (tspan[on] - 5)), atol=1e-7)
+    assert (y[tspan < 5, :2] == 0).all() and (y[tspan >= 10, :2] == 0).all()
+    bound = schedule.bind(system)
+    assert bound.parameters_at(7.0, system.parameters)[0] == 1.0
+    assert bound.parameters_at(12.0, system.parameters)[0] == 0.0
+
+
+def test_damage_pulses_add_up():
+    system = damage_signal()
+    tspan = np.linspace(0, 10, 21)
+    y, _ = integrate(system, tspan, schedule=damage_pulses([2.0, 4.0], 0.5), method='lsoda',
+                     rtol=1e-10, atol=1e-12)
+    expected = 0.5 * (np.exp(-0.5 * (tspan - 2)) * (tspan >= 2) +
+                      np.exp(-0.5 * (tspan - 4)) * (tspan >= 4))
+    assert np.allclose(y[:, 0], expected, atol=1e-7)
+
+
+def test_function_inputs_vary_continuously():
+    system = damage_signal()
+    tspan = np.linspace(0, 4, 9)
+    y, stats = integrate(system, tspan, schedule=Schedule().function('k', lambda t: t),
+                         method='lsoda', rtol=1e-10, atol=1e-12)
+    assert stats['breakpoints'] == 0
+    assert np.allclose(y[:, 2], tspan ** 2 / 2, atol=1e-7)
+    forced = Schedule().function('X', np.sin)
+    y, _ = integrate(system, tspan, schedule=forced, method='lsoda')
+    assert np.allclose(y[:, 2], np.sin(tspan))
+
+
+def test_unknown_or_invalid_inputs_are_rejected():
+    system = damage_signal()
+    with pytest.raises(ValueError):
+        Schedule().set(1.0, 'nothing', 1.0).bind(system)
+    with pytest.raises(ValueError):
+        Schedule().add(1.0, 'kd', 1.0).bind(system)
@@ -0,0 +1,65 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+from scipy.integrate import solve_ivp
+
+from cell_cycle_integrate import METHODS, integrate, observable_array
+
+from .systems import oscillator, robertson
+
+
+def _reference(system, tspan, p, y0=None):
+    y0 = system.initial_values(p) if y0 is None else y0
+    sol = solve_ivp(lambda t, y: system.rhs(y, p), (tspan[0], tspan[-1]), y0, method='Radau',
+                    t_eval=tspan, jac=lambda t, y: system.jacobian_matrix(y, p).toarray(),
+                    rtol=1e-10, atol=1e-12)
+    return sol.y.T
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_methods_match_reference(method):
+    system = oscillator()
+    tspan = np.linspace(0, 15, 31)
+    p = system.parameter_vector({'DDS_0': 0.3})
+    # ROS2 is second order; tight tolerances would cost many thousand steps
+    rtol, error = (1e-5, 2e-3) if method == 'rosenbrock' else (1e-8, 1e-3)
+    y, stats = integrate(system, tspan, p, method=method, rtol=rtol, atol=1e-2 * rtol)
+    assert np.abs(y - _reference(system, tspan, p)).max() < error
+    assert stats['steps'] > 0 and stats['nfev'] > 0
+    assert not stats['terminated']
+
+
+def test_rosenbrock_counts_work():
+    system = oscillator()
+    y, stats = integrate(system, np.linspace(0, 5, 6), method='rosenbrock', rtol=1e-4)
+    assert stats['methods']['rosenbrock']['nlu'] >= stats['steps'] + (stats['rejected'] or 0)
+
+
+def test_auto_switches_to_rosenbrock_on_stiff_problem():
+    system = robertson()
+    tspan = np.concatenate([[0.0], np.logspace(-5, 4, 40)])
+    y, stats = integrate(system, tspan, method='auto', rtol=1e-6, atol=1e-10)
+    assert stats['switches'] >= 1
+    assert 'rosenbrock' in stats['methods']
+    # mass is conserved and the solution matches the reference
+    assert np.allclose(y.sum(axis=1), 1.0, atol=1e-6)
+    assert np.allclose(y, _reference(system, tspan, system.parameters), rtol=1e-3, atol=1e-7)
+
+
+def test_callback_stops_integration():
+    system = oscillator()
+    tspan = np.linspace(0, 30, 301)
+    x = system.species_names.index('X')
+    y, stats = integrate(system, tspan, callback=lambda t, y: y[x] > 2.0)
+    assert stats['terminated']
+    assert len(y) < len(tspan) and y[-1, x] > 2.0 and (y[:-1, x] <= 2.0).all()
+    assert stats['t_final'] == tspan[len(y) - 1]
+
+
+def test_observable_array_fields():
+    system = oscillator()
+    y, _ = integrate(system, np.linspace(0, 5, 6))
+    obs = observable_array(system, y)
+    assert obs.shape == (6,)
+    assert np.allclose(obs.OBS_AB, y[:, 4] + y[:, 5])
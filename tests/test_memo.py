@@ -0,0 +1,72 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+import cell_cycle_memo
+from cell_cycle_memo import ResultCache, memo_integrate, network_id, result_key
+
+from .systems import oscillator
+
+TSPAN = np.linspace(0, 10, 41)
+
+
+def test_key_uses_plain_option_values():
+    key = result_key('net', [1.0], None, TSPAN, {'rtol': 1e-6, 'method': 'lsoda'})
+    assert key == result_key('net', [1.0], None, TSPAN,
+                             {'method': 'lsoda', 'rtol': np.float64(1e-6), 'profiler': object()})
+    assert key != result_key('net', [1.0], None, TSPAN, {'rtol': 1e-7, 'method': 'lsoda'})
+    with pytest.raises(TypeError):
+        result_key('net', [1.0], None, TSPAN, {'callback': lambda t, y: False})
+
+
+def test_memo_integrate_hits_and_bypasses(tmpdir):
+    system = oscillator()
+    cache = ResultCache(str(tmpdir))
+    y, stats = memo_integrate(system, TSPAN, cache=cache, rtol=1e-8)
+    again, hit = memo_integrate(system, TSPAN, cache=cache, rtol=1e-8)
+    assert stats is not None and hit is None and np.array_equal(y, again)
+    assert memo_integrate(system, TSPAN, cache=cache, callback=lambda t, y: False)[1] is not None
+
+
+def test_network_id_is_computed_once_per_system(monkeypatch):
+    calls = []
+    source_key = cell_cycle_memo.source_key
+    monkeypatch.setattr(cell_cycle_memo, 'source_key',
+                        lambda system: calls.append(system) or source_key(system))
+    system = oscillator()
+    cache = ResultCache(False)
+    memo_integrate(system, TSPAN, cache=cache)
+    memo_integrate(system, TSPAN, cache=cache)
+    assert len(calls) == 1
+    assert network_id(system) == source_key(oscillator())
+
+
+def test_memory_tier_is_bounded_by_bytes():
+    cache = ResultCache(False, memory_bytes=3 * 8000 + 500)
+    for k in range(5):
+        cache.put('k%d' % k, 'net', [float(k)], [0.0], y=np.zeros(1000))
+    assert cache.get('k0') is None and cache.get('k1') is None
+    assert cache.get('k4') is not None
+    assert cache._memory_used <= cache.memory_bytes
+
+
+def test_disk_tier_is_pruned_every_n_puts_or_when_full(tmpdir, monkeypatch):
+    calls = []
+    prune = cell_cycle_memo.prune_cache
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return prune(*args, **kwargs)
+
+    monkeypatch.setattr(cell_cycle_memo, 'prune_cache', counting)
+    cache = ResultCache(str(tmpdir), max_bytes=10 ** 9, prune_every=4)
+    for k in range(9):
+        cache.put('k%d' % k, 'net', [float(k)], [0.0], y=np.zeros(100))
+    assert len(calls) == 3  # the first put, then every fourth
+
+    small = ResultCache(str(tmpdir.mkdir('small')), max_bytes=4000, prune_every=100)
+    for k in range(6):
+        small.put('k%d' % k, 'net', [float(k)], [0.0], y=np.zeros(200))
+        assert small._disk_used <= 4000 + 2000
+    assert len(calls) > 4
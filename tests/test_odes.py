@@ -0,0 +1,93 @@
+from __future__ import division
+
+import pickle
+
+import numpy as np
+
+from cell_cycle_odes import integrate_ensemble
+from cell_cycle_integrate import integrate
+
+from .systems import oscillator
+
+
+def _state(system, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(0.1, 2.0, system.n_species), system.parameter_vector({'DDS_0': 0.7})
+
+
+def _finite_difference(f, x, h=1e-6):
+    f0 = f(x)
+    J = np.empty((len(f0), len(x)))
+    for k in range(len(x)):
+        dx = np.zeros(len(x))
+        dx[k] = h * max(1.0, abs(x[k]))
+        J[:, k] = (f(x + dx) - f(x - dx)) / (2 * dx[k])
+    return J
+
+
+def test_jacobian_matches_finite_differences():
+    system = oscillator()
+    y, p = _state(system)
+    expected = _finite_difference(lambda z: system.rhs(z, p), y)
+    assert np.allclose(system.jacobian_matrix(y, p).toarray(), expected, rtol=1e-6, atol=1e-8)
+
+
+def test_sparsity_pattern_covers_every_nonzero():
+    system = oscillator()
+    y, p = _state(system)
+    dense = _finite_difference(lambda z: system.rhs(z, p), y)
+    pattern = np.zeros_like(dense, dtype=bool)
+    pattern[system.jac_rows, system.jac_cols] = True
+    assert not (np.abs(dense[~pattern]) > 1e-8).any()
+
+
+def test_parameter_jacobian_matches_finite_differences():
+    system = oscillator()
+    y, p = _state(system)
+    expected = _finite_difference(lambda q: system.rhs(y, q), p)
+    assert np.allclose(system.parameter_jacobian(y, p), expected, rtol=1e-5, atol=1e-7)
+
+
+def test_batched_calls_match_single_states():
+    system = oscillator()
+    rng = np.random.RandomState(1)
+    Y = rng.uniform(0.1, 2.0, (5, system.n_species))
+    P = system.parameter_matrix([{'DDS_0': d} for d in np.linspace(0, 2, 5)])
+    rhs = system.rhs(Y, P)
+    jac = system.jacobian(Y, P)
+    assert rhs.shape == (5, system.n_species)
+    assert jac.shape == (5, system.jac_nnz)
+    for i in range(5):
+        assert np.allclose(rhs[i], system.rhs(Y[i], P[i]))
+        assert np.allclose(jac[i], system.jacobian(Y[i], P[i]))
+    # one state broadcast against several parameter vectors
+    assert np.allclose(system.rhs(Y[0], P)[3], system.rhs(Y[0], P[3]))
+
+
+def test_initial_values_and_observables():
+    system = oscillator()
+    p = system.parameter_vector({'DDS_0': 0.3, 'A_0': 2.0})
+    y0 = system.initial_values(p)
+    assert y0[system.species_names.index('Sig')] == 0.3
+    assert y0[system.species_names.index('A')] == 2.0
+    assert system.observables(y0)[system.observable_index('OBS_AB')] == 2.0
+
+
+def test_pickle_round_trip():
+    system = oscillator()
+    y, p = _state(system)
+    system.parameter_jacobian(y, p)
+    copy = pickle.loads(pickle.dumps(system))
+    assert np.allclose(copy.rhs(y, p), system.rhs(y, p))
+    assert np.allclose(copy.parameter_jacobian(y, p), system.parameter_jacobian(y, p))
+
+
+def test_ensemble_matches_single_runs():
+    system = oscillator()
+    tspan = np.linspace(0, 20, 41)
+    P = system.parameter_matrix([{'DDS_0': d} for d in (0.0, 0.5, 2.0)])
+    ys = integrate_ensemble(system, tspan, P, rtol=1e-8, atol=1e-10)
+    assert ys.shape == (3, len(tspan), system.n_species)
+    for i in range(3):
+        y, _ = integrate(system, tspan, P[i], method='lsoda', rtol=1e-8, atol=1e-10)
+        assert np.allclose(ys[i], y, rtol=1e-4, atol=1e-6)
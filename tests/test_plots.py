@@ -0,0 +1,60 @@
+from __future__ import division
+
+import os
+
+import numpy as np
+
+from cell_cycle_plots import (APC_OBSERVABLES, PROTEIN_OBSERVABLES, STYLE, damage_figures,
+                              render_figures)
+from cell_cycle_store import TrajectoryWriter
+
+LEVELS = [(0.0, "No", 0), (0.016, "Extreme", 'upper left')]
+
+
+def _store(path, scale=1.0):
+    tspan = np.linspace(0, 100, 51)
+    names = PROTEIN_OBSERVABLES + APC_OBSERVABLES
+    with TrajectoryWriter(path, tspan, names, metadata={'damage_levels': LEVELS}) as writer:
+        for run in range(len(LEVELS)):
+            writer.append(dict((name, scale * np.sin(tspan / (10.0 + i + run)))
+                               for i, name in enumerate(names)))
+    return path
+
+
+def test_damage_figures_follow_the_levels():
+    specs = damage_figures(LEVELS)
+    assert [spec.filename for spec in specs] == [
+        "Whole Cell Cycle No DNA Damage1.png", "Whole Cell Cycle No DNA Damage2.png",
+        "Whole Cell Cycle Extreme DNA Damage1.png", "Whole Cell Cycle Extreme DNA Damage2.png"]
+    assert [spec.run for spec in specs] == [0, 0, 1, 1]
+    assert specs[0].labels == ['p27', 'CycE', 'CycA', 'CycB', 'aCycE_CDK2']
+    assert specs[3].legend_loc == 'upper left'
+
+
+def test_only_changed_figures_are_redrawn(tmpdir):
+    outdir = str(tmpdir.join('figures'))
+    store = _store(str(tmpdir.join('store')))
+    specs = damage_figures(LEVELS)
+    names = [spec.filename for spec in specs]
+    assert render_figures(store, specs, outdir, processes=1) == names
+    for name in names:
+        assert os.path.getsize(os.path.join(outdir, name)) > 0
+        assert os.path.exists(os.path.join(outdir, name + '.sha1'))
+    assert render_figures(store, specs, outdir, processes=2) == []
+
+    # a new style redraws every figure, a new title only its own
+    assert render_figures(store, specs, outdir, processes=1,
+                          style=dict(STYLE, linewidth=1)) == names
+    retitled = [specs[0]._replace(title="Retitled")] + specs[1:]
+    assert render_figures(store, retitled, outdir, processes=1,
+                          style=dict(STYLE, linewidth=1)) == names[:1]
+    assert render_figures(store, specs, outdir, processes=1, style=dict(STYLE, linewidth=1),
+                          force=True) == names
+
+
+def test_new_data_redraws(tmpdir):
+    outdir = str(tmpdir.join('figures'))
+    specs = damage_figures(LEVELS)
+    render_figures(_store(str(tmpdir.join('a'))), specs, outdir, processes=1)
+    assert len(render_figures(_store(str(tmpdir.join('b')), 2.0), specs, outdir,
+                              processes=1)) == len(specs)
@@ -0,0 +1,43 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from cell_cycle_population import simulate_population
+
+from .systems import THRESHOLDS, oscillator
+
+# oscillator() has no OBS_Int; the population criteria without it
+POPULATION_THRESHOLDS = dict((key, THRESHOLDS[key]) for key in
+                             ('mpf_threshold', 'apc_threshold', 'p53_threshold',
+                              'p53_duration'))
+
+
+def test_cells_divide_and_the_lineage_is_recorded():
+    result = simulate_population(oscillator(), 16.0, n_cells=2, dt=0.2, max_cells=3,
+                                 partition_noise=0.05, thresholds=POPULATION_THRESHOLDS,
+                                 seed=0, rtol=1e-4)
+    assert result.divisions[-1] == 2 and result.deaths[-1] == 0
+    assert result.alive[0] == 2 and result.alive[-1] == 3
+    lineage = result.lineage
+    assert list(lineage.fate[:2]) == [b'divided', b'divided']
+    assert (lineage.parent[2:] >= 0).all() and (lineage.generation[2:] == 1).all()
+    assert list(lineage.fate).count(b'removed') == 1
+    assert sorted(result.ids) == sorted(lineage.id[lineage.fate == b'alive'])
+    assert result.states.shape == (3, oscillator().n_species)
+
+
+def test_sustained_p53_kills_every_cell():
+    system = oscillator()
+    result = simulate_population(system, 25.0, system.parameter_vector({'DDS_0': 2.0}),
+                                 n_cells=2, dt=0.2, thresholds=POPULATION_THRESHOLDS, rtol=1e-4)
+    assert result.deaths[-1] == 2 and result.alive[-1] == 0 and result.divisions[-1] == 0
+    assert len(result.ids) == 0
+
+
+def test_integrator_criterion_needs_its_observable():
+    with pytest.raises(KeyError):
+        simulate_population(oscillator(), 1.0,
+                            thresholds=dict(POPULATION_THRESHOLDS, int_threshold=1.0))
+    with pytest.raises(TypeError):
+        simulate_population(oscillator(), 1.0, thresholds={'arrest_time': 1.0})
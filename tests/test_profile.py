@@ -0,0 +1,63 @@
+from __future__ import division
+
+import json
+import pickle
+
+import numpy as np
+
+from cell_cycle_integrate import integrate
+from cell_cycle_profile import Profiler, profile_rates
+
+from .systems import oscillator
+
+TSPAN = np.linspace(0, 50, 51)
+SHORT = np.linspace(0, 5, 6)
+
+
+def test_profiler_counts_match_the_run():
+    system = oscillator()
+    profiler = Profiler(time_bin=1.0)
+    y, stats = integrate(system, SHORT, method='rosenbrock', rtol=1e-4, profiler=profiler)
+    plain, _ = integrate(system, SHORT, method='rosenbrock', rtol=1e-4)
+    assert np.array_equal(y, plain)
+    assert profiler.runs == 1
+    assert profiler.calls['rhs'] == stats['nfev']
+    assert profiler.calls['jacobian'] == stats['njev']
+    assert profiler.calls['lu'] == stats['nlu']
+    assert sum(profiler.step_sizes['rosenbrock']) == stats['steps']
+    assert sum(profiler.steps.values()) == stats['steps']
+    assert all(key % 1.0 == 0 and 0 <= key <= 5 for key in profiler.steps)
+
+
+def test_odepack_intervals_and_callback():
+    events = []
+    profiler = Profiler(callback=lambda event, t, value: events.append(event))
+    _, stats = integrate(oscillator(), TSPAN, method='lsoda', profiler=profiler)
+    assert sum(profiler.step_sizes['lsoda']) == stats['steps']
+    assert events and set(events) <= {'step', 'reject'}
+
+
+def test_merge_and_summary(tmpdir):
+    system = oscillator()
+    first, second = Profiler(), Profiler()
+    integrate(system, SHORT, method='rosenbrock', rtol=1e-4, profiler=first)
+    integrate(system, TSPAN, method='auto', profiler=second)
+    second = pickle.loads(pickle.dumps(second))
+    calls = first.calls['rhs'] + second.calls['rhs']
+    merged = Profiler().merge(first).merge(second)
+    assert merged.runs == 2 and merged.calls['rhs'] == calls
+    path = str(tmpdir.join('profile.json'))
+    merged.save(path)
+    with open(path) as f:
+        summary = json.load(f)
+    assert summary == json.loads(json.dumps(merged.summary()))
+    assert summary['timers']['rhs']['calls'] == calls
+    assert len(summary['step_sizes']['rosenbrock']) == len(summary['step_bins']) + 1
+    assert [t for t, _ in summary['steps']] == sorted(t for t, _ in summary['steps'])
+
+
+def test_profile_rates_covers_every_reaction():
+    system = oscillator()
+    timings = profile_rates(system, system.initial_values(), repeat=5)
+    assert sorted(j for _, j, _ in timings) == list(range(len(system.rate_exprs)))
+    assert [s for s, _, _ in timings] == sorted((s for s, _, _ in timings), reverse=True)
@@ -0,0 +1,74 @@
+from __future__ import division
+
+import errno
+import os
+
+import numpy as np
+import pytest
+
+import cell_cycle_queue
+from cell_cycle_integrate import integrate
+from cell_cycle_queue import run_worker, submit
+from cell_cycle_store import TrajectoryReader
+
+from .systems import oscillator
+
+OBSERVABLES = ('OBS_MPF', 'OBS_p53')
+OVERRIDES = [{'DDS_0': level} for level in (0.0, 0.5, 1.0, 1.5, 2.0)]
+
+
+@pytest.fixture
+def queue(tmpdir, monkeypatch):
+    monkeypatch.setattr(cell_cycle_queue, 'get_system', lambda spec: oscillator())
+    return submit(os.path.join(str(tmpdir), 'queue'), OVERRIDES, tspan=(0.0, 20.0, 41),
+                  observables=OBSERVABLES, batch_size=2, rtol=1e-8)
+
+
+def test_claims_are_exclusive(queue):
+    first, second = queue.claim('w1'), queue.claim('w2')
+    assert (first.index, second.index) == (0, 1)
+    assert first.runs == OVERRIDES[:2]
+    assert queue.status()['running'] == 2 and queue.status()['pending'] == 1
+    assert queue.claim('w3').index == 2
+    assert queue.claim('w4') is None
+
+
+def test_claim_survives_a_retransmitted_rename(queue, monkeypatch):
+    rename = os.rename
+
+    def retransmitted(src, dst):
+        rename(src, dst)
+        raise OSError(errno.ENOENT, 'No such file or directory', src)
+
+    monkeypatch.setattr(os, 'rename', retransmitted)
+    task = queue.claim('w1')
+    assert task.index == 0 and os.path.exists(task.path)
+
+
+def test_recover_puts_stale_claims_back(queue):
+    task = queue.claim('w1')
+    assert queue.recover(timeout=3600.0) == []
+    assert queue.recover(timeout=0.0) == [task.name]
+    assert queue.status()['running'] == 0
+    assert queue.errors()[task.name] == ['claim by w1 timed out']
+    again = queue.claim('w2')
+    assert again.index == task.index and again.attempts == 1
+
+
+def test_workers_finish_and_merge_in_run_order(queue, tmpdir):
+    assert run_worker(queue.path, 'w1', max_tasks=1) == 1
+    with pytest.raises(RuntimeError):
+        queue.merge(os.path.join(str(tmpdir), 'partial'))
+    assert run_worker(queue.path, 'w2') == 2
+    assert queue.status()['runs_done'] == len(OVERRIDES)
+
+    queue.merge(os.path.join(str(tmpdir), 'merged'))
+    merged = TrajectoryReader(os.path.join(str(tmpdir), 'merged'))
+    assert len(merged) == len(OVERRIDES)
+    system = oscillator()
+    for i, overrides in enumerate(OVERRIDES):
+        p = system.parameter_vector(overrides)
+        y, _ = integrate(system, queue.tspan, p, rtol=1e-8)
+        assert np.array_equal(merged.params[i], p)
+        assert np.allclose(merged['OBS_p53'][i],
+                           system.observables(y)[:, system.observable_index('OBS_p53')])
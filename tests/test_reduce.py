@@ -0,0 +1,100 @@
+from __future__ import division
+
+import pickle
+
+import numpy as np
+
+from cell_cycle_integrate import integrate
+from cell_cycle_reduce import ReducedSystem, error_report, nonlinear_species, reduce_system
+from cell_cycle_sweep import sweep_parameters
+
+from .systems import THRESHOLDS, make_system
+
+TSPAN = np.linspace(0, 60, 241)
+
+
+def fast_binding():
+    """The Brusselator cycle with X made from the middle form B of a chain
+    A <-> B <-> C that equilibrates a thousand times faster; the A -> B step
+    is driven by Y"""
+    species = ['X', 'Y', 'A', 'B', 'C']
+    parameters = [('a', 1.0), ('b', 3.0), ('DDS_0', 0.0), ('k1', 1e3), ('k2', 2e3),
+                  ('k3', 1e3), ('k4', 1e3), ('A_0', 1.0), ('X_0', 1.0), ('Y_0', 1.0)]
+    reactions = [
+        ('3*a*B/(1 + DDS_0)', [], ['X']),
+        ('b*X', ['X'], ['Y']),
+        ('X**2*Y', ['X', 'X', 'Y'], ['X', 'X', 'X']),
+        ('X', ['X'], []),
+        ('k1*Y*A', ['A'], ['B']),
+        ('k2*B', ['B'], ['A']),
+        ('k3*B', ['B'], ['C']),
+        ('k4*C', ['C'], ['B']),
+    ]
+    observables = [('OBS_MPF', ['X']), ('OBS_APC_Ccdc20', ['Y']), ('OBS_p53', []),
+                   ('OBS_CycE', ['X']), ('OBS_B', ['B'])]
+    initial = [('X', 'X_0'), ('Y', 'Y_0'), ('A', 'A_0')]
+    return make_system(species, parameters, reactions, observables, initial)
+
+
+def _reduced():
+    return reduce_system(fast_binding(), tspan=TSPAN, levels=(0.0, 1.0), fast_time=0.05,
+                         candidates=None, n_samples=20, method='lsoda')
+
+
+def test_fast_chain_is_lumped():
+    reduced = _reduced()
+    assert sorted(reduced.fast) == [2, 3, 4]
+    assert reduced.system.n_species == 3
+    lump = reduced.lumps[0]
+    assert np.allclose(lump / lump[0], 1.0)
+    # Only the conversions that change the total are left: none of A <-> B <-> C
+    assert reduced.system.n_reactions == 4
+
+
+def test_quasi_steady_state_matches_full_model():
+    reduced = _reduced()
+    for level, max_error, fate_full, fate_reduced, _, _, _ in error_report(
+            reduced, tspan=TSPAN, levels=(0.0, 1.0), thresholds=THRESHOLDS, settle=1.0,
+            observables=['OBS_MPF', 'OBS_APC_Ccdc20', 'OBS_B'], method='lsoda', rtol=1e-8,
+            atol=1e-10):
+        assert max(max_error.values()) < 0.02
+        assert fate_full == fate_reduced
+
+
+def test_reduced_system_takes_fewer_steps():
+    reduced = _reduced()
+    full = reduced.full
+    _, full_stats = integrate(full, TSPAN, method='lsoda')
+    y, stats = reduced.integrate(TSPAN, method='lsoda')
+    assert stats['steps'] < full_stats['steps']
+    x = reduced.restrict(y)
+    assert np.allclose(reduced.expand(x), y)
+
+
+def test_expand_is_stateless_and_pickles():
+    reduced = _reduced()
+    x = reduced.initial_values()
+    first = reduced.rhs(x, reduced.parameters)
+    reduced.integrate(TSPAN, method='lsoda')
+    assert np.array_equal(reduced.rhs(x, reduced.parameters), first)
+    clone = pickle.loads(pickle.dumps(reduced))
+    assert np.allclose(clone.expand(x), reduced.expand(x))
+
+
+def test_sweeps_run_the_reduced_system_with_their_parameters():
+    reduced = _reduced()
+    full = reduced.full
+    overrides = [{'k1': 1e2}, {'k1': 1e3, 'DDS_0': 1.0}]
+    y0 = full.initial_values() * 2.0
+    yobs = sweep_parameters(reduced, TSPAN, overrides, processes=1, y0=y0, method='lsoda')
+    for i, o in enumerate(overrides):
+        y, _ = reduced.integrate(TSPAN, full.parameter_vector(o), y0, method='lsoda')
+        expected = full.observables(y)[:, full.observable_index('OBS_B')]
+        assert np.allclose(yobs['OBS_B'][i], expected)
+
+
+def test_nonlinear_fast_species_are_kept():
+    system = make_system(['A', 'B'], [('k', 1.0)], [('k*A*B', ['A', 'B'], [])])
+    assert nonlinear_species(system, [0, 1]) == set([0, 1])
+    assert nonlinear_species(system, [0]) == set()
+    assert ReducedSystem(system, [], [(np.ones(2), system.parameters)]).system.n_species == 2
@@ -0,0 +1,67 @@
+from __future__ import division
+
+import numpy as np
+
+from cell_cycle_sensitivity import MorrisAnalysis, SobolAnalysis, run_sensitivity
+
+from .systems import THRESHOLDS, oscillator
+
+# Additive test function on the unit cube: the first-order Sobol index of
+# input i is a_i**2 / sum(a**2) and its Morris mu* is a_i
+A = np.array([4.0, 2.0, 0.0])
+
+
+def _evaluate(analysis):
+    for j in range(analysis.n):
+        analysis.update(analysis.row(j).dot(A)[:, None])
+    return analysis.indices()['f']
+
+
+def test_sobol_indices_of_additive_function():
+    indices = _evaluate(SobolAnalysis(['x', 'y', 'z'], [(1, 2)] * 3, 4000, 0, ['f']))
+    expected = A ** 2 / (A ** 2).sum()
+    assert np.allclose(indices['S1'], expected, atol=0.05)
+    assert np.allclose(indices['ST'], expected, atol=0.05)
+
+
+def test_morris_effects_of_additive_function():
+    indices = _evaluate(MorrisAnalysis(['x', 'y', 'z'], [(1, 2)] * 3, 20, 0, ['f']))
+    assert np.allclose(indices['mu'], A)
+    assert np.allclose(indices['mu_star'], A)
+    assert np.allclose(indices['sigma'], 0.0)
+
+
+def test_checkpoint_resumes_where_it_stopped(tmpdir):
+    system = oscillator()
+    tspan = np.linspace(0, 60, 121)
+    outputs = (('apoptotic', lambda r: float(r.fate == 'apoptotic')),
+               ('fate_time', lambda r: r.t_final if r.time is None else r.time))
+    names = ['kp', 'kdeg']
+
+    def analysis():
+        return MorrisAnalysis(names, [(0.5, 4.0), (0.2, 1.0)], 4, 1, [n for n, _ in outputs])
+
+    base = {'DDS_0': 0.3}
+    full = run_sensitivity(system, tspan, analysis(), outputs, base, processes=1,
+                           thresholds=THRESHOLDS)
+
+    path = str(tmpdir.join('morris.pkl'))
+
+    class Interrupt(Exception):
+        pass
+
+    def stop(a):
+        if a.rows_done == 2:
+            raise Interrupt()
+
+    try:
+        run_sensitivity(system, tspan, analysis(), outputs, base, checkpoint=path,
+                        checkpoint_every=1, processes=1, callback=stop, thresholds=THRESHOLDS)
+    except Interrupt:
+        pass
+    resumed = run_sensitivity(system, tspan, analysis(), outputs, base, checkpoint=path,
+                              processes=1, thresholds=THRESHOLDS)
+    assert resumed.rows_done == 4
+    for name in full.output_names:
+        for key, value in full.indices()[name].items():
+            assert np.allclose(resumed.indices()[name][key], value, equal_nan=True)
@@ -0,0 +1,94 @@
+from __future__ import division
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason="needs asyncio.run")
+
+import cell_cycle_server  # noqa: E402
+from cell_cycle_server import Client, serve  # noqa: E402
+
+from .systems import THRESHOLDS, oscillator  # noqa: E402
+
+
+@pytest.fixture
+def socket_dir():
+    # Unix socket paths are limited to about 100 characters
+    path = tempfile.mkdtemp(prefix='ccs')
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def server(socket_dir, monkeypatch):
+    monkeypatch.setattr(cell_cycle_server, 'get_system', lambda spec: oscillator())
+    path = os.path.join(socket_dir, 'sock')
+    state = {}
+
+    async def run():
+        state['loop'] = asyncio.get_running_loop()
+        state['task'] = asyncio.ensure_future(serve(path, processes=1))
+        try:
+            await state['task']
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),))
+    thread.start()
+    for _ in range(200):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    state['loop'].call_soon_threadsafe(state['task'].cancel)
+    thread.join(10)
+
+
+def test_simulate_and_classify_over_a_socket(server):
+    system = oscillator()
+    tspan = {'start': 0, 'stop': 20, 'n': 81}
+    with Client(server) as client:
+        assert client.info()['observables'] == system.observable_names
+        results = dict((i, obs) for i, obs, _ in
+                       client.simulate([{'DDS_0': 0.0}, {'DDS_0': 0.6}], tspan, ['OBS_p53']))
+        assert sorted(results) == [0, 1]
+        assert results[0]['OBS_p53'].max() == 0.0 and results[1]['OBS_p53'].max() > 0.0
+        fates = dict(client.classify([{'DDS_0': 0.0}], {'start': 0, 'stop': 60, 'n': 241},
+                                     THRESHOLDS))
+        assert fates[0]['fate'] == 'divided'
+        with pytest.raises(RuntimeError):
+            list(client.simulate([{'no_such_parameter': 1.0}], tspan))
+        assert np.isfinite(list(client.simulate([{}], tspan))[0][1]['OBS_MPF']).all()
+
+
+def test_socket_is_removed_after_shutdown(socket_dir, monkeypatch):
+    monkeypatch.setattr(cell_cycle_server, 'get_system', lambda spec: oscillator())
+    path = os.path.join(socket_dir, 'sock')
+
+    async def run():
+        task = asyncio.ensure_future(serve(path, processes=1))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert not os.path.exists(path)
+
+
+def test_refuses_to_replace_a_regular_file(socket_dir):
+    path = os.path.join(socket_dir, 'not-a-socket')
+    with open(path, 'w') as f:
+        f.write('data')
+    with pytest.raises(IOError):
+        asyncio.run(serve(path, processes=1))
+    assert os.path.exists(path)
@@ -0,0 +1,51 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from cell_cycle_stochastic import StochasticSimulator, fate_fractions, run_ensemble
+
+from .systems import THRESHOLDS, birth_death, oscillator
+
+
+@pytest.mark.parametrize('method', ['ssa', 'tau'])
+def test_birth_death_stationary_distribution(method):
+    system = birth_death()
+    simulator = StochasticSimulator(system, omega=20.0, method=method)
+    tspan = np.linspace(0, 1000, 2001)
+    counts, _ = simulator.run(tspan, rng=np.random.RandomState(1))
+    x = counts[100:, 0]  # after a burn-in of several decay times
+    mean = 20.0 * 2.0 / 0.5
+    # Poisson: variance equals the mean
+    assert x.mean() == pytest.approx(mean, rel=0.05)
+    assert x.var() == pytest.approx(mean, rel=0.2)
+
+
+def test_propensities_scale_with_system_size():
+    system = oscillator()
+    simulator = StochasticSimulator(system, omega=100.0)
+    X = np.round(100.0 * system.initial_values(system.parameter_vector({'DDS_0': 0.5})))
+    assert np.allclose(simulator.propensities(X, system.parameters),
+                       100.0 * system.rates(X / 100.0, system.parameters))
+
+
+def test_ensemble_is_reproducible_across_processes():
+    system = oscillator()
+    tspan = np.linspace(0, 60, 121)
+    p = system.parameter_vector({'DDS_0': 0.1})
+    kwargs = dict(seed=3, observables=(), thresholds=THRESHOLDS, omega=200.0, block_size=3)
+    serial = run_ensemble(system, tspan, 8, p, processes=1, **kwargs)
+    parallel = run_ensemble(system, tspan, 8, p, processes=2, **kwargs)
+    assert serial.records == parallel.records
+    assert sum(serial.fractions.values()) == pytest.approx(1.0)
+    assert serial.fractions == fate_fractions(serial.records)
+
+
+def test_ensemble_bands_are_ordered():
+    system = oscillator()
+    tspan = np.linspace(0, 20, 41)
+    result = run_ensemble(system, tspan, 12, processes=1, observables=('OBS_MPF',),
+                          thresholds=THRESHOLDS, omega=200.0)
+    band = result.bands['OBS_MPF']
+    assert band.shape == (len(result.quantiles), len(tspan))
+    assert (np.diff(band, axis=0) >= 0).all()
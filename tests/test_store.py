@@ -0,0 +1,50 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from cell_cycle_store import TrajectoryReader, TrajectoryWriter, select_observables
+
+
+def _runs(n, times, names):
+    rng = np.random.RandomState(0)
+    return [dict((name, rng.rand(times)) for name in names) for _ in range(n)]
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_round_trip(tmpdir, compress):
+    names = ['OBS_p53', 'OBS_MPF']
+    tspan = np.linspace(0, 10, 21)
+    runs = _runs(7, len(tspan), names)
+    path = str(tmpdir.join('store'))
+    with TrajectoryWriter(path, tspan, names, decimation=2, chunk_size=3, compress=compress,
+                          n_params=2, metadata={'levels': [1, 2]}) as writer:
+        for i, run in enumerate(runs):
+            writer.append(run, [i, 2 * i])
+    reader = TrajectoryReader(path)
+    assert len(reader) == 7 and len(reader.chunks) == 3
+    assert np.array_equal(reader.tspan, tspan[::2])
+    assert reader.metadata == {'levels': [1, 2]}
+    assert np.array_equal(reader['OBS_MPF'], np.array([r['OBS_MPF'][::2] for r in runs]))
+    assert np.array_equal(reader.params[:, 1], 2 * np.arange(7))
+    assert np.array_equal(reader.run(4, ['OBS_p53', 'OBS_MPF']),
+                          np.array([runs[4]['OBS_p53'][::2], runs[4]['OBS_MPF'][::2]]))
+    with pytest.raises(KeyError):
+        reader['OBS_CycE']
+
+
+def test_partial_store_is_readable(tmpdir):
+    path = str(tmpdir.join('store'))
+    writer = TrajectoryWriter(path, np.arange(5), ['a'], chunk_size=2)
+    for run in _runs(3, 5, ['a']):
+        writer.append(run)
+    assert len(TrajectoryReader(path)) == 2  # only complete chunks are visible
+    writer.close()
+    assert len(TrajectoryReader(path)) == 3
+    with pytest.raises(IOError):
+        TrajectoryWriter(path, np.arange(5), ['a'])
+
+
+def test_select_observables():
+    yobs = {'a': np.arange(10.0), 'b': -np.arange(10.0)}
+    assert select_observables(yobs, ['b', 'a'], 3).tolist() == [[0, 0], [-3, 3], [-6, 6], [-9, 9]]
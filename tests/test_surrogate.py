@@ -0,0 +1,56 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+from cell_cycle_surrogate import FEATURES, FateSurrogate, _GP, summarize
+
+from .systems import THRESHOLDS, oscillator
+
+TSPAN = np.linspace(0, 60, 241)
+
+
+def test_gp_interpolates_smooth_function():
+    rng = np.random.RandomState(0)
+    X = rng.rand(40, 2)
+    f = lambda X: np.sin(3 * X[:, 0]) + X[:, 1] ** 2
+    gp = _GP(X, f(X), noise=1e-8)
+    Xs = rng.rand(20, 2) * 0.8 + 0.1
+    mean, std = gp.predict(Xs)
+    assert np.abs(mean - f(Xs)).max() < 0.02
+    assert np.allclose(gp.predict(X)[1], 0.0, atol=1e-3)
+    assert (std >= 0).all()
+
+
+def test_summarize_matches_classifier():
+    system = oscillator()
+    from cell_cycle_integrate import integrate
+    y, _ = integrate(system, TSPAN)
+    rows = [system.observable_index(n) for n in ('OBS_MPF', 'OBS_APC_Ccdc20', 'OBS_p53',
+                                                  'OBS_CycE')]
+    fate, features = summarize(system, TSPAN, system.observables(y)[:, rows].T, THRESHOLDS)
+    assert fate == 'divided' and len(features) == len(FEATURES)
+    assert features[1] == 0.0  # no p53 without damage
+
+
+@pytest.fixture(scope='module')
+def surrogate():
+    system = oscillator()
+    return FateSurrogate.train(system, TSPAN, ['DDS_0'], [(0.0, 1.0)], n=24, processes=1,
+                               thresholds=THRESHOLDS)
+
+
+def test_surrogate_separates_fates(surrogate):
+    prediction = surrogate.predict([[0.0], [0.9]])
+    assert list(prediction.fate) == ['divided', 'apoptotic']
+    assert (prediction.uncertainty < 0.2).all()
+
+
+def test_query_simulates_when_uncertain_and_learns(surrogate):
+    n = len(surrogate.X)
+    x = [float(np.mean(surrogate.X[np.argsort(abs(surrogate.X[:, 0] - 0.05))[:2], 0]))]
+    answer = surrogate.query(x, max_uncertainty=0.0)
+    assert answer.simulated and len(surrogate.X) == n + 1
+    assert answer.fate == surrogate.simulate(x)[0]
+    confident = surrogate.query([0.9], max_uncertainty=1.0)
+    assert not confident.simulated and len(surrogate.X) == n + 1
@@ -0,0 +1,58 @@
+from __future__ import division
+
+import os
+
+import numpy as np
+
+from cell_cycle_integrate import add_stats, integrate
+from cell_cycle_store import TrajectoryReader, TrajectoryWriter
+from cell_cycle_sweep import sweep_dna_damage, sweep_parameters
+
+from .systems import oscillator
+
+TSPAN = np.linspace(0, 30, 121)
+LEVELS = (0.0, 0.3, 0.6)
+
+
+def test_sweep_runs_integrate():
+    system = oscillator()
+    yobs = sweep_dna_damage(system, TSPAN, LEVELS, processes=1, rtol=1e-8)
+    assert yobs.shape == (len(LEVELS), len(TSPAN))
+    for i, level in enumerate(LEVELS):
+        y, _ = integrate(system, TSPAN, system.parameter_vector({'DDS_0': level}), rtol=1e-8)
+        assert np.array_equal(yobs['OBS_p53'][i], y[:, system.species_names.index('P')])
+
+
+def test_pool_matches_serial_and_streams_to_writer(tmpdir):
+    system = oscillator()
+    overrides = [{'DDS_0': level, 'b': b} for level in LEVELS for b in (2.5, 3.0)]
+    serial = sweep_parameters(system, TSPAN, overrides, processes=1)
+    pooled = sweep_parameters(system, TSPAN, overrides, processes=2)
+    assert np.array_equal(serial['OBS_MPF'], pooled['OBS_MPF'])
+
+    path = os.path.join(str(tmpdir), 'store')
+    with TrajectoryWriter(path, TSPAN, ['OBS_MPF'], decimation=2, chunk_size=4,
+                          n_params=system.n_parameters) as writer:
+        assert sweep_parameters(system, TSPAN, overrides, processes=2, writer=writer) is writer
+    reader = TrajectoryReader(path)
+    assert np.array_equal(reader['OBS_MPF'], serial['OBS_MPF'][:, ::2])
+    assert np.array_equal(reader['__params__'], system.parameter_matrix(overrides))
+
+
+def test_initial_states_per_run():
+    system = oscillator()
+    y0 = [system.initial_values() * scale for scale in (1.0, 2.0)]
+    yobs = sweep_parameters(system, TSPAN, [{}, {}], processes=1, y0=y0)
+    assert yobs['OBS_MPF'][0, 0] == 1.0 and yobs['OBS_MPF'][1, 0] == 2.0
+
+
+def test_solver_counters_are_summed_over_runs():
+    system = oscillator()
+    overrides = [{'DDS_0': level} for level in LEVELS]
+    stats = {}
+    sweep_parameters(system, TSPAN, overrides, processes=2, stats=stats, method='lsoda')
+    expected = {}
+    for o in overrides:
+        add_stats(expected, integrate(system, TSPAN, system.parameter_vector(o),
+                                      method='lsoda')[1])
+    assert stats == expected and stats['nfev'] > 0
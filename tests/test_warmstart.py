@@ -0,0 +1,60 @@
+from __future__ import division
+
+import numpy as np
+import pytest
+
+import cell_cycle_memo
+import cell_cycle_warmstart
+from cell_cycle_integrate import integrate
+from cell_cycle_memo import ResultCache
+from cell_cycle_warmstart import relaxed_state, warm_integrate, warm_sweep_dna_damage
+
+from .systems import oscillator
+
+TSPAN = np.linspace(0, 20, 81)
+LEVELS = (0.0, 0.6)
+
+
+@pytest.fixture(autouse=True)
+def cache(tmpdir, monkeypatch):
+    cache = ResultCache(str(tmpdir))
+    monkeypatch.setattr(cell_cycle_memo, '_default_cache', cache)
+    return cache
+
+
+def test_relaxed_state_is_on_the_cycle_and_cached(cache):
+    system = oscillator()
+    cycle = relaxed_state(system, relax_time=100.0)
+    assert abs(cycle.period - 7.15) < 0.1
+    again = relaxed_state(system, relax_time=100.0)
+    assert np.array_equal(again.state, cycle.state) and again.period == cycle.period
+
+
+@pytest.mark.parametrize('burn_in', [0.0, 5.0])
+def test_warm_sweep_matches_warm_integrate(burn_in):
+    system = oscillator()
+    yobs = warm_sweep_dna_damage(system, TSPAN, LEVELS, relax_time=100.0, burn_in=burn_in,
+                                 processes=1)
+    cycle = relaxed_state(system, system.parameter_vector({'DDS_0': 0.0}), 100.0)
+    for i, level in enumerate(LEVELS):
+        y, _ = warm_integrate(system, TSPAN, system.parameter_vector({'DDS_0': level}), cycle,
+                              burn_in=burn_in)
+        assert np.allclose(yobs['OBS_MPF'][i], y[:, 0])
+        assert yobs['OBS_p53'][i, 0] == 0.0
+    if burn_in:
+        plain = warm_sweep_dna_damage(system, TSPAN, LEVELS, relax_time=100.0, processes=1)
+        assert not np.allclose(plain['OBS_MPF'][0], yobs['OBS_MPF'][0])
+
+
+def test_warm_sweep_relaxes_with_the_solver_options(monkeypatch):
+    calls = []
+
+    def recording(*args, **kwargs):
+        calls.append(kwargs)
+        return integrate(*args, **kwargs)
+
+    monkeypatch.setattr(cell_cycle_warmstart, 'integrate', recording)
+    warm_sweep_dna_damage(oscillator(), TSPAN, LEVELS, relax_time=100.0, burn_in=5.0,
+                          processes=1, method='lsoda', rtol=1e-9)
+    assert calls
+    assert all(c.get('method') == 'lsoda' and c.get('rtol') == 1e-9 for c in calls)